@@ -0,0 +1,295 @@
+import json
+import logging
+import os
+import threading
+from bisect import bisect_right
+from collections import OrderedDict
+from datetime import datetime, time, timedelta
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 运营日从 04:00 开始，此前的时刻（末班车过零点）计入前一运营日
+SERVICE_DAY_START = 4 * 60
+DAY_MINUTES = 24 * 60
+# 默认全天 5 分钟一班（与原先的固定间隔相同）；可用 SMARTMETRO_HEADWAY_PROFILE 覆盖，
+# 格式为 "起始时刻=间隔分钟" 逗号分隔，如 "05:00=6,07:00=3,09:30=5,17:00=3,19:30=5,22:00=8"
+DEFAULT_HEADWAY_PROFILE = '04:00=5'
+# 同时缓存的已编译运营日数（不同星期、节假日前一天的末班车延时不同）
+MAX_COMPILED_DAYS = 4
+
+# 各站分方向的首班车，末班车取 line_schedule 中同一线路、站点、方向的记录
+TIMETABLE_QUERY = """
+    SELECT f.line_id, f.station_id, f.station_name, f.direction_desc, f.first_arrival_time,
+           ls.last_time, ls.last_time_desc
+    FROM first_train_arrival f
+    LEFT JOIN (
+        SELECT line, stat_id, description, MAX(last_time) AS last_time, MAX(last_time_desc) AS last_time_desc
+        FROM line_schedule
+        GROUP BY line, stat_id, description
+    ) ls ON ls.line = f.line_id AND ls.stat_id = f.station_id AND ls.description = f.direction_desc
+    ORDER BY f.id
+"""
+
+LINE_STATIONS_QUERY = """
+    SELECT line AS line_id, station_id, name_cn AS station_name, station_order
+    FROM all_stations
+    WHERE line IS NOT NULL
+    ORDER BY line, station_order
+"""
+
+
+def _minutes(value):
+    """TIME 列（timedelta / time / 'HH:MM:SS'）转为运营日内的分钟数，过零点的时刻加 24 小时"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, timedelta):
+        total = int(value.total_seconds() // 60)
+    elif isinstance(value, time):
+        total = value.hour * 60 + value.minute
+    else:
+        hour, minute = str(value).split(':')[:2]
+        total = int(hour) * 60 + int(minute)
+    total %= DAY_MINUTES
+    if total < SERVICE_DAY_START:
+        total += DAY_MINUTES
+    return total
+
+
+def _clock(minutes):
+    """运营日内的分钟数转为 'HH:MM:SS'"""
+    minutes %= DAY_MINUTES
+    return f"{minutes // 60:02d}:{minutes % 60:02d}:00"
+
+
+def service_day(moment):
+    """返回 (运营日日期, 运营日内的分钟数，不足一分钟的部分舍去)"""
+    minutes = moment.hour * 60 + moment.minute
+    if minutes < SERVICE_DAY_START:
+        return moment.date() - timedelta(days=1), minutes + DAY_MINUTES
+    return moment.date(), minutes
+
+
+def parse_headway_profile(text):
+    """解析 "HH:MM=分钟,..."，返回按运营日分钟排序的 [(起始分钟, 间隔), ...]"""
+    profile = []
+    for item in (text or '').split(','):
+        if not item.strip():
+            continue
+        clock, headway = item.split('=')
+        headway = int(headway)
+        if headway <= 0:
+            raise ValueError(f"发车间隔必须为正数: {item}")
+        profile.append((_minutes(clock.strip()), headway))
+    if not profile:
+        raise ValueError("发车间隔配置为空")
+    profile.sort()
+    # 第一个时段之前沿用最后一个时段的间隔（跨运营日开始时刻）
+    return [(0, profile[-1][1])] + profile
+
+
+def _last_time_adjust(desc, service_date):
+    """
+    解析 last_time_desc，返回该运营日末班车的延时分钟数
+    weekday 数组以周日为 0，dateday 为节假日前一天等按日期的延时
+    """
+    if not desc:
+        return 0
+    try:
+        rule = json.loads(desc)
+    except ValueError:
+        return 0
+    weekday = service_date.isoweekday() % 7
+    mmdd = service_date.strftime('%m-%d')
+    adjust = 0
+    weekdays = rule.get('weekday') or []
+    if weekday < len(weekdays):
+        adjust = int(weekdays[weekday] or 0)
+    for item in rule.get('dateday') or []:
+        if item.get('date') == mmdd:
+            adjust = max(adjust, int(item.get('adjust') or 0))
+    return adjust
+
+
+class _CompiledDay:
+    """
+    某个运营日全部 (线路, 站点, 方向) 的到站时刻
+
+    各方向的时刻按编号首尾相接存放在一个数组中，第 k 个方向的时刻为 times[starts[k]:starts[k + 1]]；
+    查询时以 k * 2 天 + 分钟数为键在 keyed 上二分，一批方向的下一班车为一次 searchsorted。
+    """
+
+    def __init__(self, firsts, lasts, profile):
+        bounds = [start for start, _ in profile]
+        headways = [headway for _, headway in profile]
+        # 从首班车开始按所处时段的间隔逐班推算，跨时段时从上一班车开始按新间隔发车
+        chunks = []
+        counts = np.zeros(len(firsts), dtype=np.int64)
+        for k, (first, last) in enumerate(zip(firsts, lasts)):
+            if first < 0:
+                continue
+            times = []
+            current = first
+            while current <= last:
+                times.append(current)
+                current += headways[bisect_right(bounds, current) - 1]
+            chunks.append(np.array(times, dtype=np.int64))
+            counts[k] = len(times)
+        self.times = np.concatenate(chunks) if chunks else np.array([], dtype=np.int64)
+        self.starts = np.r_[0, np.cumsum(counts)]
+        self.keyed = self.times + np.repeat(np.arange(len(firsts), dtype=np.int64), counts) * 2 * DAY_MINUTES
+
+    def next_departures(self, indexes, now_minutes):
+        """indexes 各方向在 now_minutes（运营日分钟，当前这一分钟的车视为已开出）之后的第一班车，当天已无车次的为 -1"""
+        indexes = np.asarray(indexes, dtype=np.int64)
+        found = np.searchsorted(self.keyed, indexes * 2 * DAY_MINUTES + now_minutes, side='right')
+        valid = found < self.starts[indexes + 1]
+        return np.where(valid, self.times[np.minimum(found, len(self.times) - 1)] if len(self.times) else -1, -1)
+
+
+class ArrivalTimetable:
+    """
+    到站时刻引擎：由 first_train_arrival 的首班车、line_schedule 的末班车（按星期与节假日延时）
+    和分时段的发车间隔编译出每个 (线路, 站点, 方向) 当天的全部车次
+
+    编译在每个运营日首次查询时进行一次，之后查询下一班车为二分查找，整条线路的看板为一次数组运算，
+    请求中不访问数据库，也不逐行解析时间。首班车时刻在各天相同，当天末班车已过时下一班为次日首班车。
+    """
+
+    def __init__(self, entries, line_stations, headway_profile=DEFAULT_HEADWAY_PROFILE):
+        self.entries = entries              # [{line_id, station_id, station_name, direction_desc, first_arrival_time}, ...]
+        self.line_stations = line_stations  # line_id -> [(all_stations 行, 方向编号或 None), ...]
+        self.profile = parse_headway_profile(headway_profile)
+        self._firsts = np.array([entry['_first'] for entry in entries], dtype=np.int64)
+        self._lasts = [entry['_last'] for entry in entries]
+        self._last_descs = [entry['_last_desc'] for entry in entries]
+        self._compiled = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, get_connection, headway_profile=None):
+        conn = None
+        cursor = None
+        try:
+            conn = get_connection()
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute(TIMETABLE_QUERY)
+            timetable_rows = cursor.fetchall()
+            cursor.execute(LINE_STATIONS_QUERY)
+            station_rows = cursor.fetchall()
+        finally:
+            if cursor:
+                cursor.close()
+            if conn:
+                conn.close()
+        if headway_profile is None:
+            headway_profile = os.environ.get('SMARTMETRO_HEADWAY_PROFILE', DEFAULT_HEADWAY_PROFILE)
+        return cls.from_rows(timetable_rows, station_rows, headway_profile)
+
+    @classmethod
+    def from_rows(cls, timetable_rows, station_rows, headway_profile=DEFAULT_HEADWAY_PROFILE):
+        entries = []
+        by_station = {}
+        for row in timetable_rows:
+            first = _minutes(row['first_arrival_time'])
+            last = _minutes(row.get('last_time'))
+            entry = {
+                'line_id': row['line_id'],
+                'station_id': row['station_id'],
+                'station_name': row['station_name'],
+                'direction_desc': row['direction_desc'],
+                'first_arrival_time': _clock(first) if first is not None else None,
+                '_first': -1 if first is None else first,
+                # 没有末班车记录时运营到运营日结束
+                '_last': SERVICE_DAY_START + DAY_MINUTES - 1 if last is None else last,
+                '_last_desc': row.get('last_time_desc')
+            }
+            by_station.setdefault((row['line_id'], row['station_id']), []).append(len(entries))
+            entries.append(entry)
+
+        line_stations = {}
+        for row in station_rows:
+            indexes = by_station.get((row['line_id'], row['station_id'])) or [None]
+            stations = line_stations.setdefault(row['line_id'], [])
+            for index in indexes:
+                stations.append((row, index))
+        logger.info(f"到站时刻表已加载: {len(entries)} 个站点方向, {len(line_stations)} 条线路")
+        return cls(entries, line_stations, headway_profile)
+
+    def compiled(self, service_date):
+        """某个运营日的车次（按需编译并缓存）"""
+        with self._lock:
+            day = self._compiled.get(service_date)
+            if day is not None:
+                self._compiled.move_to_end(service_date)
+                return day
+        lasts = [last + _last_time_adjust(desc, service_date) for last, desc in zip(self._lasts, self._last_descs)]
+        day = _CompiledDay(self._firsts, lasts, self.profile)
+        with self._lock:
+            self._compiled[service_date] = day
+            while len(self._compiled) > MAX_COMPILED_DAYS:
+                self._compiled.popitem(last=False)
+        return day
+
+    def next_arrivals(self, indexes, now=None):
+        """
+        各方向的下一班车，返回 (下一班 'HH:MM:SS' 列表, 剩余分钟列表)；没有首班车的方向为 (None, 0)
+        """
+        service_date, minutes = service_day(now or datetime.now())
+        indexes = np.asarray(indexes, dtype=np.int64)
+        if not len(indexes):
+            return [], []
+        next_times = self.compiled(service_date).next_departures(indexes, minutes)
+        firsts = self._firsts[indexes]
+        # 当天已无车次时为次日首班车
+        next_times = np.where(next_times < 0, firsts + DAY_MINUTES, next_times)
+        return (
+            [_clock(t) if first >= 0 else None for t, first in zip(next_times.tolist(), firsts.tolist())],
+            [t - minutes if first >= 0 else 0 for t, first in zip(next_times.tolist(), firsts.tolist())]
+        )
+
+    def line_board(self, line_id, now=None):
+        """整条线路各站各方向的下一班车（与 /api/arrival-time/line 的响应相同），线路不存在时返回 None"""
+        stations = self.line_stations.get(line_id)
+        if not stations:
+            return None
+        indexes = [index for _, index in stations if index is not None]
+        next_times, remaining = self.next_arrivals(indexes, now)
+        next_times, remaining = iter(next_times), iter(remaining)
+        board = []
+        for row, index in stations:
+            entry = self.entries[index] if index is not None else None
+            board.append({
+                'line_id': row['line_id'],
+                'station_id': row['station_id'],
+                'station_name': row['station_name'],
+                'station_order': row['station_order'],
+                'direction_desc': entry['direction_desc'] if entry else None,
+                'first_arrival_time': entry['first_arrival_time'] if entry else None,
+                'line_name': f"{row['line_id']}号线",
+                'next_arrival_time': next(next_times) if entry else None,
+                'minutes_remaining': next(remaining) if entry else 0
+            })
+        return board
+
+    def search(self, query, limit=10, now=None):
+        """站名包含 query 的站点各方向的下一班车（与 /api/arrival-time/search 的响应相同）"""
+        indexes = [k for k, entry in enumerate(self.entries) if query in (entry['station_name'] or '')][:limit]
+        next_times, remaining = self.next_arrivals(indexes, now)
+        _, minutes = service_day(now or datetime.now())
+        results = []
+        for k, next_time, left in zip(indexes, next_times, remaining):
+            entry = self.entries[k]
+            results.append({
+                'line_id': entry['line_id'],
+                'station_id': entry['station_id'],
+                'station_name': entry['station_name'],
+                'direction_desc': entry['direction_desc'],
+                'first_arrival_time': entry['first_arrival_time'],
+                'minutes_passed': minutes - entry['_first'] if entry['_first'] >= 0 else 0,
+                'line_name': f"{entry['line_id']}号线",
+                'next_arrival_time': next_time,
+                'minutes_remaining': left
+            })
+        return results
@@ -1,8 +1,8 @@
 from flask import jsonify, request
 import logging
 import mysql.connector
-from datetime import datetime, timedelta
 import random
+from arrival_timetable import ArrivalTimetable
 
 logger = logging.getLogger(__name__)
 
@@ -129,77 +129,23 @@ def register_routes(app, station_graph):
             logger.error(f"Error in get_nearest_stations: {str(e)}")
             return jsonify({'error': str(e)}), 500
 
-    @app.route('/api/arrival-time/line/<int:line_id>', methods=['GET'])
-    def get_line_stations_arrival_time(line_id):
-        try:
-            conn = get_connection()
-            cursor = conn.cursor(dictionary=True)
-
-            # 获取当前时间
-            now = datetime.now()
-            current_time = now.time()
-            current_date = now.date()
-
-            # 获取该线路所有站点的首班车时间
-            query = """
-                SELECT 
-                    s.line as line_id,
-                    s.station_id,
-                    s.station_name,
-                    s.station_order,
-                    fta.direction_desc,
-                    TIME_FORMAT(fta.first_arrival_time, '%H:%i:%s') as first_arrival_time,
-                    CONCAT(s.line, '号线') as line_name
-                FROM (
-                    SELECT 
-                        line,
-                        station_id,
-                        name_cn as station_name,
-                        path_id,
-                        station_order
-                    FROM all_stations
-                    WHERE line = %(line_id)s
-                ) s
-                LEFT JOIN first_train_arrival fta ON s.line = fta.line_id 
-                    AND s.station_id = fta.station_id
-                ORDER BY s.station_order
-            """
-            cursor.execute(query, {'line_id': line_id})
-
-            arrivals = cursor.fetchall()
-            cursor.close()
-            conn.close()
+    # 到站时刻引擎：首班车、末班车与分时段发车间隔在内存中编译，加载失败时在首次查询时重试
+    timetable = {}
 
-            for arrival in arrivals:
-                logger.info(f"Processing arrival: {arrival}")
-                if arrival['first_arrival_time']:
-                    first_time_str = arrival['first_arrival_time']
-                    first_time = datetime.strptime(first_time_str, '%H:%M:%S').time()
+    def get_arrival_timetable():
+        if 'engine' not in timetable:
+            timetable['engine'] = ArrivalTimetable.load(get_connection)
+        return timetable['engine']
 
-                    logger.info(f"First time string: {first_time_str}")
-                    logger.info(f"Current time: {current_time}")
+    try:
+        get_arrival_timetable()
+    except Exception as e:
+        logger.error(f"Error loading arrival timetable: {str(e)}")
 
-                    # 计算时间差（分钟）
-                    first_datetime = datetime.combine(current_date, first_time)
-                    current_datetime = datetime.combine(current_date, current_time)
-
-                    if first_time < current_time:
-                        # 首班车已过，计算到下一班车的时间
-                        minutes_passed = int((current_datetime - first_datetime).total_seconds() / 60)
-                        next_arrival = (minutes_passed // 5 + 1) * 5
-                        arrival['next_arrival_time'] = (first_datetime + timedelta(minutes=next_arrival)).strftime(
-                            '%H:%M:%S')
-                        arrival['minutes_remaining'] = next_arrival - minutes_passed
-                    else:
-                        # 首班车还没到
-                        minutes_remaining = int((first_datetime - current_datetime).total_seconds() / 60)
-                        arrival['next_arrival_time'] = first_time_str
-                        arrival['minutes_remaining'] = minutes_remaining
-                else:
-                    arrival['next_arrival_time'] = None
-                    arrival['minutes_remaining'] = 0
-
-            return jsonify(arrivals)
+    @app.route('/api/arrival-time/line/<int:line_id>', methods=['GET'])
+    def get_line_stations_arrival_time(line_id):
+        try:
+            return jsonify(get_arrival_timetable().line_board(line_id) or [])
 
         except Exception as e:
             logger.error(f"Error in get_line_stations_arrival_time: {str(e)}")
@@ -212,62 +158,8 @@ def register_routes(app, station_graph):
             if not query:
                 return jsonify([])
 
-            conn = get_connection()
-            cursor = conn.cursor(dictionary=True)
-
-            # 搜索站点
-            search_query = f"%{query}%"
-            cursor.execute("""
-                SELECT DISTINCT
-                    f.line_id,
-                    f.station_id,
-                    f.station_name,
-                    f.direction_desc,
-                    TIME_FORMAT(f.first_arrival_time, '%H:%i:%s') as first_arrival_time,
-                    COALESCE(TIMESTAMPDIFF(MINUTE, 
-                        TIMESTAMP(CURRENT_DATE(), f.first_arrival_time),
-                        CURRENT_TIMESTAMP()), 0) as minutes_passed,
-                    CONCAT(f.line_id, '号线') as line_name
-                FROM first_train_arrival f
-                WHERE f.station_name LIKE %(search_query)s
-                LIMIT 10
-            """, {'search_query': search_query})
-
-            arrivals = cursor.fetchall()
-            cursor.close()
-            conn.close()
-
-            # 处理到达时间数据
-            for arrival in arrivals:
-                logger.info(f"Processing arrival: {arrival}")
-                minutes_passed = int(float(arrival['minutes_passed']))
-                logger.info(f"Minutes passed: {minutes_passed}")
-
-                if minutes_passed < 0:
-                    # 首班车还没到
-                    arrival['next_arrival_time'] = arrival['first_arrival_time']
-                    arrival['minutes_remaining'] = abs(minutes_passed)
-                else:
-                    # 首班车已过，计算到下一班车的时间
-                    next_arrival = (minutes_passed // 5 + 1) * 5
-                    try:
-                        # 将字符串时间转换为time对象
-                        first_time = datetime.strptime(arrival['first_arrival_time'], '%H:%M:%S').time()
-                        first_time_dt = datetime.combine(datetime.now().date(), first_time)
-                        next_time = first_time_dt + timedelta(minutes=next_arrival)
-                        arrival['next_arrival_time'] = next_time.strftime('%H:%M:%S')
-                        arrival['minutes_remaining'] = next_arrival - minutes_passed
-                    except Exception as e:
-                        logger.error(f"Error processing time: {str(e)}")
-                        arrival['next_arrival_time'] = arrival['first_arrival_time']
-                        arrival['minutes_remaining'] = 0
-
-                    # 如果剩余时间小于0，说明是明天的首班车
-                    if arrival['minutes_remaining'] < 0:
-                        arrival['minutes_remaining'] = 24 * 60 + arrival['minutes_remaining']
-
-            return jsonify(arrivals)
+            return jsonify(get_arrival_timetable().search(query))
 
         except Exception as e:
             logger.error(f"Error in search_stations: {str(e)}")
-            return jsonify({'error': str(e)}), 500
\ No newline at end of file
+            return jsonify({'error': str(e)}), 500
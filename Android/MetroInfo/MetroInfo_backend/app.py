@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, json
 from flask_cors import CORS
 import mysql.connector
 from mysql.connector import pooling
@@ -6,7 +6,9 @@ import math
 import logging
 from functools import wraps
 import heapq
-from datetime import datetime, timedelta
+from itertools import count
+from route_cache import RouteCache
+from arrival_timetable import ArrivalTimetable
 
 # 配置日志
 logging.basicConfig(level=logging.DEBUG)
@@ -308,7 +310,7 @@ class StationGraph:
                 # 构建图结构
                 if from_node not in self.graph:
                     self.graph[from_node] = []
-                self.graph[from_node].append((to_node, time))
+                self.graph[from_node].append((to_node, time, line_id))
                 
                 # 存储连接信息
                 self.connections[(from_node, to_node)] = {
@@ -319,7 +321,7 @@ class StationGraph:
                 # 添加反向关系
                 if to_node not in self.graph:
                     self.graph[to_node] = []
-                self.graph[to_node].append((from_node, time))
+                self.graph[to_node].append((from_node, time, line_id))
                 self.connections[(to_node, from_node)] = {
                     'line_id': line_id,
                     'time': time
@@ -349,42 +351,50 @@ class StationGraph:
                 return None
             if start_group not in self.graph or end_group not in self.graph:
                 return None
-            
-            # Heap (总时间, 当前节点, 路径, 当前线路)
-            heap = [(0, start_group, [], None)]
-            visited = set()
-                
+
+            # 状态为 (站点, 当前线路)，换乘代价计入边权；路径通过父指针回溯
+            start = (start_group, None)
+            dist = {start: 0}
+            parent = {start: None}
+            tie = count()
+            # Heap (总时间, 序号, 当前节点, 当前线路)
+            heap = [(0, next(tie), start_group, None)]
+
             while heap:
-                (total_time, current, path, current_line) = heapq.heappop(heap)
-            
-                if current in visited:
+                (total_time, _, current, current_line) = heapq.heappop(heap)
+                state = (current, current_line)
+                if total_time > dist[state]:
                     continue
-                    
-                visited.add(current)
-                path = path + [current]
-            
+
                 if current == end_group:
+                    path, lines, times = [], [], []
+                    while parent[state] is not None:
+                        prev_state, time = parent[state]
+                        path.append(state[0])
+                        lines.append(state[1])
+                        times.append(time)
+                        state = prev_state
+                    path.append(start_group)
                     return {
-                        'path': path,
+                        'path': path[::-1],
+                        'lines': lines[::-1],
+                        'times': times[::-1],
                         'total_time': total_time
                     }
-                
-                for neighbor, time in self.graph.get(current, []):
-                    if neighbor not in visited:
-                        # 获取连接信息
-                        conn_info = self.connections.get((current, neighbor))
-                        if not conn_info:
-                            continue
-                            
-                        new_line = conn_info['line_id']
-                        new_total_time = total_time + time
-                        
-                        # 检查是否换乘（线路变更且不是初始状态）
-                        if current_line is not None and new_line != current_line:
-                            new_total_time += 5  # 增加换乘时间
-                        
-                        heapq.heappush(heap, (new_total_time, neighbor, path, new_line))
-                            
+
+                for neighbor, time, new_line in self.graph.get(current, []):
+                    new_total_time = total_time + time
+
+                    # 检查是否换乘（线路变更且不是初始状态）
+                    if current_line is not None and new_line != current_line:
+                        new_total_time += 5  # 增加换乘时间
+
+                    next_state = (neighbor, new_line)
+                    if new_total_time < dist.get(next_state, float('inf')):
+                        dist[next_state] = new_total_time
+                        parent[next_state] = (state, time)
+                        heapq.heappush(heap, (new_total_time, next(tie), neighbor, new_line))
+
             return None
         except Exception as e:
             logger.error(f"Dijkstra算法执行出错: {str(e)}", exc_info=True)
@@ -399,6 +409,10 @@ except Exception as e:
     logger.error(f"初始化地铁图结构失败: {str(e)}")
     raise
 
+# 路线响应缓存：图结构在进程内只构建一次，键中的模式固定为 fastest、图版本为 None
+dijkstra_cache = RouteCache()
+route_cache = RouteCache()
+
 @app.route('/Dijkstra', methods=['GET'])
 @handle_errors
 def find_shortest_path():
@@ -422,6 +436,11 @@ def find_shortest_path():
             'end_station': to_station
         }), 400
         
+    cache_key = (start_group, end_group, 'fastest', None)
+    body = dijkstra_cache.get(cache_key)
+    if body is not None:
+        return Response(body, mimetype='application/json')
+        
     result = station_graph.dijkstra_shortest_path(start_group, end_group)
     
     if not result:
@@ -441,13 +460,9 @@ def find_shortest_path():
         current = result['path'][i]
         next_node = result['path'][i+1]
         
-        # 获取连接信息
-        conn_info = station_graph.connections.get((current, next_node))
-        if not conn_info:
-            continue
-            
-        line_id = conn_info['line_id']
-        segment_time = conn_info['time']
+        # 线路与区段时间取自搜索结果（共线区段在 connections 中只保留一条线路）
+        line_id = result['lines'][i]
+        segment_time = result['times'][i]
         
         # 检查是否换乘
         if previous_line is not None and line_id != previous_line:
@@ -474,7 +489,7 @@ def find_shortest_path():
             'transfer': False
         })
     
-    return jsonify({
+    body = json.dumps({
         'success': True,
         'data': {
             'path': formatted_path,
@@ -483,7 +498,9 @@ def find_shortest_path():
             'to_station': station_graph.station_info.get(end_group, {'cn': '未知', 'en': 'Unknown'}),
             'transfer_count': len([p for p in formatted_path if p.get('transfer')])
         }
-    })
+    }).encode('utf-8')
+    dijkstra_cache.put(cache_key, body)
+    return Response(body, mimetype='application/json')
 
 # 所有站点API
 @app.route('/api/stations', methods=['GET'])
@@ -515,145 +532,37 @@ def get_all_stations():
         cursor.close()
         conn.close()
 
+# 到站时刻引擎：首班车、末班车与分时段发车间隔在内存中编译，加载失败时在首次查询时重试
+arrival_timetable = None
+
+def get_arrival_timetable():
+    global arrival_timetable
+    if arrival_timetable is None:
+        arrival_timetable = ArrivalTimetable.load(get_db_connection)
+    return arrival_timetable
+
+try:
+    get_arrival_timetable()
+except Exception as e:
+    logger.error(f"加载到站时刻表失败: {str(e)}", exc_info=True)
+
 # 获取线路站点到达时间
 @app.route('/api/arrival-time/line/<int:line_id>', methods=['GET'])
 @handle_errors
 def get_line_stations_arrival_time(line_id):
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-    current_time = datetime.now().time()
-    current_date = datetime.now().date()
-    
-    try:
-        # 修改查询语句，不使用sequence列，使用path_id和station_order替代
-        query = """
-            SELECT 
-                s.line as line_id,
-                s.station_id,
-                s.station_name,
-                s.station_order,
-                fta.direction_desc,
-                TIME_FORMAT(fta.first_arrival_time, '%H:%i:%s') as first_arrival_time,
-                CONCAT(s.line, '号线') as line_name
-            FROM (
-                SELECT 
-                    line,
-                    station_id,
-                    name_cn as station_name,
-                    path_id,
-                    station_order
-                FROM all_stations
-                WHERE line = %(line_id)s
-            ) s
-            LEFT JOIN first_train_arrival fta ON s.line = fta.line_id 
-                AND s.station_id = fta.station_id
-            ORDER BY s.station_order
-        """
-        cursor.execute(query, {'line_id': line_id})
-
-        arrivals = cursor.fetchall()
-        if not arrivals:
-            return jsonify({'error': 'No stations found for this line'}), 404
-
-        for arrival in arrivals:
-            if arrival['first_arrival_time']:
-                first_time_str = arrival['first_arrival_time']
-                first_time = datetime.strptime(first_time_str, '%H:%M:%S').time()
-
-                # 计算时间差（分钟）
-                first_datetime = datetime.combine(current_date, first_time)
-                current_datetime = datetime.combine(current_date, current_time)
-
-                if first_time < current_time:
-                    # 首班车已过，计算到下一班车的时间
-                    minutes_passed = int((current_datetime - first_datetime).total_seconds() / 60)
-                    next_arrival = (minutes_passed // 5 + 1) * 5
-                    arrival['next_arrival_time'] = (first_datetime + timedelta(minutes=next_arrival)).strftime('%H:%M:%S')
-                    arrival['minutes_remaining'] = next_arrival - minutes_passed
-                else:
-                    # 首班车还没到
-                    minutes_remaining = int((first_datetime - current_datetime).total_seconds() / 60)
-                    arrival['next_arrival_time'] = first_time_str
-                    arrival['minutes_remaining'] = minutes_remaining
-            else:
-                arrival['next_arrival_time'] = None
-                arrival['minutes_remaining'] = 0
-
-        return jsonify(arrivals)
-        
-    finally:
-        cursor.close()
-        conn.close()
+    arrivals = get_arrival_timetable().line_board(line_id)
+    if not arrivals:
+        return jsonify({'error': 'No stations found for this line'}), 404
+    return jsonify(arrivals)
 
 # 搜索站点到达时间
 @app.route('/api/arrival-time/search', methods=['GET'])
 @handle_errors
 def search_stations():
-    try:
-        query = request.args.get('q', '')
-        if not query:
-            return jsonify([])
-
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-
-        # 搜索站点
-        search_query = f"%{query}%"
-        cursor.execute("""
-            SELECT DISTINCT
-                f.line_id,
-                f.station_id,
-                f.station_name,
-                f.direction_desc,
-                TIME_FORMAT(f.first_arrival_time, '%H:%i:%s') as first_arrival_time,
-                COALESCE(TIMESTAMPDIFF(MINUTE, 
-                    TIMESTAMP(CURRENT_DATE(), f.first_arrival_time),
-                    CURRENT_TIMESTAMP()), 0) as minutes_passed,
-                CONCAT(f.line_id, '号线') as line_name
-            FROM first_train_arrival f
-            WHERE f.station_name LIKE %(search_query)s
-            LIMIT 10
-        """, {'search_query': search_query})
-
-        arrivals = cursor.fetchall()
-        if not arrivals:
-            return jsonify([])
-
-        # 处理到达时间数据
-        for arrival in arrivals:
-            minutes_passed = int(float(arrival['minutes_passed']))
-
-            if minutes_passed < 0:
-                # 首班车还没到
-                arrival['next_arrival_time'] = arrival['first_arrival_time']
-                arrival['minutes_remaining'] = abs(minutes_passed)
-            else:
-                # 首班车已过，计算到下一班车的时间
-                next_arrival = (minutes_passed // 5 + 1) * 5
-                try:
-                    # 将字符串时间转换为time对象
-                    first_time = datetime.strptime(arrival['first_arrival_time'], '%H:%M:%S').time()
-                    first_time_dt = datetime.combine(datetime.now().date(), first_time)
-                    next_time = first_time_dt + timedelta(minutes=next_arrival)
-                    arrival['next_arrival_time'] = next_time.strftime('%H:%M:%S')
-                    arrival['minutes_remaining'] = next_arrival - minutes_passed
-                except Exception as e:
-                    logger.error(f"Error processing time: {str(e)}")
-                    arrival['next_arrival_time'] = arrival['first_arrival_time']
-                    arrival['minutes_remaining'] = 0
-
-                # 如果剩余时间小于0，说明是明天的首班车
-                if arrival['minutes_remaining'] < 0:
-                    arrival['minutes_remaining'] = 24 * 60 + arrival['minutes_remaining']
-
-        return jsonify(arrivals)
-
-    except Exception as e:
-        logger.error(f"Error in search_stations: {str(e)}")
-        return jsonify({'error': str(e)}), 500
-    finally:
-        cursor.close()
-        conn.close()
+    query = request.args.get('q', '')
+    if not query:
+        return jsonify([])
+    return jsonify(get_arrival_timetable().search(query))
 
 @app.route('/api/route', methods=['POST'])
 @handle_errors
@@ -681,6 +590,11 @@ def find_route():
                 'message': '无效的车站名称'
             }), 400
             
+        cache_key = (start_group, end_group, 'fastest', None)
+        body = route_cache.get(cache_key)
+        if body is not None:
+            return Response(body, mimetype='application/json')
+            
         result = station_graph.dijkstra_shortest_path(start_group, end_group)
         if not result:
             return jsonify({
@@ -698,13 +612,9 @@ def find_route():
             current = result['path'][i]
             next_node = result['path'][i+1]
             
-            # 获取连接信息
-            conn_info = station_graph.connections.get((current, next_node))
-            if not conn_info:
-                continue
-                
-            line_id = conn_info['line_id']
-            travel_time = conn_info['time']
+            # 线路与区段时间取自搜索结果（共线区段在 connections 中只保留一条线路）
+            line_id = result['lines'][i]
+            travel_time = result['times'][i]
             
             # 检查是否换乘
             if previous_line is not None and line_id != previous_line:
@@ -744,7 +654,7 @@ def find_route():
                 'transfer': False
             })
         
-        return jsonify({
+        body = json.dumps({
             'success': True,
             'data': {
                 'total_time': cumulative_time,
@@ -752,7 +662,9 @@ def find_route():
                 'transfer_count': transfer_count
             },
             'message': 'Route found successfully'
-        })
+        }).encode('utf-8')
+        route_cache.put(cache_key, body)
+        return Response(body, mimetype='application/json')
         
     except Exception as e:
         logger.error(f"Error in find_route: {str(e)}")
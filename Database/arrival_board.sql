@@ -0,0 +1,15 @@
+--
+-- Table structure for table `arrival_board`
+-- 到站看板镜像（SMARTMETRO_ARRIVAL_BOARD_MIRROR=1 时由 Flask API 定期写入），每站每方向按 arrival_rank 排列
+--
+
+CREATE TABLE IF NOT EXISTS `arrival_board` (
+  `path_id` int NOT NULL,
+  `station_id` int NOT NULL,
+  `direction` varchar(4) NOT NULL,
+  `arrival_rank` tinyint NOT NULL,
+  `train_number` varchar(20) NOT NULL,
+  `expected_arrival_time` datetime NOT NULL,
+  `updated_at` datetime NOT NULL,
+  PRIMARY KEY (`path_id`,`station_id`,`direction`,`arrival_rank`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
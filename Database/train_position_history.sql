@@ -0,0 +1,32 @@
+--
+-- Table structure for table `train_position_history`
+-- 列车位置历史，只追加；按天分区，日分区由 Flask API 后台任务提前创建并在保留期后删除
+--
+
+CREATE TABLE IF NOT EXISTS `train_position_history` (
+  `id` bigint NOT NULL AUTO_INCREMENT,
+  `train_number` varchar(20) NOT NULL,
+  `station_id` int NOT NULL,
+  `next_station_id` int NOT NULL,
+  `timestamp` datetime NOT NULL,
+  `path_id` int NOT NULL,
+  PRIMARY KEY (`id`,`timestamp`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci
+PARTITION BY RANGE (TO_DAYS(`timestamp`)) (
+  PARTITION pmax VALUES LESS THAN MAXVALUE
+);
+
+--
+-- Table structure for table `segment_run_time`
+-- 每天每个区段每小时的运行时间中位数（上一站到站到下一站到站，含停站），由位置历史汇总
+--
+
+CREATE TABLE IF NOT EXISTS `segment_run_time` (
+  `service_date` date NOT NULL,
+  `from_station_id` int NOT NULL,
+  `to_station_id` int NOT NULL,
+  `hour` tinyint NOT NULL,
+  `median_seconds` float NOT NULL,
+  `samples` int NOT NULL,
+  PRIMARY KEY (`service_date`,`from_station_id`,`to_station_id`,`hour`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
@@ -1,9 +1,13 @@
+import argparse
 import requests
 import random
 from datetime import datetime, timedelta
 import time
 import json
 
+REPORT_URL = "http://localhost:5005/api/train/report_status"
+BULK_URL = "http://localhost:5001/smartmetro/train/report_status/bulk"
+
 def generate_station_pair():
     ranges = [
         (111, 138), (234, 263), (311, 339), (401, 426),
@@ -47,7 +51,7 @@ def post_data(record):
         print("准备发送：")
         print(json.dumps(record, indent=4, ensure_ascii=False))
         response = requests.post(
-            "http://localhost:5005/api/train/report_status",
+            REPORT_URL,
             json=record,
             timeout=5
         )
@@ -60,14 +64,42 @@ def post_data(record):
         print(f"网络错误: {str(e)}\n")
         return None
 
+def post_bulk(records):
+    """一次请求提交整批记录（NDJSON），返回成功条数"""
+    try:
+        response = requests.post(
+            BULK_URL,
+            data="\n".join(json.dumps(record, ensure_ascii=False) for record in records).encode("utf-8"),
+            headers={"Content-Type": "application/x-ndjson"},
+            timeout=5
+        )
+        if response.status_code != 200:
+            print(f"批量提交失败，状态码: {response.status_code}\n")
+            return 0
+        result = response.json()
+        for error in result["errors"]:
+            print(f"第 {error['index']} 条被拒绝: {error['error']}")
+        return result["accepted"]
+    except Exception as e:
+        print(f"网络错误: {str(e)}\n")
+        return 0
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bulk", action="store_true", help="每轮一次请求提交到批量上报接口")
+    parser.add_argument("--batch", type=int, default=10, help="每轮生成的记录数")
+    args = parser.parse_args()
+
     print("Starting train data generator (with line_id)...")
     while True:
-        records = [generate_train_data() for _ in range(10)]
-        success_count = 0
-        for record in records:
-            response = post_data(record)
-            if response and response.status_code == 200:
-                success_count += 1
-        print(f"本轮成功提交 {success_count}/10 条记录 {datetime.now().strftime('%H:%M:%S')}\n")
+        records = [generate_train_data() for _ in range(args.batch)]
+        if args.bulk:
+            success_count = post_bulk(records)
+        else:
+            success_count = 0
+            for record in records:
+                response = post_data(record)
+                if response and response.status_code == 200:
+                    success_count += 1
+        print(f"本轮成功提交 {success_count}/{len(records)} 条记录 {datetime.now().strftime('%H:%M:%S')}\n")
         time.sleep(1)
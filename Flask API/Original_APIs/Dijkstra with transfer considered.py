@@ -2,6 +2,7 @@ from flask import Flask, request, jsonify
 import mysql.connector
 from mysql.connector import pooling
 import heapq
+from itertools import count
 import logging
 from functools import wraps
 
@@ -102,7 +103,7 @@ class StationGraph:
                 # 构建图结构
                 if from_node not in self.graph:
                     self.graph[from_node] = []
-                self.graph[from_node].append((to_node, time))
+                self.graph[from_node].append((to_node, time, line_id))
                 
                 # 存储连接信息
                 self.connections[(from_node, to_node)] = {
@@ -113,7 +114,7 @@ class StationGraph:
                 # 添加反向关系
                 if to_node not in self.graph:
                     self.graph[to_node] = []
-                self.graph[to_node].append((from_node, time))
+                self.graph[to_node].append((from_node, time, line_id))
                 self.connections[(to_node, from_node)] = {
                     'line_id': line_id,
                     'time': time
@@ -143,42 +144,50 @@ class StationGraph:
                 return None
             if start_group not in self.graph or end_group not in self.graph:
                 return None
-            
-            # Heap (总时间, 当前节点, 路径, 当前线路)
-            heap = [(0, start_group, [], None)]
-            visited = set()
-                
+
+            # 状态为 (站点, 当前线路)，换乘代价计入边权；路径通过父指针回溯
+            start = (start_group, None)
+            dist = {start: 0}
+            parent = {start: None}
+            tie = count()
+            # Heap (总时间, 序号, 当前节点, 当前线路)
+            heap = [(0, next(tie), start_group, None)]
+
             while heap:
-                (total_time, current, path, current_line) = heapq.heappop(heap)
-            
-                if current in visited:
+                (total_time, _, current, current_line) = heapq.heappop(heap)
+                state = (current, current_line)
+                if total_time > dist[state]:
                     continue
-                    
-                visited.add(current)
-                path = path + [current]
-            
+
                 if current == end_group:
+                    path, lines, times = [], [], []
+                    while parent[state] is not None:
+                        prev_state, time = parent[state]
+                        path.append(state[0])
+                        lines.append(state[1])
+                        times.append(time)
+                        state = prev_state
+                    path.append(start_group)
                     return {
-                        'path': path,
+                        'path': path[::-1],
+                        'lines': lines[::-1],
+                        'times': times[::-1],
                         'total_time': total_time
                     }
-                
-                for neighbor, time in self.graph.get(current, []):
-                    if neighbor not in visited:
-                        # 获取连接信息
-                        conn_info = self.connections.get((current, neighbor))
-                        if not conn_info:
-                            continue
-                            
-                        new_line = conn_info['line_id']
-                        new_total_time = total_time + time
-                        
-                        # 检查是否换乘（线路变更且不是初始状态）
-                        if current_line is not None and new_line != current_line:
-                            new_total_time += 5  # 增加换乘时间
-                        
-                        heapq.heappush(heap, (new_total_time, neighbor, path, new_line))
-                            
+
+                for neighbor, time, new_line in self.graph.get(current, []):
+                    new_total_time = total_time + time
+
+                    # 检查是否换乘（线路变更且不是初始状态）
+                    if current_line is not None and new_line != current_line:
+                        new_total_time += 5  # 增加换乘时间
+
+                    next_state = (neighbor, new_line)
+                    if new_total_time < dist.get(next_state, float('inf')):
+                        dist[next_state] = new_total_time
+                        parent[next_state] = (state, time)
+                        heapq.heappush(heap, (new_total_time, next(tie), neighbor, new_line))
+
             return None
         except Exception as e:
             logger.error(f"Dijkstra算法执行出错: {str(e)}", exc_info=True)
@@ -235,13 +244,9 @@ def find_shortest_path():
         current = result['path'][i]
         next_node = result['path'][i+1]
         
-        # 获取连接信息
-        conn_info = station_graph.connections.get((current, next_node))
-        if not conn_info:
-            continue
-            
-        line_id = conn_info['line_id']
-        segment_time = conn_info['time']
+        # 线路与区段时间取自搜索结果（共线区段在 connections 中只保留一条线路）
+        line_id = result['lines'][i]
+        segment_time = result['times'][i]
         
         # 检查是否换乘
         if previous_line is not None and line_id != previous_line:
@@ -104,27 +104,33 @@ class StationGraph:
         if not start_group or not end_group or start_group not in self.graph or end_group not in self.graph:
             return None
             
-        heap = [(0, start_group, [])]
-        visited = set()
+        # 路径通过父指针回溯，不在堆中复制路径列表
+        dist = {start_group: 0}
+        parent = {start_group: None}
+        heap = [(0, start_group)]
         
         while heap:
-            (total_time, current, path) = heapq.heappop(heap)
+            (total_time, current) = heapq.heappop(heap)
             
-            if current in visited:
+            if total_time > dist[current]:
                 continue
-                
-            visited.add(current)
-            path = path + [current]
             
             if current == end_group:
+                path = []
+                while current is not None:
+                    path.append(current)
+                    current = parent[current]
                 return {
-                    'path': path,
+                    'path': path[::-1],
                     'total_time': total_time
                 }
                 
             for neighbor, time in self.graph.get(current, []):
-                if neighbor not in visited:
-                    heapq.heappush(heap, (total_time + time, neighbor, path))
+                new_total_time = total_time + time
+                if new_total_time < dist.get(neighbor, float('inf')):
+                    dist[neighbor] = new_total_time
+                    parent[neighbor] = current
+                    heapq.heappush(heap, (new_total_time, neighbor))
                     
         return None
 
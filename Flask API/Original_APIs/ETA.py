@@ -1,6 +1,7 @@
 from flask import Flask, request, jsonify
 import pymysql
 from datetime import datetime, timedelta
+from travel_time_index import TravelTimeIndex
 
 app = Flask(__name__)
 
@@ -13,64 +14,11 @@ def get_db_connection():
         cursorclass=pymysql.cursors.DictCursor
     )
 
-def calculate_travel_time(conn, path_id, from_station_id, to_station_id):
-    with conn.cursor() as cursor:
-        cursor.execute("""
-            SELECT station_order FROM station_path_order 
-            WHERE path_id = %s AND station_id = %s
-        """, (path_id, from_station_id))
-        from_result = cursor.fetchone()
-
-        cursor.execute("""
-            SELECT station_order FROM station_path_order 
-            WHERE path_id = %s AND station_id = %s
-        """, (path_id, to_station_id))
-        to_result = cursor.fetchone()
-
-        if not from_result or not to_result:
-            return None
-
-        from_order = from_result['station_order']
-        to_order = to_result['station_order']
-
-        if from_order == to_order:
-            return 0  # 已经在目标站
-
-        total_time = 0
-        # up方向，order递增
-        if from_order < to_order:
-            current_order = from_order
-            while current_order < to_order:
-                cursor.execute("""
-                    SELECT travel_time 
-                    FROM station_travel_time stt
-                    JOIN station_path_order spo_from ON stt.from_station_id = spo_from.station_id
-                    JOIN station_path_order spo_to ON stt.to_station_id = spo_to.station_id
-                    WHERE spo_from.path_id = %s AND spo_to.path_id = %s
-                    AND spo_from.station_order = %s AND spo_to.station_order = %s
-                """, (path_id, path_id, current_order, current_order + 1))
-                result = cursor.fetchone()
-                if result:
-                    total_time += result['travel_time']
-                current_order += 1
-        else:
-            # down方向，order递减
-            current_order = from_order
-            while current_order > to_order:
-                cursor.execute("""
-                    SELECT travel_time 
-                    FROM station_travel_time stt
-                    JOIN station_path_order spo_from ON stt.from_station_id = spo_from.station_id
-                    JOIN station_path_order spo_to ON stt.to_station_id = spo_to.station_id
-                    WHERE spo_from.path_id = %s AND spo_to.path_id = %s
-                    AND spo_from.station_order = %s AND spo_to.station_order = %s
-                """, (path_id, path_id, current_order, current_order - 1))
-                result = cursor.fetchone()
-                if result:
-                    total_time += result['travel_time']
-                current_order -= 1
-
-        return float(total_time) if total_time else None
+# 站间行驶时间前缀和索引，station_path_order / station_travel_time 变化后自动重建
+travel_time_index = TravelTimeIndex(get_db_connection)
+
+def calculate_travel_time(path_id, from_station_id, to_station_id, at=None):
+    return travel_time_index.travel_time(path_id, from_station_id, to_station_id, at)
 
 @app.route('/api/train/report_status', methods=['POST'])
 def report_train_status():
@@ -166,7 +114,7 @@ def get_next_trains():
                     direction = "up" if next_order < target_order else "down"
 
                     total_travel_time = calculate_travel_time(
-                        conn, path_id, train['next_station_id'], target_station_id
+                        path_id, train['next_station_id'], target_station_id, train['timestamp']
                     )
 
                     if total_travel_time is None:
@@ -0,0 +1,86 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 各站各线的无障碍设施（无障碍电梯、斜挂梯、升降平台等），按 station_map.stat_id 对应到 travel_group
+# （station_elevators.stat_id 为字符串）
+STEP_FREE_QUERY = """
+    SELECT m.travel_group, e.line, e.description
+    FROM station_elevators e
+    JOIN station_map m ON m.stat_id = CAST(e.stat_id AS UNSIGNED)
+"""
+
+# 描述中含该关键字的设施可到达站台（如 "站厅-站台"、"站厅至站台"），只通地面与站厅的不算
+PLATFORM_KEYWORD = '站台'
+
+# 与其他线路共用站台的线路（16 号线大站车停靠 16 号线站台）
+SHARED_PLATFORMS = {160: 16}
+
+
+class AccessibilityIndex:
+    """
+    (travel_group, line_id) 无障碍位图：每个站点一个整数，第 bits[line_id] 位表示该线站台可无台阶到达
+
+    图加载时从 station_elevators 预计算，mode=accessible 的路线搜索只允许在两端站台都可无台阶到达的
+    站点换乘，每次判断为 O(1) 的位运算，不访问数据库。
+    没有设施记录的站台按不可达处理，宁可多绕路也不把乘客带到无法换乘的站台。
+    """
+
+    def __init__(self, lines=()):
+        self.bits = {line_id: bit for bit, line_id in enumerate(sorted(set(lines)))}
+        self.masks = {}  # travel_group -> 位图
+
+    @classmethod
+    def load(cls, get_connection, station_graph):
+        conn = None
+        cursor = None
+        try:
+            conn = get_connection()
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute(STEP_FREE_QUERY)
+            rows = cursor.fetchall()
+        finally:
+            if cursor:
+                cursor.close()
+            if conn:
+                conn.close()
+        return cls.from_rows(rows, station_graph)
+
+    @classmethod
+    def from_rows(cls, rows, station_graph):
+        lines = {line_id for edges in station_graph.graph.values() for _, _, line_id in edges}
+        index = cls(lines | {row['line'] for row in rows if row['line'] is not None})
+        for row in rows:
+            if row['travel_group'] in (None, '') or row['line'] is None:
+                continue
+            if PLATFORM_KEYWORD in (row['description'] or ''):
+                index.mark(int(row['travel_group']), row['line'])
+        for shared_line, line_id in SHARED_PLATFORMS.items():
+            if shared_line in index.bits:
+                for group in list(index.masks):
+                    if index.is_step_free(group, line_id):
+                        index.mark(group, shared_line)
+        logger.info(f"无障碍位图已加载: {sum(bin(mask).count('1') for mask in index.masks.values())} 个站台可无台阶到达")
+        return index
+
+    def mark(self, group, line_id):
+        bit = self.bits.get(line_id)
+        if bit is None:
+            bit = self.bits[line_id] = len(self.bits)
+        self.masks[group] = self.masks.get(group, 0) | (1 << bit)
+
+    def is_step_free(self, group, line_id):
+        bit = self.bits.get(line_id)
+        return bit is not None and (self.masks.get(group, 0) >> bit) & 1 == 1
+
+    def can_transfer(self, group, from_line, to_line):
+        """在 group 从 from_line 换乘到 to_line 是否全程无台阶"""
+        mask = self.masks.get(group, 0)
+        from_bit = self.bits.get(from_line)
+        to_bit = self.bits.get(to_line)
+        return (from_bit is not None and to_bit is not None
+                and (mask >> from_bit) & 1 == 1 and (mask >> to_bit) & 1 == 1)
+
+    def step_free_lines(self, group):
+        mask = self.masks.get(group, 0)
+        return sorted(line_id for line_id, bit in self.bits.items() if (mask >> bit) & 1)
@@ -0,0 +1,151 @@
+import json
+import logging
+import os
+
+import numpy as np
+
+from metro_graph import TRANSFER_TIME
+
+logger = logging.getLogger(__name__)
+
+# 不可达标记
+UNREACHABLE = -1
+
+ARRAY_NAMES = ('nodes', 'state_node', 'state_line', 'time', 'best_state', 'next_state', 'hop_time')
+META_FILE = 'meta.json'
+
+
+class AllPairsTable:
+    """
+    全源最短路表
+
+    换乘惩罚使"经过 v 的最优路径"不一定包含从 v 出发的最优路径，
+    因此下一跳按 (travel_group, line_id) 状态记录：
+    next_state[t, s] 是以 t 为根的最短路树中状态 s 的父状态，
+    由于图是双向对称的，沿父指针走即是从 s 正向前往 t 的下一跳。
+
+    - time[t, v]        v 与 t 之间考虑换乘的最短时间（对称），不可达为 -1
+    - best_state[t, v]  以 t 为根时到达 v 的最优状态
+    - next_state[t, s]  状态 s 朝向 t 的下一状态，-1 表示下一站即为 t
+    - hop_time[t, s]    对应区段的行驶时间
+    """
+
+    def __init__(self, arrays, signature=None):
+        for name in ARRAY_NAMES:
+            setattr(self, name, arrays[name])
+        self.signature = signature
+        self.index = {node.item(): i for i, node in enumerate(self.nodes)}
+
+    @classmethod
+    def build(cls, station_graph):
+        nodes = sorted(station_graph.graph)
+        index = {node: i for i, node in enumerate(nodes)}
+
+        states = sorted({
+            (neighbor, line_id)
+            for edges in station_graph.graph.values()
+            for neighbor, _, line_id in edges
+        })
+        state_index = {state: i for i, state in enumerate(states)}
+
+        n, m = len(nodes), len(states)
+        time = np.full((n, n), UNREACHABLE, dtype=np.int32)
+        best_state = np.full((n, n), UNREACHABLE, dtype=np.int32)
+        next_state = np.full((n, m), UNREACHABLE, dtype=np.int32)
+        hop_time = np.zeros((n, m), dtype=np.int32)
+
+        for root, root_group in enumerate(nodes):
+            dist, parent = station_graph.shortest_path_tree(root_group)
+            time[root, root] = 0
+            for state, total_time in dist.items():
+                if parent[state] is None:
+                    continue
+                i = state_index[state]
+                prev_state, segment_time = parent[state]
+                next_state[root, i] = state_index[prev_state] if prev_state[1] is not None else UNREACHABLE
+                hop_time[root, i] = segment_time
+
+                v = index[state[0]]
+                if v != root and (time[root, v] == UNREACHABLE or total_time < time[root, v]):
+                    time[root, v] = total_time
+                    best_state[root, v] = i
+
+        arrays = {
+            'nodes': np.array(nodes, dtype=np.int64),
+            'state_node': np.array([index[node] for node, _ in states], dtype=np.int32),
+            'state_line': np.array([line_id for _, line_id in states], dtype=np.int32),
+            'time': time,
+            'best_state': best_state,
+            'next_state': next_state,
+            'hop_time': hop_time
+        }
+        logger.info(f"全源最短路表构建完成: {n} 个站点, {m} 个状态")
+        return cls(arrays, station_graph.version or station_graph.compute_version())
+
+    def save(self, directory):
+        """写入 .npy 文件；先写临时文件再替换，meta.json 最后写入"""
+        os.makedirs(directory, exist_ok=True)
+        for name in ARRAY_NAMES:
+            path = os.path.join(directory, f'{name}.npy')
+            with open(path + '.tmp', 'wb') as f:
+                np.save(f, np.asarray(getattr(self, name)))
+            os.replace(path + '.tmp', path)
+
+        meta_path = os.path.join(directory, META_FILE)
+        with open(meta_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'signature': self.signature, 'transfer_time': TRANSFER_TIME}, f)
+        os.replace(meta_path + '.tmp', meta_path)
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        """以内存映射方式加载，多个 worker 共享同一份页缓存"""
+        with open(os.path.join(directory, META_FILE), encoding='utf-8') as f:
+            meta = json.load(f)
+        arrays = {
+            name: np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r' if mmap else None)
+            for name in ARRAY_NAMES
+        }
+        return cls(arrays, meta.get('signature'))
+
+    @classmethod
+    def load_or_build(cls, station_graph, directory):
+        """磁盘上的表与当前图一致（记录的图版本号相同）时直接映射，否则重新计算并保存"""
+        signature = station_graph.version or station_graph.compute_version()
+        try:
+            table = cls.load(directory)
+            if table.signature == signature:
+                logger.info(f"已加载全源最短路表: {directory}")
+                return table
+            logger.info("全源最短路表已过期，重新计算")
+        except (OSError, ValueError) as e:
+            logger.info(f"未找到可用的全源最短路表，重新计算: {str(e)}")
+
+        table = cls.build(station_graph)
+        table.save(directory)
+        return cls.load(directory)
+
+    def route(self, start_group, end_group):
+        """查表得到路线，格式与 StationGraph.dijkstra_shortest_path 相同"""
+        start = self.index.get(start_group)
+        end = self.index.get(end_group)
+        if start is None or end is None:
+            return None
+
+        total_time = int(self.time[end, start])
+        if total_time == UNREACHABLE:
+            return None
+
+        path, lines, times = [start_group], [], []
+        state = int(self.best_state[end, start])
+        while state != UNREACHABLE:
+            lines.append(int(self.state_line[state]))
+            times.append(int(self.hop_time[end, state]))
+            state = int(self.next_state[end, state])
+            path.append(self.nodes[self.state_node[state]].item() if state != UNREACHABLE else end_group)
+
+        return {
+            'path': path,
+            'lines': lines,
+            'times': times,
+            'total_time': total_time
+        }
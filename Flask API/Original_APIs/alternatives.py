@@ -0,0 +1,210 @@
+import heapq
+import time
+from itertools import count
+
+from metro_graph import TRANSFER_TIME
+
+# 默认单次请求的计算预算（毫秒）
+DEFAULT_BUDGET_MS = 200
+# 与已选路线重合的行驶时间占比超过该值时视为"同一条路线"
+DEFAULT_MAX_OVERLAP = 0.8
+# 每条返回路线最多检查的候选数，避免重合度过滤导致无限扩展
+CANDIDATES_PER_ROUTE = 5
+
+
+class _TargetDistance:
+    """
+    以终点为根的最短路树，作为所有偏离搜索共用的 A* 启发函数。
+
+    图是双向对称的，树中 (v, l) 的距离即"从 v 乘 l 号线出发到终点"的最短时间，
+    删除边或站点只会让距离变大，因此它在 Yen 的每一轮中都是可采纳且一致的。
+    """
+
+    def __init__(self, station_graph, end_group):
+        dist, _ = station_graph.shortest_path_tree(end_group)
+        self.end_group = end_group
+        self.by_line = {}
+        self.best = {}
+        for (node, line_id), total_time in dist.items():
+            if line_id is None:
+                continue
+            self.by_line.setdefault(node, {})[line_id] = total_time
+            if total_time < self.best.get(node, float('inf')):
+                self.best[node] = total_time
+
+    def __call__(self, node, current_line):
+        if node == self.end_group:
+            return 0
+        best = self.best.get(node)
+        if best is None:
+            return None  # 不可达
+        if current_line is None:
+            return best
+        return min(best + TRANSFER_TIME, self.by_line[node].get(current_line, float('inf')))
+
+
+def _spur_search(station_graph, heuristic, spur_node, spur_line, blocked_nodes, blocked_edges, penalties=None,
+                 step_free=None):
+    """
+    从偏离点出发的 A* 搜索，返回 (path, lines, times, 代价) 或 None
+    附加代价非负、换乘限制只会让路线变长，不含二者的最短路树仍是可采纳且一致的启发函数
+    """
+    end_group = heuristic.end_group
+    h = heuristic(spur_node, spur_line)
+    if h is None:
+        return None
+
+    start = (spur_node, spur_line)
+    dist = {start: 0}
+    parent = {start: None}
+    closed = set()
+    tie = count()
+    heap = [(h, next(tie), spur_node, spur_line)]
+
+    while heap:
+        _, _, current, current_line = heapq.heappop(heap)
+        state = (current, current_line)
+        if state in closed:
+            continue
+        closed.add(state)
+        total_time = dist[state]
+
+        if current == end_group:
+            path, lines, times = [], [], []
+            while parent[state] is not None:
+                prev_state, segment_time = parent[state]
+                path.append(state[0])
+                lines.append(state[1])
+                times.append(segment_time)
+                state = prev_state
+            path.append(spur_node)
+            return path[::-1], lines[::-1], times[::-1], total_time
+
+        for neighbor, segment_time, line_id in station_graph.graph[current]:
+            if neighbor in blocked_nodes or (current, neighbor, line_id) in blocked_edges:
+                continue
+            new_total_time = total_time + segment_time
+            if current_line is not None and line_id != current_line:
+                if step_free is not None and not step_free.can_transfer(current, current_line, line_id):
+                    continue
+                new_total_time += TRANSFER_TIME
+            if penalties:
+                new_total_time += penalties.get((current, neighbor, line_id), 0)
+
+            next_state = (neighbor, line_id)
+            if new_total_time < dist.get(next_state, float('inf')):
+                h = heuristic(neighbor, line_id)
+                if h is None:
+                    continue
+                dist[next_state] = new_total_time
+                parent[next_state] = (state, segment_time)
+                heapq.heappush(heap, (new_total_time + h, next(tie), neighbor, line_id))
+
+    return None
+
+
+def _prefix_time(path, lines, times, i, penalties=None):
+    """路线前 i 段（含换乘及附加代价）的累计代价"""
+    total_time = 0
+    for j in range(i):
+        total_time += times[j]
+        if j > 0 and lines[j] != lines[j - 1]:
+            total_time += TRANSFER_TIME
+        if penalties:
+            total_time += penalties.get((path[j], path[j + 1], lines[j]), 0)
+    return total_time
+
+
+def _overlap(candidate, accepted):
+    """候选路线与已选路线共用区段的行驶时间占比"""
+    shared_edges = set()
+    for route in accepted:
+        shared_edges.update(zip(route['path'], route['path'][1:]))
+    total_time = sum(candidate['times']) or 1
+    shared_time = sum(
+        segment_time
+        for edge, segment_time in zip(zip(candidate['path'], candidate['path'][1:]), candidate['times'])
+        if edge in shared_edges
+    )
+    return shared_time / total_time
+
+
+def k_shortest_paths(station_graph, start_group, end_group, k,
+                     budget_ms=DEFAULT_BUDGET_MS, max_overlap=DEFAULT_MAX_OVERLAP, penalties=None, step_free=None):
+    """
+    Yen 算法求至多 k 条无环、互相有明显差异的备选路线。
+
+    返回 (routes, truncated)，routes 中每项与 dijkstra_shortest_path 的结果格式相同，
+    truncated 表示因超出 budget_ms 而提前结束。给定 penalties 时按含附加代价的总代价排序，
+    给定 step_free 时只在无台阶可达的站台之间换乘。
+    """
+    if start_group not in station_graph.graph or end_group not in station_graph.graph:
+        return [], False
+
+    deadline = time.perf_counter() + budget_ms / 1000.0
+    heuristic = _TargetDistance(station_graph, end_group)
+
+    first = _spur_search(station_graph, heuristic, start_group, None, set(), set(), penalties, step_free)
+    if first is None:
+        return [], False
+    path, lines, times, total_time = first
+    shortest = {'path': path, 'lines': lines, 'times': times, 'total_time': total_time}
+
+    found = [shortest]      # Yen 意义下已确定的路线（含因重合度过高被略过的）
+    accepted = [shortest]   # 返回给用户的路线
+    seen = {(tuple(path), tuple(lines))}
+    candidates = []
+    tie = count()
+    truncated = False
+
+    while len(accepted) < k and len(found) < k * CANDIDATES_PER_ROUTE:
+        previous = found[-1]
+        for i in range(len(previous['path']) - 1):
+            if time.perf_counter() > deadline:
+                truncated = True
+                break
+
+            spur_node = previous['path'][i]
+            root_path = previous['path'][:i + 1]
+            root_lines = previous['lines'][:i]
+
+            # 屏蔽与当前根路径相同的已知路线在偏离点的下一条边
+            blocked_edges = {
+                (route['path'][i], route['path'][i + 1], route['lines'][i])
+                for route in found
+                if route['path'][:i + 1] == root_path and route['lines'][:i] == root_lines
+            }
+            blocked_nodes = set(root_path[:-1])
+
+            spur = _spur_search(
+                station_graph, heuristic, spur_node, root_lines[-1] if root_lines else None,
+                blocked_nodes, blocked_edges, penalties, step_free
+            )
+            if spur is None:
+                continue
+
+            spur_path, spur_lines, spur_times, spur_time = spur
+            candidate = {
+                'path': root_path[:-1] + spur_path,
+                'lines': root_lines + spur_lines,
+                'times': previous['times'][:i] + spur_times,
+                'total_time': _prefix_time(previous['path'], previous['lines'], previous['times'], i, penalties) + spur_time
+            }
+            key = (tuple(candidate['path']), tuple(candidate['lines']))
+            if key not in seen:
+                seen.add(key)
+                heapq.heappush(candidates, (candidate['total_time'], next(tie), candidate))
+
+        if truncated or not candidates:
+            break
+
+        _, _, route = heapq.heappop(candidates)
+        found.append(route)
+        if _overlap(route, accepted) <= max_overlap:
+            accepted.append(route)
+
+    if penalties:
+        for route in accepted:
+            route['cost'] = route['total_time']
+            route['total_time'] = station_graph.travel_time(route['lines'], route['times'])
+    return accepted, truncated
@@ -0,0 +1,424 @@
+import heapq
+import json
+import logging
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 检查数据是否变化并推送的间隔（秒）
+DEFAULT_PUBLISH_SECONDS = 1
+# 没有更新时发送 SSE 注释行保持连接的间隔（秒）
+DEFAULT_HEARTBEAT_SECONDS = 15
+# 每个站点每个方向保留的列车数
+DEFAULT_PER_DIRECTION = 2
+# 看板镜像写入数据库的间隔（秒）
+DEFAULT_MIRROR_SECONDS = 5
+
+DIRECTIONS = ('up', 'down')
+
+# 看板镜像表结构见 Database/arrival_board.sql
+ARRIVAL_BOARD_DELETE = "DELETE FROM arrival_board WHERE path_id = %s AND station_id = %s"
+
+ARRIVAL_BOARD_INSERT = """
+    INSERT INTO arrival_board
+    (path_id, station_id, direction, arrival_rank, train_number, expected_arrival_time, updated_at)
+    VALUES (%s, %s, %s, %s, %s, %s, %s)
+"""
+
+
+def encode_event(payload, event='board'):
+    """编码为一条 SSE 消息"""
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False, default=str)}\n\n"
+
+
+class ArrivalBoard:
+    """
+    物化的到站看板：每个站点（行驶时间索引中的扁平下标）每个方向预计最早到达的几班列车
+
+    列车存储每变化一条记录（add_listener 回调，在存储锁内），只撤销该列车原来的贡献，
+    再沿它所在 path 的站点序列计算行驶方向前方各站的到站时间（一次数组运算），
+    只有进入或离开某站前几名时才重新排序该站。next_trains 与整条线路的看板都只读字典。
+
+    到站约定与原 next_trains 相同：按下一站到目标站的行驶时间估算，下一站在目标站之后记为 up、
+    之前记为 down，下一站即目标站的不计入；已知当前站时只计入行驶方向前方的站点。
+    行驶时间索引切换后以存储中的全部列车整体重建。
+    """
+
+    def __init__(self, table_source, train_store, per_direction=DEFAULT_PER_DIRECTION):
+        self._table_source = table_source  # 返回当前行驶时间索引快照，不访问数据库
+        self._train_store = train_store
+        self.per_direction = per_direction
+        self._lock = threading.RLock()
+        self.table = None
+        self._candidates = {}  # (扁平下标, 方向) -> {train_number: (预计到站时间, 分钟, 记录)}
+        self._top = {}         # (扁平下标, 方向) -> [(预计到站时间, train_number, 分钟, 记录), ...]
+        self._affects = {}     # train_number -> [(扁平下标, 方向), ...]
+        self._boards = {}      # 站名 -> 看板缓存
+        self._dirty = set()    # 待镜像到数据库的扁平下标
+        self.version = 0       # 任一站点前几名变化时加一
+        self._mirror_thread = None
+        self.mirrored_at = None
+        self.last_error = None
+        train_store.add_listener(self.apply)
+
+    def _sync_table(self):
+        """行驶时间索引已切换时重建（先取存储锁再取看板锁，与回调的加锁顺序一致）"""
+        table = self._table_source()
+        if table is not self.table:
+            self._train_store.with_records(lambda records: self._rebuild(table, records))
+
+    def _rebuild(self, table, records):
+        with self._lock:
+            self.table = table
+            self._candidates = {}
+            self._top = {}
+            self._affects = {}
+            self._boards = {}
+            self._dirty = set(range(len(table.stations)))
+            for record in records:
+                self._add(record)
+            # 前几名清空后重算，否则要等每列车再次上报才会出现在看板上
+            for key in list(self._candidates):
+                self._refresh_top(key)
+            self.version += 1
+        logger.info(f"到站看板已重建: {len(records)} 列列车, {len(table.stations)} 个站点")
+
+    def apply(self, previous, record):
+        """列车存储的变化回调"""
+        self._sync_table()
+        with self._lock:
+            train_number = (record or previous)['train_number']
+            touched = self._remove(train_number)
+            if record is not None:
+                touched |= self._add(record)
+            for key in touched:
+                self._refresh_top(key)
+
+    def _contributions(self, record):
+        """列车对各站的贡献 [(扁平下标, 方向, 分钟), ...]"""
+        table = self.table
+        path_id = record['path_id']
+        next_position = table.positions.get((path_id, record['next_station_id']))
+        if next_position is None or record['station_id'] // 100 != record['next_station_id'] // 100:
+            return []
+
+        start, end = table.span(next_position)
+        current = table.positions.get((path_id, record['station_id']))
+        if current is not None and current != next_position and start <= current < end:
+            # 只计入行驶方向前方的站点
+            if current < next_position:
+                start = next_position + 1
+            else:
+                end = next_position
+        targets = np.arange(start, end)
+        targets = targets[targets != next_position]
+        minutes = table.between(next_position, targets, record['timestamp'].hour)
+        keep = minutes > 0
+        return [
+            (target, 'up' if target < next_position else 'down', m)
+            for target, m in zip(targets[keep].tolist(), minutes[keep].tolist())
+        ]
+
+    def _remove(self, train_number):
+        touched = set()
+        for key in self._affects.pop(train_number, ()):
+            candidates = self._candidates[key]
+            del candidates[train_number]
+            if not candidates:
+                del self._candidates[key]
+            if any(entry[1] == train_number for entry in self._top.get(key, ())):
+                touched.add(key)
+        return touched
+
+    def _add(self, record):
+        touched = set()
+        train_number = record['train_number']
+        affects = []
+        for position, direction, minutes in self._contributions(record):
+            key = (position, direction)
+            eta = record['timestamp'] + timedelta(minutes=minutes)
+            self._candidates.setdefault(key, {})[train_number] = (eta, minutes, record)
+            affects.append(key)
+            top = self._top.get(key, ())
+            if len(top) < self.per_direction or (eta, train_number) < top[-1][:2]:
+                touched.add(key)
+        self._affects[train_number] = affects
+        return touched
+
+    def _refresh_top(self, key):
+        candidates = self._candidates.get(key, {})
+        top = heapq.nsmallest(self.per_direction, (
+            (eta, train_number, minutes, record)
+            for train_number, (eta, minutes, record) in candidates.items()
+        ))
+        if top == self._top.get(key, []):
+            return
+        if top:
+            self._top[key] = top
+        else:
+            self._top.pop(key, None)
+        position = key[0]
+        self._boards.pop(self.table.stations[position][2], None)
+        self._dirty.add(position)
+        self.version += 1
+
+    def _arrivals(self, position, direction, line_id):
+        return [
+            {
+                "train_number": train_number,
+                "direction": direction,
+                "expected_arrival_time": eta.strftime('%Y-%m-%d %H:%M:%S'),
+                "path_id": record['path_id'],
+                "line_id": line_id
+            }
+            for eta, train_number, _, record in self._top.get((position, direction), ())
+        ]
+
+    def board(self, station_name):
+        """站点看板（与 /smartmetro/next_trains 的响应相同），站名不存在时返回 None"""
+        self._sync_table()
+        with self._lock:
+            board = self._boards.get(station_name)
+            if board is not None:
+                return board
+            targets = self.table.names.get(station_name)
+            if not targets:
+                return None
+
+            lines = {}
+            for _, station_id, position in targets:
+                line_id = station_id // 100
+                line_key = f"Line_{line_id}"
+                if line_key not in lines:
+                    lines[line_key] = {
+                        f"{direction}_direction": self._arrivals(position, direction, line_id)
+                        for direction in DIRECTIONS
+                    }
+            board = self._boards[station_name] = {
+                "station_name": station_name,
+                "lines": lines
+            }
+            return board
+
+    def line_board(self, line_id):
+        """整条线路各站的看板，按 path_id、station_order 排列；线路不存在时返回 None"""
+        self._sync_table()
+        with self._lock:
+            positions = self.table.line_positions(line_id)
+            if not positions:
+                return None
+            stations = []
+            for position in positions:
+                path_id, station_id, name = self.table.stations[position]
+                station = {
+                    "station_id": station_id,
+                    "station_name": name,
+                    "path_id": path_id
+                }
+                for direction in DIRECTIONS:
+                    station[f"{direction}_direction"] = self._arrivals(position, direction, line_id)
+                stations.append(station)
+            return {
+                "line_id": line_id,
+                "stations": stations
+            }
+
+    def mirror(self, get_connection):
+        """把前几名有变化的站点写入 arrival_board 表（先删后插），失败时保留待写集合，返回写入站点数"""
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            table = self.table
+            rows = []
+            for position in dirty:
+                path_id, station_id, _ = table.stations[position]
+                for direction in DIRECTIONS:
+                    for rank, (eta, train_number, _, _) in enumerate(self._top.get((position, direction), ()), 1):
+                        rows.append((path_id, station_id, direction, rank, train_number, eta))
+        if not dirty:
+            return 0
+
+        updated_at = datetime.now()
+        conn = None
+        cursor = None
+        try:
+            conn = get_connection()
+            cursor = conn.cursor()
+            cursor.executemany(ARRIVAL_BOARD_DELETE, [table.stations[position][:2] for position in dirty])
+            if rows:
+                cursor.executemany(ARRIVAL_BOARD_INSERT, [row + (updated_at,) for row in rows])
+            conn.commit()
+        except Exception:
+            with self._lock:
+                if table is self.table:
+                    self._dirty |= dirty
+            raise
+        finally:
+            if cursor:
+                cursor.close()
+            if conn:
+                conn.close()
+        self.mirrored_at = updated_at
+        return len(dirty)
+
+    def start_mirror(self, get_connection, mirror_seconds=DEFAULT_MIRROR_SECONDS):
+        """启动后台线程，定期把看板镜像到数据库"""
+        if self._mirror_thread is not None and self._mirror_thread.is_alive():
+            return
+
+        def run():
+            while True:
+                time.sleep(mirror_seconds)
+                try:
+                    self.mirror(get_connection)
+                    self.last_error = None
+                except Exception as e:
+                    self.last_error = str(e)
+                    logger.error(f"到站看板写入数据库失败: {str(e)}", exc_info=True)
+
+        self._mirror_thread = threading.Thread(target=run, name='arrival-board-mirror', daemon=True)
+        self._mirror_thread.start()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'stations': len({position for position, _ in self._top}),
+                'trains': len(self._affects),
+                'version': self.version,
+                'pending_mirror': len(self._dirty),
+                'mirrored_at': self.mirrored_at.isoformat() if self.mirrored_at else None,
+                'last_error': self.last_error
+            }
+
+
+class ArrivalBoardHub:
+    """
+    按站名订阅的到站看板推送（Server-Sent Events）
+
+    compute_board(station_name) 返回该站看板（与 /smartmetro/next_trains 的响应相同），
+    version() 返回看板数据版本，版本变化时后台线程对每个有订阅者的站点
+    只读取并编码一次看板，内容有变化才把同一条已编码消息放入该站所有订阅者的队列，
+    开销随被订阅的站点数增长，与客户端数量无关。
+
+    每个订阅者的队列只保留最新一条消息，慢客户端跳过中间状态，不会拖慢推送线程。
+    """
+
+    def __init__(self, compute_board, version, publish_seconds=DEFAULT_PUBLISH_SECONDS):
+        self._compute_board = compute_board
+        self._version = version
+        self.publish_seconds = publish_seconds
+        self._lock = threading.Lock()
+        self._subscribers = {}  # 站名 -> {队列, ...}
+        self._messages = {}     # 站名 -> 最近一次推送的已编码消息
+        self._published_version = None
+        self._thread = None
+        self.publishes = 0      # 计算看板的次数
+        self.deliveries = 0     # 放入订阅者队列的消息数
+
+    def _encode(self, station_name):
+        return encode_event(self._compute_board(station_name))
+
+    @staticmethod
+    def _offer(subscriber, message):
+        """放入队列，队列已满时丢弃未读的旧消息"""
+        try:
+            subscriber.put_nowait(message)
+        except queue.Full:
+            try:
+                subscriber.get_nowait()
+            except queue.Empty:
+                pass
+            subscriber.put_nowait(message)
+
+    def subscribe(self, station_name):
+        """订阅一个站点，返回队列；队列中已放入当前看板"""
+        self._ensure_thread()
+        with self._lock:
+            message = self._messages.get(station_name)
+        if message is None:
+            message = self._encode(station_name)
+
+        subscriber = queue.Queue(maxsize=1)
+        subscriber.put_nowait(message)
+        with self._lock:
+            self._subscribers.setdefault(station_name, set()).add(subscriber)
+            self._messages.setdefault(station_name, message)
+        return subscriber
+
+    def unsubscribe(self, station_name, subscriber):
+        with self._lock:
+            subscribers = self._subscribers.get(station_name)
+            if subscribers is None:
+                return
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self._subscribers[station_name]
+                self._messages.pop(station_name, None)
+
+    def publish(self, force=False):
+        """数据版本变化时重新计算被订阅站点的看板并推送，返回有变化的站点数"""
+        version = self._version()
+        if not force and version == self._published_version:
+            return 0
+        self._published_version = version
+
+        with self._lock:
+            station_names = list(self._subscribers)
+        changed = 0
+        for station_name in station_names:
+            try:
+                message = self._encode(station_name)
+            except Exception as e:
+                logger.error(f"计算 {station_name} 到站看板出错: {str(e)}", exc_info=True)
+                continue
+            self.publishes += 1
+            with self._lock:
+                subscribers = self._subscribers.get(station_name)
+                if not subscribers or self._messages.get(station_name) == message:
+                    continue
+                self._messages[station_name] = message
+                subscribers = list(subscribers)
+            for subscriber in subscribers:
+                self._offer(subscriber, message)
+            self.deliveries += len(subscribers)
+            changed += 1
+        return changed
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='arrival-board-publish', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.publish_seconds)
+            try:
+                self.publish()
+            except Exception as e:
+                logger.error(f"推送到站看板出错: {str(e)}", exc_info=True)
+
+    def stream(self, station_name, heartbeat_seconds=DEFAULT_HEARTBEAT_SECONDS):
+        """SSE 响应体生成器，客户端断开后自动退订"""
+        subscriber = self.subscribe(station_name)
+        try:
+            while True:
+                try:
+                    yield subscriber.get(timeout=heartbeat_seconds)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+        finally:
+            self.unsubscribe(station_name, subscriber)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'stations': len(self._subscribers),
+                'subscribers': sum(len(subscribers) for subscribers in self._subscribers.values()),
+                'publishes': self.publishes,
+                'deliveries': self.deliveries
+            }
@@ -0,0 +1,131 @@
+import json
+import logging
+import multiprocessing
+import os
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+logger = logging.getLogger(__name__)
+
+# 起点数量达到该值时改用进程池
+POOL_MIN_ORIGINS = 16
+
+# 每个工作进程同时排队的任务数，提交的任务随完成逐个补充
+TASKS_PER_WORKER = 2
+
+# 子进程中的图结构，由 _init_worker 设置
+_worker_graph = None
+
+
+def _init_worker(station_graph):
+    global _worker_graph
+    _worker_graph = station_graph
+
+
+def _encode(record):
+    return json.dumps(record, ensure_ascii=False) + '\n'
+
+
+def route_origin(station_graph, start_group, items, penalties=None, step_free=None):
+    """
+    同一起点的所有 OD 对只做一次单源搜索
+    items: [(序号, 起始站, 目的站, 终点 travel_group), ...]，返回编码好的 NDJSON 行
+    """
+    results = station_graph.routes_from(start_group, {end_group for _, _, _, end_group in items}, penalties, step_free)
+    lines = []
+    for index, from_station, to_station, end_group in items:
+        result = results.get(end_group)
+        if result is None:
+            lines.append(_encode({
+                'index': index,
+                'from': from_station,
+                'to': to_station,
+                'success': False,
+                'message': '未找到路径'
+            }))
+            continue
+        lines.append(_encode({
+            'index': index,
+            'from': from_station,
+            'to': to_station,
+            'success': True,
+            'data': station_graph.format_route(result, start_group, end_group)
+        }))
+    return ''.join(lines)
+
+
+def _route_origin_in_worker(start_group, items, penalties, step_free):
+    return route_origin(_worker_graph, start_group, items, penalties, step_free)
+
+
+class BatchRouter:
+    """批量路线规划：按起点分组，大批量时分发到进程池，结果按完成顺序流式返回"""
+
+    def __init__(self, station_graph, max_workers=None):
+        self.station_graph = station_graph
+        self.max_workers = max_workers or os.cpu_count()
+        self._executor = None
+
+    def _get_executor(self):
+        if self._executor is None:
+            # 服务进程中已有后台线程，fork 可能复制持有中的锁，工作进程改用 spawn 启动
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+                initargs=(self.station_graph,)
+            )
+        return self._executor
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def stream(self, pairs, penalties=None, step_free=None):
+        """
+        pairs: [(起始站, 目的站), ...]，站名须为字符串；penalties / step_free 见 StationGraph._search
+        逐块产出 NDJSON 文本，每行对应一个 OD 对并带有原始序号 index
+        """
+        graph = self.station_graph
+        groups = defaultdict(list)
+        for index, (from_station, to_station) in enumerate(pairs):
+            # 站名不是字符串（如 {"from": 1}）与无效站名一样逐条报错，不中断整个响应
+            valid = isinstance(from_station, str) and isinstance(to_station, str)
+            start_group = graph.find_travel_group(from_station) if valid else None
+            end_group = graph.find_travel_group(to_station) if valid else None
+            if not start_group or not end_group:
+                yield _encode({
+                    'index': index,
+                    'from': from_station,
+                    'to': to_station,
+                    'success': False,
+                    'message': '无效的车站名称'
+                })
+                continue
+            groups[start_group].append((index, from_station, to_station, end_group))
+
+        if len(groups) < POOL_MIN_ORIGINS or self.max_workers <= 1:
+            for start_group, items in groups.items():
+                yield route_origin(graph, start_group, items, penalties, step_free)
+            return
+
+        executor = self._get_executor()
+        tasks = iter(groups.items())
+        pending = set()
+        try:
+            # 在途任务数不超过 TASKS_PER_WORKER × 进程数，已完成的结果产出后即释放
+            while True:
+                for start_group, items in tasks:
+                    pending.add(executor.submit(_route_origin_in_worker, start_group, items, penalties, step_free))
+                    if len(pending) >= TASKS_PER_WORKER * self.max_workers:
+                        break
+                if not pending:
+                    return
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        finally:
+            # 客户端中途断开时取消尚未开始的任务
+            for future in pending:
+                future.cancel()
@@ -0,0 +1,116 @@
+"""
+收缩层次基准：现有实时 Dijkstra 对比收缩层次查询，并在放大若干倍的合成网络上验证延迟是否随规模增长
+
+合成网络把现有线网复制 --scale 份（站点编号加偏移、线路编号加偏移，模拟邻近城市 / 市郊铁路），
+相邻两份之间用一条"城际线"在若干站点相连。数据取自仓库中的 Database/new_schema.sql，无需连接数据库：
+
+    python bench_contraction.py [--scale 10] [--queries 1000] [--seed 0] [--dir /tmp/smartmetro_ch]
+"""
+import argparse
+import contextlib
+import random
+import tempfile
+import time
+
+from contraction import ContractionHierarchy
+from metro_graph import StationGraph
+from sql_dump import load_table
+
+# 合成网络中各份线网的站点 / 线路编号偏移
+GROUP_STRIDE = 100000
+LINE_STRIDE = 1000
+# 城际线的线路编号基数、区段时间（分钟）与每两份线网之间的连接站数
+INTERCITY_LINE = 900
+INTERCITY_TIME = 25
+INTERCITY_LINKS = 3
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+def scaled_rows(rows, scale, rng):
+    """把 Dijkstra 表复制 scale 份并用城际线串联"""
+    groups = sorted({row['from_station_travel_group'] for row in rows})
+    result = []
+    for copy in range(scale):
+        for row in rows:
+            row = dict(row)
+            row['from_station_travel_group'] += copy * GROUP_STRIDE
+            row['to_station_travel_group'] += copy * GROUP_STRIDE
+            row['line_id'] += copy * LINE_STRIDE
+            row['from_station_cn'] = f"{row['from_station_cn']}#{copy}"
+            row['to_station_cn'] = f"{row['to_station_cn']}#{copy}"
+            row['from_station_en'] = f"{row['from_station_en']}#{copy}"
+            row['to_station_en'] = f"{row['to_station_en']}#{copy}"
+            result.append(row)
+        if copy == 0:
+            continue
+        for link, group in enumerate(rng.sample(groups, INTERCITY_LINKS)):
+            result.append({
+                'from_station_travel_group': group + (copy - 1) * GROUP_STRIDE,
+                'to_station_travel_group': group + copy * GROUP_STRIDE,
+                'travel_time': INTERCITY_TIME,
+                'line_id': INTERCITY_LINE + link,
+                'from_station_cn': f'城际{copy}-{link}A', 'to_station_cn': f'城际{copy}-{link}B',
+                'from_station_en': f'Intercity {copy}-{link}A', 'to_station_en': f'Intercity {copy}-{link}B'
+            })
+    return result
+
+
+def measure(route, pairs):
+    samples = []
+    for start_group, end_group in pairs:
+        begin = time.perf_counter()
+        route(start_group, end_group)
+        samples.append((time.perf_counter() - begin) * 1000)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', type=int, default=10)
+    parser.add_argument('--queries', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--dir', help='收缩层次文件目录，默认使用临时目录')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    rows = [row for row in load_table('Dijkstra')
+            if row['from_station_cn'] is not None and row['to_station_cn'] is not None]
+    # 未指定 --dir 时使用临时目录，运行结束后删除
+    with (contextlib.nullcontext(args.dir) if args.dir
+          else tempfile.TemporaryDirectory(prefix='smartmetro_ch_')) as directory:
+        print(f"{'network':<10}{'nodes':>8}{'engine':>10}{'build s':>10}{'KiB':>8}"
+              f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'wrong':>8}")
+        for scale in sorted({1, args.scale}):
+            station_graph = StationGraph().load_rows(scaled_rows(rows, scale, rng) if scale > 1 else rows)
+            station_graph.version = station_graph.compute_version()
+            nodes = sorted(station_graph.graph)
+            pairs = [(rng.choice(nodes), rng.choice(nodes)) for _ in range(args.queries)]
+
+            begin = time.perf_counter()
+            hierarchy = ContractionHierarchy.load_or_build(station_graph, directory)
+            build_seconds = time.perf_counter() - begin
+
+            wrong = sum(
+                1 for s, e in pairs[:200]
+                if (hierarchy.route(s, e) or {}).get('total_time')
+                != (station_graph.dijkstra_shortest_path(s, e) or {}).get('total_time')
+            )
+            label = f'{scale}x'
+            for engine, route, seconds, size in (
+                ('dijkstra', station_graph.dijkstra_shortest_path, 0, 0),
+                ('ch', hierarchy.route, build_seconds, hierarchy.nbytes()),
+            ):
+                samples = measure(route, pairs)
+                print(f"{label:<10}{len(nodes):>8}{engine:>10}{seconds:>10.2f}{size / 1024:>8.0f}"
+                      f"{percentile(samples, 50):>10.3f}{percentile(samples, 95):>10.3f}{percentile(samples, 99):>10.3f}"
+                      f"{wrong if engine == 'ch' else 0:>8}")
+        if args.dir:
+            print(f"收缩层次目录: {directory}（按图版本分子目录，再次运行直接加载）")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,328 @@
+"""
+路线引擎基准：仓库中每一份 StationGraph 实现的延迟、内存与结果正确性
+
+引擎包括 main.py 使用的 metro_graph（字典 / CSR / 收缩层次 / 全源最短路表）以及各独立副本：
+Original_APIs/Dijkstra.py、Original_APIs/Dijkstra with transfer considered.py、
+Android 的 MetroInfo_backend/Dijkstra.py 和两份 app.py。各副本只取出 StationGraph 类，
+build_graph 连接的是一个按 Dijkstra 表返回数据的本地替身，不需要 MySQL。
+
+精确参考值由 isochrone.TravelTimeMatrix（展开图上的向量化 Bellman-Ford，与 Dijkstra 无关的实现）给出；
+总时间与参考值不同、或 lines / times 与 total_time 对不上的结果计为 "差异"。
+
+数据默认取自 Database/new_schema.sql，也可用 --source 指定其他 .sql 转储或 .csv / .json / .jsonl 导出：
+
+    python bench_engines.py [--sample 5000] [--engines main,android_dijkstra] \\
+        [--max-diffs 0] [--max-p99-ms 20] [--thresholds thresholds.json] [--json report.json]
+
+默认跑全部 OD 对。任一引擎超出阈值时以退出码 1 结束。--thresholds 为按引擎覆盖的阈值，例如
+{"original_dijkstra": {"max_diffs": null}, "main_ch": {"max_p99_ms": 2}}，null 表示不检查。
+"""
+import argparse
+import ast
+import csv
+import gc
+import heapq
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from itertools import count
+
+from all_pairs import AllPairsTable
+from contraction import ContractionHierarchy
+from csr_graph import CSRStationGraph
+from isochrone import TravelTimeMatrix, UNREACHABLE
+from metro_graph import StationGraph, TRANSFER_TIME
+from sql_dump import DEFAULT_DUMP, load_table
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.abspath(os.path.join(HERE, '..', '..'))
+
+# 独立副本：引擎名 -> 源文件（相对仓库根目录）
+COPIES = {
+    'original_dijkstra': 'Flask API/Original_APIs/Dijkstra.py',
+    'transfer_considered': 'Flask API/Original_APIs/Dijkstra with transfer considered.py',
+    'android_dijkstra': 'Android/MetroInfo/MetroInfo_backend/MetroInfo_backend/Dijkstra.py',
+    'android_app': 'Android/MetroInfo/MetroInfo_backend/app.py',
+    'android_adapted_app': 'Flask API/Android_Adapted_APIs/MetroInfo_backend/app.py',
+}
+ENGINES = ('main', 'main_csr', 'main_ch', 'main_all_pairs') + tuple(COPIES)
+
+THRESHOLD_KEYS = ('max_diffs', 'max_p50_ms', 'max_p95_ms', 'max_p99_ms', 'max_heap_kib')
+
+
+class _RowsCursor:
+    """只服务 build_graph 中那一条 Dijkstra 查询的游标替身"""
+
+    def __init__(self, rows):
+        self._rows = rows
+        self._result = []
+
+    def execute(self, sql, params=None):
+        self._result = list(self._rows)
+
+    def fetchall(self):
+        result, self._result = self._result, []
+        return result
+
+    def fetchone(self):
+        return self._result.pop(0) if self._result else None
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def close(self):
+        pass
+
+
+class RowsConnection:
+    """数据库连接替身：任意查询都返回 Dijkstra 表中站名非空的行"""
+
+    def __init__(self, rows):
+        self.rows = [row for row in rows
+                     if row['from_station_cn'] is not None and row['to_station_cn'] is not None]
+
+    def cursor(self, dictionary=False, **kwargs):
+        return _RowsCursor(self.rows)
+
+    def is_connected(self):
+        return True
+
+    def close(self):
+        pass
+
+
+def load_rows(source):
+    """从 .sql 转储或 .csv / .json / .jsonl 导出读取 Dijkstra 表"""
+    if source.endswith('.sql'):
+        return load_table('Dijkstra', source)
+
+    with open(source, encoding='utf-8') as f:
+        if source.endswith('.csv'):
+            rows = list(csv.DictReader(f))
+        elif source.endswith('.jsonl'):
+            rows = [json.loads(line) for line in f if line.strip()]
+        else:
+            rows = json.load(f)
+
+    for row in rows:
+        for key in ('from_station_travel_group', 'to_station_travel_group', 'travel_time', 'line_id'):
+            row[key] = int(row[key])
+        for key in ('from_station_cn', 'to_station_cn', 'from_station_en', 'to_station_en'):
+            if row.get(key) in ('', 'NULL'):
+                row[key] = None
+    return rows
+
+
+def load_copy_class(path, connection):
+    """
+    只执行源文件中的 import 语句和 StationGraph 类定义，不启动 Flask 应用、不建立连接池；
+    get_db_connection 指向替身连接
+    """
+    with open(path, encoding='utf-8') as f:
+        tree = ast.parse(f.read(), path)
+
+    namespace = {
+        '__name__': f'bench_copy_{abs(hash(path))}',
+        'heapq': heapq,
+        'count': count,
+        'logging': logging,
+        'logger': logging.getLogger(os.path.basename(path)),
+        'get_db_connection': lambda: connection,
+    }
+    for node in tree.body:
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            try:
+                exec(compile(ast.Module(body=[node], type_ignores=[]), path, 'exec'), namespace)
+            except ImportError:
+                pass
+    classes = [node for node in tree.body if isinstance(node, ast.ClassDef) and node.name == 'StationGraph']
+    if not classes:
+        raise ValueError(f'{path} 中没有 StationGraph 类')
+    exec(compile(ast.Module(body=classes, type_ignores=[]), path, 'exec'), namespace)
+    # 类体外引用的 get_db_connection 可能被 import 覆盖，这里重新指向替身
+    namespace['get_db_connection'] = lambda: connection
+    return namespace['StationGraph']
+
+
+def copy_builder(path, connection):
+    """加载副本的 StationGraph 类，返回构建该图并给出查询函数的闭包（类加载与 import 不计入构建开销）"""
+    cls = load_copy_class(path, connection)
+    if '_get_db_connection' in vars(cls):
+        # Android 的 Dijkstra.py 以 db_config 构造、在构造函数中自行连接并建图
+        cls = type(cls.__name__, (cls,), {'_get_db_connection': lambda self: connection})
+
+        def build():
+            return cls({}).dijkstra_shortest_path
+    else:
+        def build():
+            graph = cls()
+            graph.build_graph()
+            return graph.dijkstra_shortest_path
+    return build
+
+
+def engine_builder(name, connection, tmpdir):
+    """返回构建引擎的闭包，闭包返回按 (起点, 终点) 查询的函数"""
+    if name in COPIES:
+        return copy_builder(os.path.join(REPO_ROOT, COPIES[name]), connection)
+    if name not in ENGINES:
+        raise ValueError(f'未知引擎 {name}')
+
+    def build():
+        graph = StationGraph()
+        graph.build_graph(lambda: connection)
+        graph.version = graph.compute_version()
+        if name == 'main_csr':
+            directory = os.path.join(tmpdir, 'csr')
+            CSRStationGraph.from_station_graph(graph).save(directory)
+            return CSRStationGraph.load(directory).dijkstra_shortest_path
+        if name == 'main_ch':
+            return ContractionHierarchy.build(graph).route
+        if name == 'main_all_pairs':
+            return AllPairsTable.build(graph).route
+        return graph.dijkstra_shortest_path
+    return build
+
+
+def measure_build(build):
+    """返回 (查询函数, 构建耗时秒, 构建后驻留的 Python 堆字节数)"""
+    gc.collect()
+    tracemalloc.start()
+    begin = time.perf_counter()
+    route = build()
+    seconds = time.perf_counter() - begin
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return route, seconds, current
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+def is_consistent(result):
+    """带 lines / times 的结果，重新计算的耗时应与 total_time 相同"""
+    if 'lines' not in result or 'times' not in result:
+        return True
+    lines, times = result['lines'], result['times']
+    if len(result['path']) != len(lines) + 1 or len(lines) != len(times):
+        return False
+    transfers = sum(1 for a, b in zip(lines, lines[1:]) if a != b)
+    return sum(times) + TRANSFER_TIME * transfers == result['total_time']
+
+
+def run_engine(route, pairs, reference):
+    samples = []
+    diffs = []
+    for start_group, end_group in pairs:
+        begin = time.perf_counter()
+        result = route(start_group, end_group)
+        samples.append((time.perf_counter() - begin) * 1000)
+
+        expected = reference(start_group, end_group)
+        actual = result['total_time'] if result else None
+        if actual != expected or (result and not is_consistent(result)):
+            diffs.append((start_group, end_group, expected, actual))
+    return samples, diffs
+
+
+def check_thresholds(name, report, defaults, overrides):
+    limits = dict(defaults)
+    limits.update(overrides.get(name, {}))
+    values = {
+        'max_diffs': report['diffs'],
+        'max_p50_ms': report['p50_ms'],
+        'max_p95_ms': report['p95_ms'],
+        'max_p99_ms': report['p99_ms'],
+        'max_heap_kib': report['heap_kib'],
+    }
+    return [
+        f"{name}: {key[4:]} = {values[key]} 超过阈值 {limits[key]}"
+        for key in THRESHOLD_KEYS
+        if limits.get(key) is not None and values[key] > limits[key]
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--source', default=DEFAULT_DUMP, help='Dijkstra 表来源（.sql / .csv / .json / .jsonl）')
+    parser.add_argument('--engines', default=','.join(ENGINES), help='逗号分隔的引擎名')
+    parser.add_argument('--sample', type=int, help='随机抽取的 OD 对数量，默认全部')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--thresholds', help='按引擎覆盖阈值的 JSON 文件')
+    parser.add_argument('--json', help='把结果写入该 JSON 文件')
+    parser.add_argument('--show-diffs', type=int, default=3, help='每个引擎打印的差异样例数')
+    for key in THRESHOLD_KEYS:
+        parser.add_argument('--' + key.replace('_', '-'), type=float, dest=key)
+    args = parser.parse_args()
+
+    engines = [name.strip() for name in args.engines.split(',') if name.strip()]
+    unknown = [name for name in engines if name not in ENGINES]
+    if unknown:
+        parser.error(f"未知引擎: {', '.join(unknown)}；可选 {', '.join(ENGINES)}")
+
+    connection = RowsConnection(load_rows(args.source))
+    reference_graph = StationGraph()
+    reference_graph.build_graph(lambda: connection)
+    matrix = TravelTimeMatrix.build(reference_graph)
+
+    def reference(start_group, end_group):
+        value = int(matrix.time[matrix.index[start_group], matrix.index[end_group]])
+        return None if value == UNREACHABLE else value
+
+    nodes = matrix.nodes
+    pairs = [(s, e) for s in nodes for e in nodes]
+    if args.sample and args.sample < len(pairs):
+        pairs = random.Random(args.seed).sample(pairs, args.sample)
+
+    defaults = {key: getattr(args, key) for key in THRESHOLD_KEYS}
+    overrides = {}
+    if args.thresholds:
+        with open(args.thresholds, encoding='utf-8') as f:
+            overrides = json.load(f)
+
+    print(f"节点 {len(nodes)}，OD 对 {len(pairs)}，数据来源 {args.source}")
+    print(f"{'engine':<22}{'build s':>9}{'heap KiB':>10}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'diffs':>8}")
+
+    reports = {}
+    failures = []
+    with tempfile.TemporaryDirectory(prefix='smartmetro_bench_') as tmpdir:
+        for name in engines:
+            route, build_seconds, heap_bytes = measure_build(engine_builder(name, connection, tmpdir))
+            samples, diffs = run_engine(route, pairs, reference)
+            report = {
+                'build_s': round(build_seconds, 3),
+                'heap_kib': round(heap_bytes / 1024, 1),
+                'p50_ms': round(percentile(samples, 50), 4),
+                'p95_ms': round(percentile(samples, 95), 4),
+                'p99_ms': round(percentile(samples, 99), 4),
+                'diffs': len(diffs),
+                'diff_examples': diffs[:args.show_diffs],
+            }
+            reports[name] = report
+            print(f"{name:<22}{report['build_s']:>9.2f}{report['heap_kib']:>10.1f}{report['p50_ms']:>9.3f}"
+                  f"{report['p95_ms']:>9.3f}{report['p99_ms']:>9.3f}{report['diffs']:>8}")
+            for start_group, end_group, expected, actual in report['diff_examples']:
+                print(f"{'':<4}{start_group} -> {end_group}: 参考 {expected}，实际 {actual}")
+            failures.extend(check_thresholds(name, report, defaults, overrides))
+            del route
+            gc.collect()
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'pairs': len(pairs), 'engines': reports, 'failures': failures}, f, ensure_ascii=False, indent=2)
+
+    if failures:
+        print('\n'.join(['', '超出阈值:'] + failures))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
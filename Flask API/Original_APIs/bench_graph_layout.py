@@ -0,0 +1,89 @@
+"""
+图结构内存 / 延迟基准：字典邻接表 (StationGraph) 对比 CSR 数组 (CSRStationGraph)
+
+数据取自仓库中的 Database/new_schema.sql，无需连接数据库：
+
+    python bench_graph_layout.py [--queries 2000] [--seed 0] [--dir /dev/shm/smartmetro_csr]
+"""
+import argparse
+import contextlib
+import gc
+import random
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+from csr_graph import CSRStationGraph
+from metro_graph import StationGraph
+from sql_dump import load_table
+
+
+def measure_heap(build):
+    """返回 (对象, 构建后仍驻留的 Python 堆字节数)"""
+    gc.collect()
+    tracemalloc.start()
+    obj = build()
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return obj, current
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+def measure_latency(station_graph, pairs):
+    samples = []
+    for start_group, end_group in pairs:
+        begin = time.perf_counter()
+        station_graph.dijkstra_shortest_path(start_group, end_group)
+        samples.append((time.perf_counter() - begin) * 1000)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--dir', help='CSR 文件目录，默认使用临时目录')
+    args = parser.parse_args()
+
+    rows = [row for row in load_table('Dijkstra')
+            if row['from_station_cn'] is not None and row['to_station_cn'] is not None]
+
+    dict_graph, dict_bytes = measure_heap(lambda: StationGraph().load_rows(rows))
+    dict_graph.version = dict_graph.compute_version()
+
+    # 未指定 --dir 时使用临时目录，运行结束后删除
+    with (contextlib.nullcontext(args.dir) if args.dir
+          else tempfile.TemporaryDirectory(prefix='smartmetro_csr_')) as directory:
+        CSRStationGraph.from_station_graph(dict_graph).save(directory)
+        csr_graph, csr_heap = measure_heap(lambda: CSRStationGraph.load(directory))
+
+        rng = random.Random(args.seed)
+        nodes = sorted(dict_graph.graph)
+        pairs = [(rng.choice(nodes), rng.choice(nodes)) for _ in range(args.queries)]
+
+        mismatches = sum(
+            1 for s, e in pairs[:200]
+            if (dict_graph.dijkstra_shortest_path(s, e) or {}).get('total_time')
+            != (csr_graph.dijkstra_shortest_path(s, e) or {}).get('total_time')
+        )
+
+        print(f"节点 {len(nodes)}，有向边 {sum(len(v) for v in dict_graph.graph.values())}，查询 {len(pairs)} 次")
+        print(f"{'layout':<8}{'heap KiB':>12}{'mmap KiB':>12}{'p50 ms':>10}{'p95 ms':>10}{'mean ms':>10}")
+        for name, graph, heap_bytes, mapped_bytes in (
+            ('dict', dict_graph, dict_bytes, 0),
+            ('csr', csr_graph, csr_heap, csr_graph.nbytes()),
+        ):
+            samples = measure_latency(graph, pairs)
+            print(f"{name:<8}{heap_bytes / 1024:>12.1f}{mapped_bytes / 1024:>12.1f}"
+                  f"{percentile(samples, 50):>10.3f}{percentile(samples, 95):>10.3f}{statistics.mean(samples):>10.3f}")
+        print(f"CSR 文件目录: {args.dir or '临时目录（已删除）'}；前 200 次查询结果不一致: {mismatches}")
+
+
+if __name__ == '__main__':
+    main()
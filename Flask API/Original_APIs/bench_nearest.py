@@ -0,0 +1,128 @@
+"""
+最近站点基准：原逐行扫描 station_map（每次解析 all_stations / associated_lines、逐行计算距离）与网格空间索引的延迟，
+以及批量匹配（nearest_many，GPS 轨迹）的吞吐
+
+数据取自仓库中的 Database/new_schema.sql，无需连接数据库；原实现每次请求另有一次全表查询，未计入：
+
+    python bench_nearest.py [--queries 5000] [--limit 5] [--cell-km 2] [--seed 0]
+"""
+import argparse
+import math
+import random
+import time
+
+import numpy as np
+
+from sql_dump import load_table
+from station_locator import StationLocator, DEFAULT_CELL_KM
+
+# 与 /smartmetro/nearest_stations 的参数校验相同
+LAT_RANGE = (30.5, 32.5)
+LNG_RANGE = (120.8, 122.2)
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    R = 6371  # 地球半径km
+    lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+    a = math.sin(dlat/2)**2 + math.cos(lat1)*math.cos(lat2)*math.sin(dlon/2)**2
+    return R * 2 * math.asin(math.sqrt(a))
+
+
+def full_scan(stations, user_lat, user_lng, max_results):
+    """原 get_nearest_stations 的逐行处理（不含查询）"""
+    seen_groups = {}
+    for station in stations:
+        travel_group = str(station.get('travel_group', '')).strip()
+        if not travel_group:
+            continue
+        if travel_group not in seen_groups:
+            distance_km = haversine(user_lat, user_lng, float(station['latitude']), float(station['longitude']))
+            all_stations = [
+                s.strip('"\' ') for s in station['all_stations'].split(',') if s.strip()
+            ]
+            associated_lines = [
+                int(line.strip()) for line in (station['associated_lines'] or '').split(',')
+                if line.strip().isdigit()
+            ]
+            seen_groups[travel_group] = {
+                "stat_id": station['stat_id'],
+                "name_cn": station['name_cn'],
+                "name_en": station['name_en'],
+                "travel_group": travel_group,
+                "distance_m": round(distance_km * 1000),
+                "line_info": {
+                    "line": station['line'],
+                    "all_stations": all_stations
+                },
+                "associated_lines": associated_lines
+            }
+    return sorted(seen_groups.values(), key=lambda x: x['distance_m'])[:max_results]
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--queries', type=int, default=5000)
+    parser.add_argument('--limit', type=int, default=5)
+    parser.add_argument('--cell-km', type=float, default=DEFAULT_CELL_KM)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rows = [row for row in load_table('station_map') if row['latitude'] is not None and row['longitude'] is not None]
+    begin = time.perf_counter()
+    locator = StationLocator(None, cell_km=args.cell_km)
+    locator.grid = locator.build(rows, args.cell_km)
+    locator.checked_at = float('inf')  # 不访问数据库
+    build_ms = (time.perf_counter() - begin) * 1000
+
+    rng = random.Random(args.seed)
+    points = [(rng.uniform(*LAT_RANGE), rng.uniform(*LNG_RANGE)) for _ in range(args.queries // 2)]
+    # 一半查询落在站点附近（约 3 公里内），更接近真实请求
+    for _ in range(args.queries - len(points)):
+        row = rng.choice(rows)
+        points.append((float(row['latitude']) + rng.uniform(-0.03, 0.03), float(row['longitude']) + rng.uniform(-0.03, 0.03)))
+
+    print(f"station_map {len(rows)} 行，{len(locator.grid)} 个 travel_group，网格 {len(locator.grid.cells)} 格"
+          f"（边长 {args.cell_km} km），构建（含批量候选表）{build_ms:.1f} ms；查询 {len(points)} 次，limit={args.limit}")
+    print(f"{'engine':<12}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'wrong':>8}")
+
+    reference = []
+    samples = []
+    for lat, lng in points:
+        begin = time.perf_counter()
+        reference.append(full_scan(rows, lat, lng, args.limit))
+        samples.append((time.perf_counter() - begin) * 1000)
+    print(f"{'full_scan':<12}{percentile(samples, 50):>10.3f}{percentile(samples, 95):>10.3f}{percentile(samples, 99):>10.3f}{0:>8}")
+
+    samples = []
+    wrong = 0
+    for (lat, lng), expected in zip(points, reference):
+        begin = time.perf_counter()
+        result = locator.nearest(lat, lng, args.limit)
+        samples.append((time.perf_counter() - begin) * 1000)
+        # 距离相同（取整到米）的站点先后可能不同，只比较距离序列
+        if [s['distance_m'] for s in result] != [s['distance_m'] for s in expected]:
+            wrong += 1
+    print(f"{'grid':<12}{percentile(samples, 50):>10.3f}{percentile(samples, 95):>10.3f}{percentile(samples, 99):>10.3f}{wrong:>8}")
+
+    lats, lngs = np.array(points).T
+    table = locator.grid.candidates[-1]
+    begin = time.perf_counter()
+    _, distances = locator.grid.nearest_many(lats, lngs)
+    batch_ms = (time.perf_counter() - begin) * 1000
+    wrong = sum(
+        1 for distance_km, expected in zip(distances.tolist(), reference)
+        if round(distance_km * 1000) != expected[0]['distance_m']
+    )
+    print(f"batch       候选表 {table.shape[0]} 格 × {table.shape[1]} 列，{len(points)} 个点共 {batch_ms:.1f} ms"
+          f"（{batch_ms * 1000 / len(points):.3f} µs/点），wrong {wrong}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""
+搜索算法基准：Dijkstra / A*（直线距离 ÷ 最高线路速度）/ 双向 Dijkstra 的已确定节点数与延迟
+
+数据取自仓库中的 Database/new_schema.sql，无需连接数据库：
+
+    python bench_search.py [--queries 2000] [--seed 0]
+"""
+import argparse
+import random
+import statistics
+import time
+
+from goal_directed import SEARCH_ALGORITHMS, StationCoordinates, search_with_stats
+from metro_graph import StationGraph
+from sql_dump import load_table
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rows = [row for row in load_table('Dijkstra')
+            if row['from_station_cn'] is not None and row['to_station_cn'] is not None]
+    station_graph = StationGraph().load_rows(rows)
+    station_graph.coordinates = StationCoordinates.from_rows(load_table('station_map'), station_graph)
+
+    rng = random.Random(args.seed)
+    nodes = sorted(station_graph.graph)
+    pairs = [(rng.choice(nodes), rng.choice(nodes)) for _ in range(args.queries)]
+
+    print(f"节点 {len(nodes)}，查询 {len(pairs)} 次，最高线路速度 "
+          f"{station_graph.coordinates.max_speed * 60:.1f} km/h，坐标覆盖全部站点: "
+          f"{station_graph.coordinates.covers(station_graph)}")
+    print(f"{'algorithm':<15}{'states':>10}{'nodes':>10}{'vs dijkstra':>13}{'p50 ms':>10}{'p95 ms':>10}{'wrong':>8}")
+
+    reference = [station_graph.dijkstra_shortest_path(s, e) for s, e in pairs]
+    baseline = None
+    for algorithm in SEARCH_ALGORITHMS:
+        states, settled_nodes, samples = [], [], []
+        wrong = 0
+        for (start_group, end_group), expected in zip(pairs, reference):
+            begin = time.perf_counter()
+            result, stats = search_with_stats(station_graph, start_group, end_group, algorithm)
+            samples.append((time.perf_counter() - begin) * 1000)
+            states.append(stats['settled_states'])
+            settled_nodes.append(stats['settled_nodes'])
+            if (result or {}).get('total_time') != (expected or {}).get('total_time'):
+                wrong += 1
+        mean_states = statistics.mean(states)
+        baseline = baseline or mean_states
+        print(f"{algorithm:<15}{mean_states:>10.1f}{statistics.mean(settled_nodes):>10.1f}"
+              f"{mean_states / baseline:>13.2f}{percentile(samples, 50):>10.3f}{percentile(samples, 95):>10.3f}{wrong:>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,354 @@
+import heapq
+import json
+import logging
+import os
+from itertools import count
+
+import numpy as np
+
+from metro_graph import TRANSFER_TIME
+
+logger = logging.getLogger(__name__)
+
+ARRAY_NAMES = (
+    'groups', 'group_offsets', 'node_group', 'node_line',
+    'rank', 'up_offsets', 'up_targets', 'up_weights', 'up_middles'
+)
+META_FILE = 'meta.json'
+
+# 原始边（非捷径）的 middle 标记
+ORIGINAL_EDGE = -1
+# 见证搜索最多确定的节点数，超过后按需添加捷径（只会多加边，不影响正确性）
+WITNESS_SETTLE_LIMIT = 60
+
+
+def _int_view(array):
+    array = np.ascontiguousarray(array, dtype=np.int32)
+    return memoryview(array).cast('B').cast('i')
+
+
+def _expand(station_graph):
+    """
+    按线路展开：节点为 (travel_group, line_id)，即某站某线的站台
+    同线相邻站之间为行驶边，同站不同线之间为换乘边（TRANSFER_TIME），
+    展开图上的最短路与 StationGraph 换乘惩罚模型下的最短路一一对应。
+    """
+    platforms = sorted({
+        (group, line_id)
+        for node, edges in station_graph.graph.items()
+        for neighbor, _, line_id in edges
+        for group in (node, neighbor)
+    })
+    index = {platform: i for i, platform in enumerate(platforms)}
+
+    adjacency = [dict() for _ in platforms]
+
+    def connect(a, b, weight):
+        if a != b and weight < adjacency[a].get(b, (float('inf'),))[0]:
+            adjacency[a][b] = (weight, ORIGINAL_EDGE)
+            adjacency[b][a] = (weight, ORIGINAL_EDGE)
+
+    for node, edges in station_graph.graph.items():
+        for neighbor, time, line_id in edges:
+            connect(index[(node, line_id)], index[(neighbor, line_id)], time)
+
+    by_group = {}
+    for i, (group, _) in enumerate(platforms):
+        by_group.setdefault(group, []).append(i)
+    for members in by_group.values():
+        for a in members:
+            for b in members:
+                if a < b:
+                    connect(a, b, TRANSFER_TIME)
+    return platforms, adjacency
+
+
+def _witness_distances(adjacency, source, skip, limit, settle_limit=WITNESS_SETTLE_LIMIT):
+    """从 source 出发、绕开 skip 的有限 Dijkstra，返回已知的距离上界"""
+    dist = {source: 0}
+    heap = [(0, source)]
+    settled = 0
+    while heap and settled < settle_limit:
+        d, node = heapq.heappop(heap)
+        if d > dist[node]:
+            continue
+        if d > limit:
+            break
+        settled += 1
+        for neighbor, (weight, _) in adjacency[node].items():
+            if neighbor == skip:
+                continue
+            nd = d + weight
+            if nd < dist.get(neighbor, float('inf')):
+                dist[neighbor] = nd
+                heapq.heappush(heap, (nd, neighbor))
+    return dist
+
+
+def _shortcuts(adjacency, node):
+    """收缩 node 需要添加的捷径 [(u, w, 权重)]"""
+    neighbors = list(adjacency[node].items())
+    shortcuts = []
+    for i, (u, (weight_u, _)) in enumerate(neighbors):
+        targets = neighbors[i + 1:]
+        if not targets:
+            continue
+        limit = weight_u + max(weight for _, (weight, _) in targets)
+        dist = _witness_distances(adjacency, u, node, limit)
+        for w, (weight_w, _) in targets:
+            via = weight_u + weight_w
+            if dist.get(w, float('inf')) > via:
+                shortcuts.append((u, w, via))
+    return shortcuts
+
+
+class ContractionHierarchy:
+    """
+    展开图上的收缩层次（Contraction Hierarchy）
+
+    预处理按"边差 + 已收缩邻居数"的顺序逐个收缩站台节点，必要时添加捷径边，
+    捷径记录被收缩的中间节点 middle，查询后递归展开还原为原始区段。
+    查询从起点所有站台、终点所有站台同时向上（只走向更高 rank 的节点）做双向搜索，
+    各自确定的节点数只与层次深度有关，网络规模扩大时延迟基本不变。
+    只支持不带附加代价的查询（comfort 模式仍走实时搜索）。
+
+    - rank[v]                         收缩顺序，越晚收缩越高
+    - up_*[up_offsets[v]:up_offsets[v+1]]  v 指向更高 rank 节点的边（目标、权重、捷径中间节点）
+    """
+
+    def __init__(self, arrays, version=None):
+        for name in ARRAY_NAMES:
+            setattr(self, name, arrays[name])
+        self.version = version
+        self.index = {group.item(): i for i, group in enumerate(self.groups)}
+        self._group_offsets = _int_view(self.group_offsets)
+        self._node_group = _int_view(self.node_group)
+        self._node_line = _int_view(self.node_line)
+        self._rank = _int_view(self.rank)
+        self._up_offsets = _int_view(self.up_offsets)
+        self._up_targets = _int_view(self.up_targets)
+        self._up_weights = _int_view(self.up_weights)
+        self._up_middles = _int_view(self.up_middles)
+
+    @classmethod
+    def build(cls, station_graph):
+        platforms, adjacency = _expand(station_graph)
+        n = len(platforms)
+        rank = [0] * n
+        contracted_neighbors = [0] * n
+        upward = [None] * n
+        shortcut_count = 0
+
+        def priority(node):
+            return len(_shortcuts(adjacency, node)) - len(adjacency[node]) + contracted_neighbors[node]
+
+        tie = count()
+        heap = [(priority(node), next(tie), node) for node in range(n)]
+        heapq.heapify(heap)
+        next_rank = 0
+        while heap:
+            _, _, node = heapq.heappop(heap)
+            # 惰性更新：重新计算优先级，仍不大于堆顶才收缩
+            current = priority(node)
+            if heap and current > heap[0][0]:
+                heapq.heappush(heap, (current, next(tie), node))
+                continue
+
+            for u, w, weight in _shortcuts(adjacency, node):
+                if weight < adjacency[u].get(w, (float('inf'),))[0]:
+                    adjacency[u][w] = (weight, node)
+                    adjacency[w][u] = (weight, node)
+                    shortcut_count += 1
+            upward[node] = sorted((target, weight, middle) for target, (weight, middle) in adjacency[node].items())
+            for neighbor in adjacency[node]:
+                del adjacency[neighbor][node]
+                contracted_neighbors[neighbor] += 1
+            adjacency[node] = {}
+            rank[node] = next_rank
+            next_rank += 1
+
+        groups = sorted({group for group, _ in platforms})
+        group_index = {group: i for i, group in enumerate(groups)}
+        group_offsets = [0] * (len(groups) + 1)
+        for group, _ in platforms:
+            group_offsets[group_index[group] + 1] += 1
+        for i in range(len(groups)):
+            group_offsets[i + 1] += group_offsets[i]
+
+        up_offsets = [0]
+        for edges in upward:
+            up_offsets.append(up_offsets[-1] + len(edges))
+        arrays = {
+            'groups': np.array(groups, dtype=np.int64),
+            'group_offsets': np.array(group_offsets, dtype=np.int32),
+            'node_group': np.array([group_index[group] for group, _ in platforms], dtype=np.int32),
+            'node_line': np.array([line_id for _, line_id in platforms], dtype=np.int32),
+            'rank': np.array(rank, dtype=np.int32),
+            'up_offsets': np.array(up_offsets, dtype=np.int32),
+            'up_targets': np.array([t for edges in upward for t, _, _ in edges], dtype=np.int32),
+            'up_weights': np.array([w for edges in upward for _, w, _ in edges], dtype=np.int32),
+            'up_middles': np.array([m for edges in upward for _, _, m in edges], dtype=np.int32)
+        }
+        logger.info(f"收缩层次构建完成: {n} 个站台节点, {len(arrays['up_targets'])} 条向上边, {shortcut_count} 条捷径")
+        return cls(arrays, station_graph.version)
+
+    def save(self, directory):
+        """写入 .npy 文件；先写临时文件再替换，meta.json 最后写入"""
+        os.makedirs(directory, exist_ok=True)
+        for name in ARRAY_NAMES:
+            path = os.path.join(directory, f'{name}.npy')
+            with open(path + '.tmp', 'wb') as f:
+                np.save(f, np.asarray(getattr(self, name)))
+            os.replace(path + '.tmp', path)
+
+        meta_path = os.path.join(directory, META_FILE)
+        with open(meta_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'version': self.version, 'transfer_time': TRANSFER_TIME}, f)
+        os.replace(meta_path + '.tmp', meta_path)
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        with open(os.path.join(directory, META_FILE), encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('transfer_time') != TRANSFER_TIME:
+            raise ValueError(f"收缩层次的换乘耗时为 {meta.get('transfer_time')}，与当前配置不符")
+        arrays = {
+            name: np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r' if mmap else None)
+            for name in ARRAY_NAMES
+        }
+        return cls(arrays, meta.get('version'))
+
+    @classmethod
+    def load_or_build(cls, station_graph, directory):
+        """按图版本存放在 <directory>/<版本号>/ 下，已存在则直接映射，否则构建并保存"""
+        version = station_graph.version or station_graph.compute_version()
+        path = os.path.join(directory, version)
+        try:
+            hierarchy = cls.load(path)
+            logger.info(f"已加载收缩层次: {path}")
+            return hierarchy
+        except (OSError, ValueError) as e:
+            logger.info(f"未找到可用的收缩层次，重新构建: {str(e)}")
+
+        hierarchy = cls.build(station_graph)
+        hierarchy.version = version
+        hierarchy.save(path)
+        return cls.load(path)
+
+    def nbytes(self):
+        return sum(np.asarray(getattr(self, name)).nbytes for name in ARRAY_NAMES)
+
+    def _platforms(self, group):
+        i = self.index.get(group)
+        if i is None:
+            return range(0)
+        return range(self._group_offsets[i], self._group_offsets[i + 1])
+
+    def _upward_search(self, dist, parent, other, best, heap):
+        """单步：弹出一个节点并沿向上边松弛，返回更新后的 best = (mu, 相遇节点)"""
+        d, node = heapq.heappop(heap)
+        if d > dist[node]:
+            return best
+        if node in other and d + other[node] < best[0]:
+            best = (d + other[node], node)
+        targets, weights = self._up_targets, self._up_weights
+        for e in range(self._up_offsets[node], self._up_offsets[node + 1]):
+            neighbor = targets[e]
+            nd = d + weights[e]
+            if nd < dist.get(neighbor, float('inf')):
+                dist[neighbor] = nd
+                parent[neighbor] = node
+                heapq.heappush(heap, (nd, neighbor))
+        return best
+
+    def _edge(self, a, b):
+        """a、b 之间的边 (权重, middle)，存放在 rank 较低的一端"""
+        low, high = (a, b) if self._rank[a] < self._rank[b] else (b, a)
+        for e in range(self._up_offsets[low], self._up_offsets[low + 1]):
+            if self._up_targets[e] == high:
+                return self._up_weights[e], self._up_middles[e]
+        raise KeyError((a, b))
+
+    def _unpack(self, a, b, out):
+        """把边 a-b 展开为原始边序列 [(x, y, 权重)] 追加到 out"""
+        stack = [(a, b)]
+        while stack:
+            x, y = stack.pop()
+            weight, middle = self._edge(x, y)
+            if middle == ORIGINAL_EDGE:
+                out.append((x, y, weight))
+            else:
+                stack.append((middle, y))
+                stack.append((x, middle))
+
+    def query(self, start_group, end_group):
+        """返回 (总时间, 展开后的原始边序列, 搜索确定的节点数)，不可达时总时间为 None"""
+        forward, backward = {}, {}
+        forward_parent, backward_parent = {}, {}
+        forward_heap, backward_heap = [], []
+        for node in self._platforms(start_group):
+            forward[node] = 0
+            forward_heap.append((0, node))
+        for node in self._platforms(end_group):
+            backward[node] = 0
+            backward_heap.append((0, node))
+
+        best = (float('inf'), None)
+        settled = 0
+        while forward_heap or backward_heap:
+            # 两侧堆顶都不小于当前最优值时停止
+            if forward_heap and forward_heap[0][0] < best[0]:
+                best = self._upward_search(forward, forward_parent, backward, best, forward_heap)
+                settled += 1
+            else:
+                forward_heap = []
+            if backward_heap and backward_heap[0][0] < best[0]:
+                best = self._upward_search(backward, backward_parent, forward, best, backward_heap)
+                settled += 1
+            else:
+                backward_heap = []
+
+        total_time, meet = best
+        if meet is None:
+            return None, [], settled
+
+        head = []
+        node = meet
+        while node in forward_parent:
+            head.append((forward_parent[node], node))
+            node = forward_parent[node]
+        head.reverse()
+        tail = []
+        node = meet
+        while node in backward_parent:
+            tail.append((node, backward_parent[node]))
+            node = backward_parent[node]
+
+        edges = []
+        for a, b in head + tail:
+            self._unpack(a, b, edges)
+        return total_time, edges, settled
+
+    def route(self, start_group, end_group):
+        """查询路线，格式与 StationGraph.dijkstra_shortest_path 相同"""
+        if start_group not in self.index or end_group not in self.index:
+            return None
+        total_time, edges, _ = self.query(start_group, end_group)
+        if total_time is None:
+            return None
+
+        groups = self.groups
+        path, lines, times = [start_group], [], []
+        for a, b, weight in edges:
+            group = self._node_group[b]
+            if group == self._node_group[a]:
+                continue  # 换乘边
+            path.append(groups[group].item())
+            lines.append(self._node_line[b])
+            times.append(weight)
+        return {
+            'path': path,
+            'lines': lines,
+            'times': times,
+            'total_time': total_time
+        }
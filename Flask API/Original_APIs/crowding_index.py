@@ -0,0 +1,157 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# 线路方向内各车厢最新拥挤等级的平均值达到该值时视为拥挤（等级 0/1/2，见 /smartmetro/crowding）
+DEFAULT_CROWD_THRESHOLD = 1.5
+# 拥挤区段的附加代价 = 行驶时间 × 该比例（分钟）
+DEFAULT_PENALTY_RATIO = 0.5
+# 从数据库增量拉取新上报记录的最小间隔（秒）
+DEFAULT_REFRESH_SECONDS = 10
+
+# Dijkstra 表中每条边对应的运行方向：沿 station_path_order 顺序为上行 (path_id=0)，反之为下行 (path_id=1)，
+# 与 coach_congestion.path_id 的约定一致
+EDGE_DIRECTION_QUERY = """
+    SELECT
+        d.from_station_travel_group,
+        d.to_station_travel_group,
+        d.line_id,
+        d.travel_time,
+        MIN(CASE WHEN a.station_order < b.station_order THEN 0 ELSE 1 END) AS path_id
+    FROM Dijkstra d
+    JOIN station_path_order a ON a.station_id = d.from_station AND a.line = d.line_id
+    JOIN station_path_order b ON b.station_id = d.to_station AND b.path_id = a.path_id AND b.line = a.line
+    GROUP BY d.id, d.from_station_travel_group, d.to_station_travel_group, d.line_id, d.travel_time
+"""
+
+NEW_REPORTS_QUERY = """
+    SELECT id, line_number, line_carriage, crowd_level, path_id
+    FROM coach_congestion
+    WHERE id > %s
+    ORDER BY id
+"""
+
+
+class CrowdingIndex:
+    """
+    各线路、各方向的车厢拥挤度内存汇总，供 mode=comfort 的路线规划使用
+
+    latest 中保存每节车厢最新一条上报（按自增 id 判断先后）。本进程收到的上报通过 apply 立即生效，
+    其他 worker 写入的上报按 id 增量拉取，路线查询本身不访问数据库。
+    """
+
+    def __init__(self, get_connection, threshold=DEFAULT_CROWD_THRESHOLD,
+                 penalty_ratio=DEFAULT_PENALTY_RATIO, refresh_seconds=DEFAULT_REFRESH_SECONDS):
+        self._get_connection = get_connection
+        self.threshold = threshold
+        self.penalty_ratio = penalty_ratio
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        self.latest = {}      # (line_number, path_id, line_carriage) -> (id, crowd_level)
+        self.directions = {}  # (from_group, to_group, line_id) -> (path_id, travel_time)
+        self.last_id = 0
+        self.refreshed_at = None
+        self._penalties = None
+        self._generation = 0  # 拥挤状态每变化一次加一，用于丢弃构建期间已过期的 penalties
+
+    @property
+    def version(self):
+        """拥挤状态版本号，每次汇总变化后递增，可作为缓存键"""
+        return self._generation
+
+    def _invalidate(self):
+        self._penalties = None
+        self._generation += 1
+
+    def _query(self, sql, params=()):
+        conn = None
+        cursor = None
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+        finally:
+            if cursor:
+                cursor.close()
+            if conn:
+                conn.close()
+
+    def load_directions(self):
+        """加载边的运行方向，线路数据变化（图快照切换）后需重新调用"""
+        directions = {}
+        for row in self._query(EDGE_DIRECTION_QUERY):
+            from_group, to_group = row['from_station_travel_group'], row['to_station_travel_group']
+            directions[(from_group, to_group, row['line_id'])] = (row['path_id'], row['travel_time'])
+            # Dijkstra 表中每个区段只有一个方向的记录（同方向各重复一行），反向边取相反方向；
+            # 若表中另有反向记录，以该记录为准
+            directions.setdefault((to_group, from_group, row['line_id']), (1 - row['path_id'], row['travel_time']))
+        with self._lock:
+            self.directions = directions
+            self._invalidate()
+        logger.info(f"拥挤度索引已加载 {len(directions)} 条边的运行方向")
+
+    def apply(self, line_number, line_carriage, path_id, crowd_level, report_id):
+        """记录一条上报；report_id 为 coach_congestion.id，旧于已有记录时忽略"""
+        key = (line_number, path_id, line_carriage)
+        with self._lock:
+            previous = self.latest.get(key)
+            if previous is not None and previous[0] > report_id:
+                return
+            self.latest[key] = (report_id, crowd_level)
+            if previous is None or previous[1] != crowd_level:
+                self._invalidate()
+
+    def clear(self):
+        with self._lock:
+            self.latest = {}
+            self.last_id = 0
+            self._invalidate()
+
+    def refresh(self):
+        """拉取 last_id 之后的新上报；表被清空过（最大 id 回退）时重新开始"""
+        max_id = self._query("SELECT MAX(id) AS max_id FROM coach_congestion")[0]['max_id'] or 0
+        if max_id < self.last_id:
+            self.clear()
+        for row in self._query(NEW_REPORTS_QUERY, (self.last_id,)):
+            self.apply(row['line_number'], row['line_carriage'], row['path_id'], row['crowd_level'], row['id'])
+            self.last_id = row['id']
+        self.refreshed_at = time.monotonic()
+
+    def levels(self):
+        """{(line_number, path_id): 各车厢最新拥挤等级的平均值}"""
+        totals = {}
+        with self._lock:
+            for (line_number, path_id, _), (_, crowd_level) in self.latest.items():
+                total, carriages = totals.get((line_number, path_id), (0, 0))
+                totals[(line_number, path_id)] = (total + crowd_level, carriages + 1)
+        return {key: total / carriages for key, (total, carriages) in totals.items()}
+
+    def penalties(self):
+        """
+        {(from_group, to_group, line_id): 附加分钟数}，只包含拥挤方向上的边
+        返回的字典在拥挤状态变化前保持不变，可直接传给路线搜索或子进程
+        """
+        if self.refreshed_at is None or time.monotonic() - self.refreshed_at > self.refresh_seconds:
+            try:
+                self.refresh()
+            except Exception as e:
+                # 拉取失败时沿用内存中的数据
+                logger.error(f"增量刷新车厢拥挤度失败: {str(e)}", exc_info=True)
+                self.refreshed_at = time.monotonic()
+
+        penalties = self._penalties
+        if penalties is None:
+            generation = self._generation
+            crowded = {key for key, level in self.levels().items() if level >= self.threshold}
+            penalties = {
+                edge: travel_time * self.penalty_ratio
+                for edge, (path_id, travel_time) in self.directions.items()
+                if (edge[2], path_id) in crowded
+            }
+            with self._lock:
+                if generation == self._generation:
+                    self._penalties = penalties
+        return penalties
@@ -0,0 +1,308 @@
+import heapq
+import json
+import logging
+import os
+from collections.abc import Mapping
+from itertools import count
+
+import numpy as np
+
+from metro_graph import StationGraph, TRANSFER_TIME
+
+logger = logging.getLogger(__name__)
+
+ARRAY_NAMES = (
+    'nodes', 'offsets', 'targets', 'weights', 'lines',
+    'name_blob', 'name_offsets', 'node_name_cn', 'node_name_en',
+    'lookup_keys', 'lookup_nodes'
+)
+META_FILE = 'meta.json'
+
+
+def _int_view(array):
+    array = np.ascontiguousarray(array, dtype=np.int32)
+    return memoryview(array).cast('B').cast('i')
+
+
+class _Strings:
+    """驻留字符串表：所有名称以 UTF-8 拼接在 name_blob 中，按编号取出"""
+
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __getitem__(self, i):
+        return bytes(self.blob[self.offsets[i]:self.offsets[i + 1]]).decode('utf-8')
+
+
+class _Adjacency(Mapping):
+    """以 travel_group 为键的邻接表视图，返回 [(相邻节点, 行驶时间, 线路), ...]"""
+
+    def __init__(self, csr):
+        self.csr = csr
+
+    def __getitem__(self, group):
+        csr = self.csr
+        i = csr.index[group]
+        start, end = csr.offsets_list[i], csr.offsets_list[i + 1]
+        nodes = csr.nodes_list
+        return [
+            (nodes[target], weight, line_id)
+            for target, weight, line_id in zip(
+                csr.targets[start:end].tolist(),
+                csr.weights[start:end].tolist(),
+                csr.lines[start:end].tolist()
+            )
+        ]
+
+    def __iter__(self):
+        return iter(self.csr.nodes_list)
+
+    def __len__(self):
+        return len(self.csr.nodes_list)
+
+    def __contains__(self, group):
+        return group in self.csr.index
+
+
+class _StationInfo(Mapping):
+    """travel_group -> {'cn', 'en'} 的只读视图"""
+
+    def __init__(self, csr):
+        self.csr = csr
+
+    def __getitem__(self, group):
+        csr = self.csr
+        i = csr.index[group]
+        return {
+            'cn': csr.strings[int(csr.node_name_cn[i])],
+            'en': csr.strings[int(csr.node_name_en[i])]
+        }
+
+    def __iter__(self):
+        return iter(self.csr.nodes_list)
+
+    def __len__(self):
+        return len(self.csr.nodes_list)
+
+    def __contains__(self, group):
+        return group in self.csr.index
+
+
+class _NameIndex(Mapping):
+    """小写站名 -> travel_group，在按字典序排列的驻留字符串上二分查找"""
+
+    def __init__(self, csr):
+        self.csr = csr
+
+    def _key(self, i):
+        return self.csr.strings[int(self.csr.lookup_keys[i])]
+
+    def get(self, name, default=None):
+        lo, hi = 0, len(self.csr.lookup_keys)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < name:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self.csr.lookup_keys) and self._key(lo) == name:
+            return self.csr.nodes_list[int(self.csr.lookup_nodes[lo])]
+        return default
+
+    def __getitem__(self, name):
+        group = self.get(name)
+        if group is None:
+            raise KeyError(name)
+        return group
+
+    def __iter__(self):
+        return (self._key(i) for i in range(len(self.csr.lookup_keys)))
+
+    def __len__(self):
+        return len(self.csr.lookup_keys)
+
+
+class CSRStationGraph(StationGraph):
+    """
+    紧凑的 CSR（压缩稀疏行）图结构
+
+    节点按整数编号，邻接关系存放在 offsets / targets / weights / lines 四个数组中，
+    站名驻留在一段 UTF-8 字节数组里。数组以 .npy 文件保存，多个 worker 以
+    mmap_mode='r' 加载后共享同一份页缓存（目录放在 /dev/shm 下即为共享内存）。
+
+    graph / station_info / name_to_groups 以只读视图的形式保留 StationGraph 的接口，
+    备选路线、批量规划等基于 StationGraph 的功能可直接使用。
+    """
+
+    def __init__(self, arrays, directory=None):
+        super().__init__()
+        for name in ARRAY_NAMES:
+            setattr(self, name, arrays[name])
+        self.directory = directory
+
+        # 热路径上的小数组转为列表，按节点数计，大小可忽略
+        self.nodes_list = self.nodes.tolist()
+        self.offsets_list = self.offsets.tolist()
+        self.index = {group: i for i, group in enumerate(self.nodes_list)}
+        self.strings = _Strings(self.name_blob, self.name_offsets)
+        # memoryview 按下标取值比 numpy 标量快一个数量级，且不复制底层（mmap）内存
+        self._targets = _int_view(self.targets)
+        self._weights = _int_view(self.weights)
+        self._lines = _int_view(self.lines)
+
+        self.graph = _Adjacency(self)
+        self.station_info = _StationInfo(self)
+        self.name_to_groups = _NameIndex(self)
+        self.connections = None  # CSR 结构不保存按站点对索引的连接字典
+
+    @classmethod
+    def from_station_graph(cls, station_graph):
+        nodes = sorted(station_graph.graph)
+        index = {group: i for i, group in enumerate(nodes)}
+
+        offsets = [0]
+        targets, weights, lines = [], [], []
+        for group in nodes:
+            for neighbor, time, line_id in station_graph.graph[group]:
+                targets.append(index[neighbor])
+                weights.append(time)
+                lines.append(line_id)
+            offsets.append(len(targets))
+
+        strings = {}
+
+        def intern(text):
+            if text not in strings:
+                strings[text] = len(strings)
+            return strings[text]
+
+        node_name_cn = [intern(station_graph.station_info[group]['cn']) for group in nodes]
+        node_name_en = [intern(station_graph.station_info[group]['en']) for group in nodes]
+        lookup = sorted(station_graph.name_to_groups.items())
+        lookup_keys = [intern(name) for name, _ in lookup]
+        lookup_nodes = [index[group] for _, group in lookup]
+
+        encoded = [text.encode('utf-8') for text in strings]
+        name_offsets = np.zeros(len(encoded) + 1, dtype=np.int32)
+        name_offsets[1:] = np.cumsum([len(b) for b in encoded])
+
+        arrays = {
+            'nodes': np.array(nodes, dtype=np.int64),
+            'offsets': np.array(offsets, dtype=np.int32),
+            'targets': np.array(targets, dtype=np.int32),
+            'weights': np.array(weights, dtype=np.int32),
+            'lines': np.array(lines, dtype=np.int32),
+            'name_blob': np.frombuffer(b''.join(encoded), dtype=np.uint8).copy(),
+            'name_offsets': name_offsets,
+            'node_name_cn': np.array(node_name_cn, dtype=np.int32),
+            'node_name_en': np.array(node_name_en, dtype=np.int32),
+            'lookup_keys': np.array(lookup_keys, dtype=np.int32),
+            'lookup_nodes': np.array(lookup_nodes, dtype=np.int32)
+        }
+        graph = cls(arrays)
+        graph.version = station_graph.version
+        return graph
+
+    def save(self, directory):
+        """写入 .npy 文件；先写临时文件再替换，meta.json 最后写入"""
+        os.makedirs(directory, exist_ok=True)
+        for name in ARRAY_NAMES:
+            path = os.path.join(directory, f'{name}.npy')
+            with open(path + '.tmp', 'wb') as f:
+                np.save(f, np.asarray(getattr(self, name)))
+            os.replace(path + '.tmp', path)
+
+        meta_path = os.path.join(directory, META_FILE)
+        with open(meta_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'version': self.version}, f)
+        os.replace(meta_path + '.tmp', meta_path)
+        self.directory = directory
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        with open(os.path.join(directory, META_FILE), encoding='utf-8') as f:
+            meta = json.load(f)
+        arrays = {
+            name: np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r' if mmap else None)
+            for name in ARRAY_NAMES
+        }
+        graph = cls(arrays, directory)
+        graph.version = meta.get('version')
+        return graph
+
+    def __reduce__(self):
+        # 传给子进程时只传目录，由子进程重新映射同一组文件
+        if self.directory:
+            return (CSRStationGraph.load, (self.directory,))
+        return (CSRStationGraph, ({name: np.asarray(getattr(self, name)) for name in ARRAY_NAMES},))
+
+    def nbytes(self):
+        return sum(np.asarray(getattr(self, name)).nbytes for name in ARRAY_NAMES)
+
+    def _search(self, start_group, end_group=None, penalties=None, max_time=None, step_free=None):
+        """
+        与 StationGraph._search 相同的 (站点, 线路) 状态 Dijkstra，
+        直接在整数编号和 CSR 数组上运行，返回的 dist / parent 仍以 travel_group 为键
+        """
+        nodes = self.nodes_list
+        offsets = self.offsets_list
+        targets, weights, lines = self._targets, self._weights, self._lines
+        source = self.index[start_group]
+        target = self.index.get(end_group, -1) if end_group is not None else -1
+
+        start = (source, None)
+        dist = {start: 0}
+        parent = {start: None}
+        tie = count()
+        heap = [(0, next(tie), source, None)]
+        reached = None
+
+        while heap:
+            total_time, _, current, current_line = heapq.heappop(heap)
+            if max_time is not None and total_time > max_time:
+                break
+            state = (current, current_line)
+            if total_time > dist[state]:
+                continue
+
+            if current == target:
+                reached = state
+                break
+
+            for edge in range(offsets[current], offsets[current + 1]):
+                neighbor, time, line_id = targets[edge], weights[edge], lines[edge]
+                new_total_time = total_time + time
+                if current_line is not None and line_id != current_line:
+                    if step_free is not None and not step_free.can_transfer(nodes[current], current_line, line_id):
+                        continue
+                    new_total_time += TRANSFER_TIME
+                if penalties:
+                    new_total_time += penalties.get((nodes[current], nodes[neighbor], line_id), 0)
+
+                next_state = (neighbor, line_id)
+                if new_total_time < dist.get(next_state, float('inf')):
+                    dist[next_state] = new_total_time
+                    parent[next_state] = (state, time)
+                    heapq.heappush(heap, (new_total_time, next(tie), neighbor, line_id))
+
+        # 转换回以 travel_group 为键的状态
+        def to_group(state):
+            return (nodes[state[0]], state[1])
+
+        if reached is not None:
+            # 单目标查询只需转换终点所在的父链
+            group_dist, group_parent = {}, {}
+            state = reached
+            while state is not None:
+                group_dist[to_group(state)] = dist[state]
+                entry = parent[state]
+                group_parent[to_group(state)] = (to_group(entry[0]), entry[1]) if entry else None
+                state = entry[0] if entry else None
+            return group_dist, group_parent, to_group(reached)
+
+        group_parent = {
+            to_group(state): (to_group(entry[0]), entry[1]) if entry else None
+            for state, entry in parent.items()
+        }
+        return {to_group(state): d for state, d in dist.items()}, group_parent, None
@@ -0,0 +1,281 @@
+import heapq
+import logging
+import math
+from itertools import count
+
+from metro_graph import TRANSFER_TIME, StationGraph
+
+logger = logging.getLogger(__name__)
+
+STATION_COORDS_QUERY = """
+    SELECT travel_group, latitude, longitude
+    FROM station_map
+    WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+"""
+
+# 可选的搜索算法：dijkstra 为基准，astar 以直线距离 / 最高线路速度为启发函数，bidirectional 为双向 Dijkstra
+SEARCH_ALGORITHMS = ('dijkstra', 'astar', 'bidirectional')
+
+EARTH_RADIUS_KM = 6371
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+class StationCoordinates:
+    """
+    每个 travel_group 的代表坐标（station_map 中同组各行取平均）及全网最高行驶速度
+
+    最高速度按同一组代表坐标在 Dijkstra 边上求得：对任意边 (u, v) 有 直线距离(u, v) / 速度 ≤ 行驶时间，
+    结合三角不等式，直线距离 / 最高速度 是一致（从而可采纳）的剩余时间下界；换乘与拥挤代价只会让实际时间更长。
+    缺坐标的站点下界记为 0，会破坏一致性，因此只有坐标覆盖全部站点（complete）时 A* 才使用该启发函数。
+    """
+
+    def __init__(self, coords, max_speed, complete=False):
+        self.coords = coords        # travel_group -> (lat, lng)
+        self.max_speed = max_speed  # 千米 / 分钟
+        self.complete = complete    # 构建时图中每个站点都有坐标
+
+    @classmethod
+    def load(cls, get_connection, station_graph):
+        conn = None
+        cursor = None
+        try:
+            conn = get_connection()
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute(STATION_COORDS_QUERY)
+            rows = cursor.fetchall()
+        finally:
+            if cursor:
+                cursor.close()
+            if conn:
+                conn.close()
+        return cls.from_rows(rows, station_graph)
+
+    @classmethod
+    def from_rows(cls, rows, station_graph):
+        points = {}
+        for row in rows:
+            if row['travel_group'] in (None, ''):
+                continue
+            group = int(row['travel_group'])
+            lat_sum, lng_sum, n = points.get(group, (0.0, 0.0, 0))
+            points[group] = (lat_sum + float(row['latitude']), lng_sum + float(row['longitude']), n + 1)
+        coords = {group: (lat_sum / n, lng_sum / n) for group, (lat_sum, lng_sum, n) in points.items()}
+
+        max_speed = 0.0
+        for node in station_graph.graph:
+            if node not in coords:
+                continue
+            for neighbor, time, _ in station_graph.graph[node]:
+                if neighbor in coords and time > 0:
+                    max_speed = max(max_speed, haversine_km(*coords[node], *coords[neighbor]) / time)
+
+        missing = sum(1 for node in station_graph.graph if node not in coords)
+        if missing:
+            logger.warning(f"{missing} 个站点缺少坐标，algorithm=astar 将退化为 Dijkstra")
+        return cls(coords, max_speed, complete=not missing)
+
+    def distance_km(self, from_group, to_group):
+        a = self.coords.get(from_group)
+        b = self.coords.get(to_group)
+        if a is None or b is None:
+            return None
+        return haversine_km(a[0], a[1], b[0], b[1])
+
+    def lower_bound(self, from_group, to_group):
+        """from_group 到 to_group 的最短乘车时间下界（分钟）；缺坐标时为 0"""
+        if self.max_speed <= 0:
+            return 0
+        distance = self.distance_km(from_group, to_group)
+        return distance / self.max_speed if distance is not None else 0
+
+    def covers(self, station_graph):
+        """图中每个站点都有坐标时启发函数才是一致的"""
+        return all(node in self.coords for node in station_graph.graph)
+
+
+def _astar(station_graph, start_group, end_group, potential, penalties=None, step_free=None):
+    """
+    与 StationGraph._search 相同的状态与代价模型，按 代价 + potential(站点) 出堆。
+    potential 为 None 时即普通 Dijkstra。返回 (dist, parent, 终点状态, 已确定的状态集合)
+    """
+    h = {}
+
+    def estimate(node):
+        value = h.get(node)
+        if value is None:
+            value = h[node] = potential(node) if potential else 0
+        return value
+
+    start = (start_group, None)
+    dist = {start: 0}
+    parent = {start: None}
+    settled = set()
+    tie = count()
+    heap = [(estimate(start_group), next(tie), start_group, None)]
+
+    while heap:
+        _, _, current, current_line = heapq.heappop(heap)
+        state = (current, current_line)
+        if state in settled:
+            continue
+        settled.add(state)
+        total_time = dist[state]
+
+        if current == end_group:
+            return dist, parent, state, settled
+
+        for neighbor, time, line_id in station_graph.graph[current]:
+            new_total_time = total_time + time
+            if current_line is not None and line_id != current_line:
+                if step_free is not None and not step_free.can_transfer(current, current_line, line_id):
+                    continue
+                new_total_time += TRANSFER_TIME
+            if penalties:
+                new_total_time += penalties.get((current, neighbor, line_id), 0)
+
+            next_state = (neighbor, line_id)
+            if next_state not in settled and new_total_time < dist.get(next_state, float('inf')):
+                dist[next_state] = new_total_time
+                parent[next_state] = (state, time)
+                heapq.heappush(heap, (new_total_time + estimate(neighbor), next(tie), neighbor, line_id))
+
+    return dist, parent, None, settled
+
+
+def _stats(algorithm, settled):
+    return {
+        'algorithm': algorithm,
+        'settled_states': len(settled),
+        'settled_nodes': len({node for node, _ in settled})
+    }
+
+
+def dijkstra_with_stats(station_graph, start_group, end_group, penalties=None, step_free=None):
+    """普通 Dijkstra，返回 (结果, 搜索统计)，作为 A* / 双向搜索的对照"""
+    if start_group not in station_graph.graph or end_group not in station_graph.graph:
+        return None, None
+    dist, parent, state, settled = _astar(station_graph, start_group, end_group, None, penalties, step_free)
+    result = StationGraph.trace(parent, state, dist[state], penalties) if state else None
+    return result, _stats('dijkstra', settled)
+
+
+def astar_shortest_path(station_graph, start_group, end_group, penalties=None, step_free=None):
+    """
+    A* 搜索，启发函数为到终点的直线距离 / 全网最高线路速度（station_graph.coordinates）
+    未加载坐标或坐标未覆盖全部站点时退化为 Dijkstra。返回 (结果, 搜索统计)
+    """
+    if start_group not in station_graph.graph or end_group not in station_graph.graph:
+        return None, None
+    coordinates = getattr(station_graph, 'coordinates', None)
+    potential = None
+    if coordinates is not None and coordinates.complete:
+        potential = lambda node: coordinates.lower_bound(node, end_group)
+    dist, parent, state, settled = _astar(station_graph, start_group, end_group, potential, penalties, step_free)
+    result = StationGraph.trace(parent, state, dist[state], penalties) if state else None
+    return result, _stats('astar' if potential else 'dijkstra', settled)
+
+
+def bidirectional_shortest_path(station_graph, start_group, end_group, penalties=None, step_free=None):
+    """
+    双向 Dijkstra，返回 (结果, 搜索统计)
+
+    正向状态 (v, l) 表示乘 l 号线到达 v；反向状态 (v, l) 表示从 v 乘 l 号线出发前往终点（图是双向对称的，
+    反向搜索直接沿 graph 的邻接表展开）。两侧在同一站点相遇时，线路不同则补一次换乘时间。
+    每次松弛都用对侧已有的标号更新最优值 mu，两侧堆顶之和不小于 mu 时停止，结果是精确最优的。
+    """
+    graph = station_graph.graph
+    if start_group not in graph or end_group not in graph:
+        return None, None
+
+    inf = float('inf')
+    forward_start, backward_start = (start_group, None), (end_group, None)
+    dist = ({forward_start: 0}, {backward_start: 0})
+    parent = ({forward_start: None}, {backward_start: None})
+    labels = ({start_group: {None: 0}}, {end_group: {None: 0}})  # 站点 -> {线路: 标号}
+    settled = (set(), set())
+    tie = count()
+    heaps = ([(0, next(tie), start_group, None)], [(0, next(tie), end_group, None)])
+
+    mu = 0 if start_group == end_group else inf
+    meet = (forward_start, backward_start) if start_group == end_group else None
+
+    while heaps[0] and heaps[1] and heaps[0][0][0] + heaps[1][0][0] < mu:
+        side = 0 if heaps[0][0][0] <= heaps[1][0][0] else 1
+        _, _, current, current_line = heapq.heappop(heaps[side])
+        state = (current, current_line)
+        if state in settled[side]:
+            continue
+        settled[side].add(state)
+        total_time = dist[side][state]
+        other_labels = labels[1 - side]
+
+        for neighbor, time, line_id in graph[current]:
+            new_total_time = total_time + time
+            if current_line is not None and line_id != current_line:
+                if step_free is not None and not step_free.can_transfer(current, current_line, line_id):
+                    continue
+                new_total_time += TRANSFER_TIME
+            if penalties:
+                edge = (current, neighbor, line_id) if side == 0 else (neighbor, current, line_id)
+                new_total_time += penalties.get(edge, 0)
+
+            next_state = (neighbor, line_id)
+            # 与对侧在 neighbor 处相遇
+            for other_line, other_time in other_labels.get(neighbor, {}).items():
+                total = new_total_time + other_time
+                if other_line is not None and other_line != line_id:
+                    if step_free is not None and not step_free.can_transfer(neighbor, line_id, other_line):
+                        continue
+                    total += TRANSFER_TIME
+                if total < mu:
+                    mu = total
+                    meet = (next_state, (neighbor, other_line)) if side == 0 else ((neighbor, other_line), next_state)
+
+            if next_state not in settled[side] and new_total_time < dist[side].get(next_state, inf):
+                dist[side][next_state] = new_total_time
+                parent[side][next_state] = (state, time)
+                labels[side].setdefault(neighbor, {})[line_id] = new_total_time
+                heapq.heappush(heaps[side], (new_total_time, next(tie), neighbor, line_id))
+
+    stats = {
+        'algorithm': 'bidirectional',
+        'settled_states': len(settled[0]) + len(settled[1]),
+        'settled_nodes': len({node for node, _ in settled[0] | settled[1]})
+    }
+    if meet is None:
+        return None, stats
+
+    forward_state, backward_state = meet
+    head = StationGraph.trace(parent[0], forward_state, 0)
+    path, lines, times = head['path'], head['lines'], head['times']
+    state = backward_state
+    while parent[1][state] is not None:
+        next_state, time = parent[1][state]
+        path.append(next_state[0])
+        lines.append(state[1])
+        times.append(time)
+        state = next_state
+
+    result = {'path': path, 'lines': lines, 'times': times, 'total_time': mu}
+    if penalties:
+        result['cost'] = mu
+        result['total_time'] = StationGraph.travel_time(lines, times)
+    return result, stats
+
+
+def search_with_stats(station_graph, start_group, end_group, algorithm, penalties=None, step_free=None):
+    """按 algorithm（见 SEARCH_ALGORITHMS）搜索，返回 (结果, 搜索统计)"""
+    try:
+        if algorithm == 'astar':
+            return astar_shortest_path(station_graph, start_group, end_group, penalties, step_free)
+        if algorithm == 'bidirectional':
+            return bidirectional_shortest_path(station_graph, start_group, end_group, penalties, step_free)
+        return dijkstra_with_stats(station_graph, start_group, end_group, penalties, step_free)
+    except Exception as e:
+        logger.error(f"{algorithm} 搜索执行出错: {str(e)}", exc_info=True)
+        return None, None
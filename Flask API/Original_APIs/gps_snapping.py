@@ -0,0 +1,182 @@
+"""
+GPS 轨迹批量匹配最近站点：输入按批读取、按批计算、结果按批以 CSV 产出，内存占用只与批大小有关
+
+    from gps_snapping import snap_points
+    for offset, indexes, distances_km in snap_points(grid, lats, lngs):
+        ...
+
+grid 为 StationLocator.current() 返回的快照；Parquet 输入需要安装 pyarrow。
+纬度超出 ±90、经度超出 ±180 或非有限值的坐标视为无效，不参与匹配。
+"""
+import csv
+import io
+import logging
+from itertools import islice
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 每批的点数；单批临时数组约为 点数 × 候选表列数 × 8 字节 × 数个
+DEFAULT_CHUNK_SIZE = 65536
+DEFAULT_LAT_COLUMN = 'lat'
+DEFAULT_LNG_COLUMN = 'lng'
+
+RESULT_COLUMNS = ['point_index', 'stat_id', 'travel_group', 'name_cn', 'distance_m']
+
+# 流式输出中途出错时追加的最后一行以此为 point_index，name_cn 列为错误信息
+ERROR_ROW_MARKER = 'error'
+
+
+def _to_floats(values):
+    if isinstance(values, np.ndarray):
+        return values.astype(np.float64, copy=False)
+    # JSON 列表中的 null、字符串等记为 NaN
+    return np.array([
+        v if isinstance(v, (int, float)) and not isinstance(v, bool) else np.nan for v in values
+    ], dtype=np.float64)
+
+
+def _mask_invalid(lats, lngs):
+    """超出经纬度范围或非有限值的点两个坐标都记为 NaN"""
+    invalid = ~(np.abs(lats) <= 90) | ~(np.abs(lngs) <= 180)
+    if invalid.any():
+        lats = np.where(invalid, np.nan, lats)
+        lngs = np.where(invalid, np.nan, lngs)
+    return lats, lngs
+
+
+def array_point_chunks(lats, lngs, chunk_size=DEFAULT_CHUNK_SIZE):
+    """数组或列表形式的坐标按 chunk_size 切分，返回逐批产出 (lats, lngs) 的生成器；形状不一致时立即抛出 ValueError"""
+    lats, lngs = _to_floats(lats), _to_floats(lngs)
+    if lats.shape != lngs.shape or lats.ndim != 1:
+        raise ValueError('lat 与 lng 必须为长度相同的一维数组')
+    return (
+        (lats[begin:begin + chunk_size], lngs[begin:begin + chunk_size])
+        for begin in range(0, len(lats), chunk_size)
+    )
+
+
+def snap_points(grid, lats, lngs, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    NumPy 数组形式的一批点按 chunk_size 分批求最近站点
+    逐批产出 (本批第一个点的序号, 站点下标数组, 距离千米数组)，坐标无效的点站点下标为 -1
+    """
+    begin = 0
+    for chunk_lats, chunk_lngs in array_point_chunks(lats, lngs, chunk_size):
+        indexes, distances = grid.nearest_many(*_mask_invalid(chunk_lats, chunk_lngs))
+        yield begin, indexes, distances
+        begin += len(indexes)
+
+
+def _parse_lines(lines, lat_index, lng_index):
+    """CSV 数据行转为坐标数组；整批解析失败时逐行解析，无法解析的坐标记为 NaN"""
+    try:
+        values = np.loadtxt(lines, delimiter=',', quotechar='"', usecols=(lat_index, lng_index),
+                            dtype=np.float64, ndmin=2)
+        return values[:, 0], values[:, 1]
+    except ValueError:
+        pass
+    lats = np.full(len(lines), np.nan)
+    lngs = np.full(len(lines), np.nan)
+    for i, fields in enumerate(csv.reader(lines)):
+        try:
+            lats[i], lngs[i] = float(fields[lat_index]), float(fields[lng_index])
+        except (IndexError, ValueError):
+            continue
+    return lats, lngs
+
+
+def csv_point_chunks(stream, lat_column=DEFAULT_LAT_COLUMN, lng_column=DEFAULT_LNG_COLUMN,
+                     chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    按行读取带表头的 CSV（二进制流，UTF-8），返回逐批产出 (lats, lngs) 的生成器
+    表头在调用时立即读取，缺少坐标列时抛出 ValueError；空行跳过
+    """
+    header = stream.readline().decode('utf-8-sig').strip()
+    columns = next(csv.reader([header]), [])
+    columns = [column.strip() for column in columns]
+    missing = [column for column in (lat_column, lng_column) if column not in columns]
+    if missing:
+        raise ValueError(f"CSV 缺少坐标列: {', '.join(missing)}")
+    lat_index, lng_index = columns.index(lat_column), columns.index(lng_column)
+
+    def chunks():
+        lines = (line.decode('utf-8').strip() for line in stream)
+        lines = (line for line in lines if line)
+        while True:
+            batch = list(islice(lines, chunk_size))
+            if not batch:
+                return
+            yield _parse_lines(batch, lat_index, lng_index)
+
+    return chunks()
+
+
+def parquet_point_chunks(file, lat_column=DEFAULT_LAT_COLUMN, lng_column=DEFAULT_LNG_COLUMN,
+                         chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    按 record batch 读取 Parquet 文件（路径或可随机读取的文件对象）的两个坐标列，返回逐批产出 (lats, lngs) 的生成器
+    未安装 pyarrow 或缺少坐标列时立即抛出 ValueError；空值记为 NaN
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ValueError('读取 Parquet 需要安装 pyarrow，或改为上传 CSV')
+
+    parquet_file = pq.ParquetFile(file)
+    missing = [column for column in (lat_column, lng_column) if column not in parquet_file.schema_arrow.names]
+    if missing:
+        raise ValueError(f"Parquet 缺少坐标列: {', '.join(missing)}")
+
+    def chunks():
+        for batch in parquet_file.iter_batches(batch_size=chunk_size, columns=[lat_column, lng_column]):
+            yield tuple(
+                batch.column(name).cast(pa.float64()).to_numpy(zero_copy_only=False)
+                for name in (lat_column, lng_column)
+            )
+
+    return chunks()
+
+
+def _station_fields(grid):
+    """每个站点预先编码好的 stat_id,travel_group,name_cn 三列（含两侧逗号），最后一项为坐标无效的点"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='')
+    fields = []
+    for station in grid.stations:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerow([station['stat_id'], station['travel_group'], station['name_cn']])
+        fields.append(f",{buffer.getvalue()},")
+    fields.append(',,,,')
+    return np.array(fields, dtype=object)
+
+
+def snap_csv(grid, point_chunks):
+    """
+    逐批求最近站点并编码为 CSV 文本（列见 RESULT_COLUMNS），第一块为表头
+    point_chunks 逐批产出 (lats, lngs)；坐标无效的点站点各列与距离为空
+    """
+    fields = _station_fields(grid)
+    yield ','.join(RESULT_COLUMNS) + '\n'
+
+    offset = 0
+    for lats, lngs in point_chunks:
+        indexes, distances = grid.nearest_many(*_mask_invalid(lats, lngs))
+        meters = np.rint(np.nan_to_num(distances) * 1000).astype(np.int64).astype(object)
+        meters[indexes < 0] = ''
+        yield ''.join([
+            '%d%s%s\n' % row
+            for row in zip(range(offset, offset + len(indexes)), fields[indexes].tolist(), meters.tolist())
+        ])
+        offset += len(indexes)
+    logger.info(f"批量最近站点匹配完成: {offset} 个点")
+
+
+def error_csv_row(message):
+    """snap_csv 中途出错时追加的结果行：point_index 为 ERROR_ROW_MARKER，name_cn 为错误信息"""
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator='\n').writerow([ERROR_ROW_MARKER, '', '', message, ''])
+    return buffer.getvalue()
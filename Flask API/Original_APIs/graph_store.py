@@ -0,0 +1,75 @@
+import logging
+import threading
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+
+class GraphStore:
+    """
+    版本化的地铁图快照
+
+    build 回调每次返回一个全新构建好的 StationGraph，构建在后台线程中完成，
+    完成后一次性替换 current 引用。请求处理时先取 current 到局部变量，
+    之后整个请求都使用同一份快照，不会读到构建了一半的 graph / connections / name_to_groups。
+    """
+
+    def __init__(self, build):
+        self._build = build
+        self._lock = threading.Lock()
+        self._thread = None
+        self._listeners = []
+        self.current = None
+        self.loaded_at = None
+        self.last_error = None
+
+    def add_listener(self, listener):
+        """listener(new_graph, old_graph)，在快照替换后调用"""
+        self._listeners.append(listener)
+
+    def load(self):
+        """同步构建并替换快照，构建失败时抛出异常、保留旧快照"""
+        graph = self._build()
+        graph.version = graph.compute_version()
+        self._swap(graph)
+        return graph
+
+    def _swap(self, graph):
+        old_graph = self.current
+        self.current = graph
+        self.loaded_at = datetime.now()
+        self.last_error = None
+        logger.info(f"地铁图快照已切换到版本 {graph.version}")
+        for listener in self._listeners:
+            try:
+                listener(graph, old_graph)
+            except Exception as e:
+                logger.error(f"图快照切换回调出错: {str(e)}", exc_info=True)
+
+    def reloading(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def reload_async(self):
+        """在后台线程中重建；已有重建在进行时返回 False"""
+        with self._lock:
+            if self.reloading():
+                return False
+            self._thread = threading.Thread(target=self._reload, name='graph-reload', daemon=True)
+            self._thread.start()
+            return True
+
+    def _reload(self):
+        try:
+            self.load()
+        except Exception as e:
+            self.last_error = str(e)
+            logger.error(f"重建地铁图结构失败，继续使用版本 {getattr(self.current, 'version', None)}: {str(e)}",
+                         exc_info=True)
+
+    def status(self):
+        return {
+            'graph_version': getattr(self.current, 'version', None),
+            'loaded_at': self.loaded_at.isoformat() if self.loaded_at else None,
+            'reloading': self.reloading(),
+            'last_error': self.last_error
+        }
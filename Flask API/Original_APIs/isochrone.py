@@ -0,0 +1,126 @@
+import logging
+
+import numpy as np
+
+from metro_graph import TRANSFER_TIME
+
+logger = logging.getLogger(__name__)
+
+# 不可达标记
+UNREACHABLE = -1
+
+_INF = np.iinfo(np.int64).max // 4
+
+
+class TravelTimeMatrix:
+    """
+    全部站点两两之间考虑换乘的最短时间，用于一次性计算所有站点的等时圈
+
+    在按线路展开的站台图上（节点为 (travel_group, line_id)，同站不同线之间为 TRANSFER_TIME 的换乘边）
+    以所有站点为源同时做向量化的 Bellman-Ford：每轮用 numpy 对全部 (源, 边) 松弛一次，
+    轮数只与最短路的最大边数有关。结果与图版本绑定，图切换后需重新构建。
+
+    - nodes[i]    第 i 个 travel_group
+    - time[s, t]  从 nodes[s] 到 nodes[t] 的最短时间（分钟），不可达为 -1
+    """
+
+    def __init__(self, nodes, time, version=None):
+        self.nodes = nodes
+        self.time = time
+        self.version = version
+        self.index = {node: i for i, node in enumerate(nodes)}
+
+    @classmethod
+    def build(cls, station_graph):
+        platforms = sorted({
+            (group, line_id)
+            for node, edges in station_graph.graph.items()
+            for neighbor, _, line_id in edges
+            for group in (node, neighbor)
+        })
+        platform_index = {platform: i for i, platform in enumerate(platforms)}
+        nodes = sorted({group for group, _ in platforms})
+        group_index = {group: i for i, group in enumerate(nodes)}
+        platform_group = np.array([group_index[group] for group, _ in platforms], dtype=np.int64)
+
+        src, dst, weight = [], [], []
+        for node, edges in station_graph.graph.items():
+            for neighbor, time, line_id in edges:
+                src.append(platform_index[(node, line_id)])
+                dst.append(platform_index[(neighbor, line_id)])
+                weight.append(time)
+        members = {}
+        for i, (group, _) in enumerate(platforms):
+            members.setdefault(group, []).append(i)
+        for platform_ids in members.values():
+            for a in platform_ids:
+                for b in platform_ids:
+                    if a != b:
+                        src.append(a)
+                        dst.append(b)
+                        weight.append(TRANSFER_TIME)
+
+        # 按终点排序，每轮用 reduceat 求各终点的最小入边
+        order = np.argsort(dst, kind='stable')
+        src = np.array(src, dtype=np.int64)[order]
+        dst = np.array(dst, dtype=np.int64)[order]
+        weight = np.array(weight, dtype=np.int64)[order]
+        starts = np.flatnonzero(np.r_[True, dst[1:] != dst[:-1]])
+        heads = dst[starts]
+
+        # dist[s, p]：从站点 s（任一站台出发，无换乘）到站台 p 的最短时间
+        dist = np.full((len(nodes), len(platforms)), _INF, dtype=np.int64)
+        dist[platform_group, np.arange(len(platforms))] = 0
+        rounds = 0
+        while True:
+            rounds += 1
+            candidate = np.minimum.reduceat(dist[:, src] + weight, starts, axis=1)
+            improved = candidate < dist[:, heads]
+            if not improved.any():
+                break
+            dist[:, heads] = np.minimum(dist[:, heads], candidate)
+
+        group_starts = np.flatnonzero(np.r_[True, platform_group[1:] != platform_group[:-1]])
+        time = np.minimum.reduceat(dist, group_starts, axis=1)
+        time[time >= _INF] = UNREACHABLE
+        logger.info(f"全站点最短时间矩阵构建完成: {len(nodes)} 个站点, {rounds} 轮松弛")
+        return cls(nodes, time.astype(np.int32), station_graph.version)
+
+    def reachable(self, start_group, minutes):
+        """{travel_group: 最短时间}，只含 minutes 分钟内可达的站点"""
+        i = self.index.get(start_group)
+        if i is None:
+            return {}
+        row = self.time[i]
+        within = np.flatnonzero((row >= 0) & (row <= minutes))
+        return {self.nodes[j]: int(row[j]) for j in within}
+
+    def within(self, minutes):
+        """所有站点的等时圈：{起点 travel_group: [(travel_group, 最短时间), ...]}，按时间排序"""
+        mask = (self.time >= 0) & (self.time <= minutes)
+        result = {node: [] for node in self.nodes}
+        rows, cols = np.nonzero(mask)
+        times = self.time[rows, cols]
+        order = np.lexsort((cols, times, rows))
+        nodes = self.nodes
+        for r, c, t in zip(rows[order].tolist(), cols[order].tolist(), times[order].tolist()):
+            result[nodes[r]].append((nodes[c], t))
+        return result
+
+
+def format_isochrone(reachable, station_graph):
+    """把 {travel_group: 分钟} 转为接口返回的站点列表（按到达时间排序，附 station_map 坐标）"""
+    coordinates = getattr(station_graph, 'coordinates', None)
+    stations = []
+    for group, minutes in sorted(reachable.items(), key=lambda item: (item[1], item[0])):
+        info = station_graph.station_info.get(group, {})
+        point = coordinates.coords.get(group) if coordinates is not None else None
+        stations.append({
+            'travel_group': group,
+            'name_cn': info.get('cn'),
+            'name_en': info.get('en'),
+            'arrival_minutes': minutes,
+            'latitude': round(point[0], 6) if point else None,
+            'longitude': round(point[1], 6) if point else None
+        })
+    return stations
@@ -0,0 +1,291 @@
+import logging
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+
+from position_history import HISTORY_INSERT
+
+logger = logging.getLogger(__name__)
+
+# 后台写回数据库的间隔（秒）
+DEFAULT_FLUSH_SECONDS = 2
+# 最新上报早于该时长（分钟）的列车视为已下线，从内存中移除
+DEFAULT_STALE_MINUTES = 30
+# 单次 executemany 的最大行数
+FLUSH_BATCH_SIZE = 500
+# 待追加到位置历史的上报数上限，数据库长时间不可用时丢弃最早的
+MAX_PENDING_HISTORY = 200000
+
+LIVE_TRAINS_QUERY = """
+    SELECT train_number, station_id, next_station_id, timestamp, path_id
+    FROM train_realtime_status
+    WHERE timestamp >= %s
+"""
+
+UPSERT_TRAIN_STATUS = """
+    INSERT INTO train_realtime_status
+    (train_number, station_id, next_station_id, timestamp, path_id)
+    VALUES (%s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+    station_id = VALUES(station_id),
+    next_station_id = VALUES(next_station_id),
+    timestamp = VALUES(timestamp),
+    path_id = VALUES(path_id)
+"""
+
+
+class LiveTrainStore:
+    """
+    列车实时位置的内存存储，按 train_number 和 path_id 两级索引
+
+    上报通过 update 在 O(1) 内写入内存并记入待写回集合，后台线程每隔 flush_seconds 把变化过的列车
+    批量 upsert 到 train_realtime_status（同一列车在两次写回之间多次上报只写最后一条）；
+    next_trains 等读取只访问内存。数据库只用于持久化，启动时 load 从中恢复未过期的列车。
+
+    record_history 为 True 时每条被采用的上报（包括两次写回之间同一列车的多条）还会在写回时追加到
+    train_position_history；历史与实时状态分两次提交，历史表写入失败不影响实时状态的写回。
+
+    每条记录为 dict（键与 train_realtime_status 的列相同），写入后不再修改，更新时整条替换，
+    读取方拿到的记录不会被并发修改。多个 worker 进程各自持有一份存储，只能看到本进程收到的上报。
+    """
+
+    def __init__(self, get_connection, flush_seconds=DEFAULT_FLUSH_SECONDS, stale_minutes=DEFAULT_STALE_MINUTES,
+                 record_history=False):
+        self._get_connection = get_connection
+        self.flush_seconds = flush_seconds
+        self.stale_after = timedelta(minutes=stale_minutes)
+        self.record_history = record_history
+        self._lock = threading.RLock()
+        # 后台线程、管理接口、批量上报的 flush=1 可能同时写回，串行执行，避免较早的一批晚提交而覆盖较新的状态
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.trains = {}   # train_number -> 记录
+        self.by_path = {}  # path_id -> {train_number: 记录}
+        self._dirty = {}   # train_number -> 待写回的记录
+        self._history = deque(maxlen=MAX_PENDING_HISTORY)  # 待追加到位置历史的记录
+        self.version = 0   # 内存中的列车每变化一次加一，供到站看板判断是否需要重新计算
+        self._listeners = []
+        self.flushed_at = None
+        self.last_error = None
+
+    def add_listener(self, listener):
+        """
+        listener(previous, record)：列车记录变化后在存储锁内调用，previous 为旧记录或 None，
+        record 为新记录，列车被移除时为 None。回调应只更新内存，不能再调用本存储加锁的方法
+        """
+        self._listeners.append(listener)
+
+    def _notify(self, previous, record):
+        for listener in self._listeners:
+            try:
+                listener(previous, record)
+            except Exception as e:
+                logger.error(f"列车位置变化回调出错: {str(e)}", exc_info=True)
+
+    def load(self):
+        """从 train_realtime_status 恢复未过期的列车"""
+        conn = None
+        cursor = None
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute(LIVE_TRAINS_QUERY, (datetime.now() - self.stale_after,))
+            rows = cursor.fetchall()
+        finally:
+            if cursor:
+                cursor.close()
+            if conn:
+                conn.close()
+        with self._lock:
+            for row in rows:
+                self._put(dict(row))
+            self.version += 1
+        logger.info(f"已从数据库恢复 {len(rows)} 列在线列车")
+
+    def _put(self, record):
+        train_number = record['train_number']
+        previous = self.trains.get(train_number)
+        if previous is not None and previous['path_id'] != record['path_id']:
+            trains = self.by_path.get(previous['path_id'])
+            if trains is not None:
+                trains.pop(train_number, None)
+                if not trains:
+                    del self.by_path[previous['path_id']]
+        self.trains[train_number] = record
+        self.by_path.setdefault(record['path_id'], {})[train_number] = record
+        self._notify(previous, record)
+
+    def _apply(self, record):
+        previous = self.trains.get(record['train_number'])
+        if previous is not None and previous['timestamp'] > record['timestamp']:
+            return False
+        self._put(record)
+        self._dirty[record['train_number']] = record
+        if self.record_history:
+            self._history.append(record)
+        self.version += 1
+        return True
+
+    def update(self, train_number, station_id, next_station_id, timestamp, path_id):
+        """
+        记录一条上报并标记待写回；早于该列车已有记录的上报（乱序到达）被忽略，返回 False
+        """
+        record = {
+            'train_number': train_number,
+            'station_id': station_id,
+            'next_station_id': next_station_id,
+            'timestamp': timestamp,
+            'path_id': path_id
+        }
+        with self._lock:
+            return self._apply(record)
+
+    def update_many(self, records):
+        """批量记录上报（键同 train_realtime_status 的列），只加一次锁，返回每条是否被采用"""
+        with self._lock:
+            return [self._apply(dict(record)) for record in records]
+
+    def with_records(self, callback):
+        """在存储锁内以当前全部列车记录调用 callback，期间不会有新的变化（用于派生数据整体重建）"""
+        with self._lock:
+            return callback(list(self.trains.values()))
+
+    def get(self, train_number):
+        return self.trains.get(train_number)
+
+    def trains_on(self, path_ids):
+        """给定各 path 上的全部列车记录"""
+        with self._lock:
+            return [record for path_id in path_ids for record in self.by_path.get(path_id, {}).values()]
+
+    def evict_stale(self, now=None):
+        """移除最新上报已过期的列车（数据库中的行保留），返回移除数"""
+        cutoff = (now or datetime.now()) - self.stale_after
+        with self._lock:
+            stale = [record for record in self.trains.values() if record['timestamp'] < cutoff]
+            for record in stale:
+                train_number = record['train_number']
+                del self.trains[train_number]
+                trains = self.by_path[record['path_id']]
+                del trains[train_number]
+                if not trains:
+                    del self.by_path[record['path_id']]
+                self._notify(record, None)
+            if stale:
+                self.version += 1
+        if stale:
+            logger.info(f"移除 {len(stale)} 列超过 {self.stale_after} 未上报的列车")
+        return len(stale)
+
+    def clear(self):
+        with self._lock:
+            for record in self.trains.values():
+                self._notify(record, None)
+            self.trains = {}
+            self.by_path = {}
+            self._dirty = {}
+            self._history.clear()
+            self.version += 1
+
+    def flush(self):
+        """
+        把待写回的记录批量写入数据库，再追加位置历史；失败时放回待写回集合（不覆盖期间收到的更新），
+        返回写入的实时状态行数
+        """
+        with self._flush_lock:
+            return self._flush()
+
+    def _flush(self):
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+            history = list(self._history)
+            self._history.clear()
+        if not dirty and not history:
+            return 0
+
+        records = list(dirty.values())
+        conn = None
+        cursor = None
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            try:
+                self._write(cursor, UPSERT_TRAIN_STATUS, records)
+                conn.commit()
+            except Exception:
+                with self._lock:
+                    for train_number, record in dirty.items():
+                        self._dirty.setdefault(train_number, record)
+                    self._requeue_history(history)
+                raise
+            try:
+                self._write(cursor, HISTORY_INSERT, history)
+                conn.commit()
+            except Exception:
+                with self._lock:
+                    self._requeue_history(history)
+                raise
+        finally:
+            if cursor:
+                cursor.close()
+            if conn:
+                conn.close()
+        self.flushed_at = datetime.now()
+        return len(records)
+
+    @staticmethod
+    def _write(cursor, sql, records):
+        for begin in range(0, len(records), FLUSH_BATCH_SIZE):
+            cursor.executemany(sql, [
+                (r['train_number'], r['station_id'], r['next_station_id'], r['timestamp'], r['path_id'])
+                for r in records[begin:begin + FLUSH_BATCH_SIZE]
+            ])
+
+    def _requeue_history(self, history):
+        # 放在期间新上报之前，超出上限时丢弃最早的
+        self._history = deque(history + list(self._history), maxlen=MAX_PENDING_HISTORY)
+
+    def pending(self):
+        return len(self._dirty)
+
+    def start(self):
+        """启动后台写回线程"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='live-train-flush', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """停止后台线程并写回剩余记录"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error(f"退出前写回列车实时位置失败，{self.pending()} 条未写入: {str(e)}", exc_info=True)
+
+    def _run(self):
+        while not self._stop.wait(self.flush_seconds):
+            try:
+                self.flush()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                logger.error(f"写回列车实时位置失败，{self.pending()} 条待重试: {str(e)}", exc_info=True)
+            try:
+                self.evict_stale()
+            except Exception as e:
+                logger.error(f"清理过期列车出错: {str(e)}", exc_info=True)
+
+    def status(self):
+        return {
+            'trains': len(self.trains),
+            'pending_writes': self.pending(),
+            'pending_history': len(self._history),
+            'flushed_at': self.flushed_at.isoformat() if self.flushed_at else None,
+            'last_error': self.last_error
+        }
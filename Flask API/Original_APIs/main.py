@@ -1,13 +1,43 @@
-from flask import Flask, jsonify, request
+from flask import Flask, jsonify, request, Response, stream_with_context, json
 import mysql.connector
 from mysql.connector import pooling
+import os
 import math
+import atexit
+import shutil
+import tempfile
+import signal
+import threading
 import logging
-import heapq
 from flask_cors import CORS
 from collections import defaultdict
-from datetime import datetime, timedelta
+from datetime import datetime
 from functools import wraps
+from json import JSONDecoder
+from werkzeug.exceptions import RequestEntityTooLarge
+from metro_graph import StationGraph
+from alternatives import k_shortest_paths, DEFAULT_BUDGET_MS
+from batch_routing import BatchRouter
+from graph_store import GraphStore
+from crowding_index import CrowdingIndex, DEFAULT_CROWD_THRESHOLD, DEFAULT_PENALTY_RATIO
+from timetable import TimetablePlanner, DEFAULT_HEADWAY, parse_depart_at, format_journey
+from route_cache import RouteCache, DEFAULT_MAXSIZE
+from station_names import StationNameIndex
+from goal_directed import StationCoordinates, SEARCH_ALGORITHMS, search_with_stats
+from isochrone import TravelTimeMatrix, format_isochrone
+from accessibility import AccessibilityIndex
+from travel_time_index import TravelTimeIndex, DEFAULT_REFRESH_SECONDS
+from live_trains import LiveTrainStore, DEFAULT_FLUSH_SECONDS, DEFAULT_STALE_MINUTES
+from station_locator import StationLocator, DEFAULT_MAP_REFRESH_SECONDS, DEFAULT_CELL_KM
+from gps_snapping import (
+    array_point_chunks, csv_point_chunks, parquet_point_chunks, snap_csv, error_csv_row,
+    DEFAULT_CHUNK_SIZE, DEFAULT_LAT_COLUMN, DEFAULT_LNG_COLUMN
+)
+from position_history import PositionHistory, DEFAULT_LEARNED_DAYS, DEFAULT_MIN_SAMPLES, DEFAULT_RETENTION_DAYS
+from arrival_boards import (
+    ArrivalBoard, ArrivalBoardHub, DEFAULT_PER_DIRECTION, DEFAULT_MIRROR_SECONDS,
+    DEFAULT_PUBLISH_SECONDS, DEFAULT_HEARTBEAT_SECONDS
+)
 
 # 配置日志
 logging.basicConfig(level=logging.DEBUG)
@@ -29,19 +59,88 @@ db_config = {
 # 连接池
 connection_pool = pooling.MySQLConnectionPool(**db_config)
 
+# 全源最短路表目录（可选）：设置后启动时加载或预计算 .npy 表，路线查询改为查表
+ALL_PAIRS_DIR = os.environ.get('SMARTMETRO_ALL_PAIRS_DIR')
+
+# 收缩层次目录（可选）：设置后按图版本在 <目录>/<版本号>/ 下加载或预处理收缩层次，
+# 不带附加代价的路线查询改用收缩层次（已配置全源最短路表时仍优先查表）
+CONTRACTION_DIR = os.environ.get('SMARTMETRO_CONTRACTION_DIR')
+
+# 紧凑图目录（可选）：设置后图结构以 CSR 数组写入 <目录>/<版本号>/ 并以 mmap 加载，
+# 多个 worker 进程共享同一份页缓存；放在 /dev/shm 下即为共享内存
+CSR_GRAPH_DIR = os.environ.get('SMARTMETRO_CSR_GRAPH_DIR')
+
+# 备选路线数量上限
+MAX_ALTERNATIVES = 10
+
+# 批量路线规划单次请求的 OD 对上限
+MAX_BATCH_PAIRS = 100000
+
+# 批量上报列车位置单次请求的记录数上限
+MAX_BULK_STATUSES = 100000
+# 批量上报请求体的字节上限，按每条记录 512 字节估算（单条记录实际约 150 字节），在读取请求体前检查
+MAX_BULK_STATUS_BYTES = MAX_BULK_STATUSES * 512
+
+# 批量匹配最近站点以 JSON 数组提交时的点数上限（更大的批量请上传 CSV / Parquet，按批流式处理）
+MAX_SNAP_JSON_POINTS = 100000
+
+# 站名联想返回条数上限
+MAX_SUGGESTIONS = 20
+
+# 等时圈时间上限（分钟）
+MAX_ISOCHRONE_MINUTES = 240
+
+# 路线规划模式：fastest 最快；comfort 避开拥挤的线路方向；accessible 只在有无障碍设施的站台间换乘
+ROUTE_MODES = ('fastest', 'comfort', 'accessible')
+
+# comfort 模式参数：车厢平均拥挤等级达到阈值的区段，附加代价为行驶时间 × 比例
+COMFORT_CROWD_THRESHOLD = float(os.environ.get('SMARTMETRO_COMFORT_THRESHOLD', DEFAULT_CROWD_THRESHOLD))
+COMFORT_PENALTY_RATIO = float(os.environ.get('SMARTMETRO_COMFORT_PENALTY_RATIO', DEFAULT_PENALTY_RATIO))
+
+# 按时刻表规划时假定的发车间隔（分钟）
+TIMETABLE_HEADWAY = int(os.environ.get('SMARTMETRO_HEADWAY_MINUTES', DEFAULT_HEADWAY))
+
+# 检查 station_path_order / station_travel_time 是否变化的间隔（秒），变化后重建行驶时间索引
+TRAVEL_TIME_REFRESH_SECONDS = int(os.environ.get('SMARTMETRO_TRAVEL_TIME_REFRESH_SECONDS', DEFAULT_REFRESH_SECONDS))
+
+# 检查 station_map 是否变化的间隔（秒），以及最近站点空间索引的网格边长（千米）
+STATION_MAP_REFRESH_SECONDS = int(os.environ.get('SMARTMETRO_STATION_MAP_REFRESH_SECONDS', DEFAULT_MAP_REFRESH_SECONDS))
+STATION_GRID_CELL_KM = float(os.environ.get('SMARTMETRO_STATION_GRID_CELL_KM', DEFAULT_CELL_KM))
+
+# 批量匹配最近站点（GPS 轨迹）每批读取与计算的点数，决定单个请求的内存上限
+SNAP_CHUNK_SIZE = int(os.environ.get('SMARTMETRO_SNAP_CHUNK_SIZE', DEFAULT_CHUNK_SIZE))
+
+# 列车实时位置写回 train_realtime_status 的间隔（秒），以及多久未上报的列车从内存中移除（分钟）
+TRAIN_FLUSH_SECONDS = float(os.environ.get('SMARTMETRO_TRAIN_FLUSH_SECONDS', DEFAULT_FLUSH_SECONDS))
+TRAIN_STALE_MINUTES = float(os.environ.get('SMARTMETRO_TRAIN_STALE_MINUTES', DEFAULT_STALE_MINUTES))
+
+# 设置 SMARTMETRO_POSITION_HISTORY=1 时上报追加到 train_position_history 并每天汇总区段运行时间；
+# 最近几天、样本数达到下限的区段小时用于行驶时间估算
+POSITION_HISTORY = os.environ.get('SMARTMETRO_POSITION_HISTORY', '').lower() in ('1', 'true', 'yes')
+LEARNED_DAYS = int(os.environ.get('SMARTMETRO_LEARNED_DAYS', DEFAULT_LEARNED_DAYS))
+LEARNED_MIN_SAMPLES = int(os.environ.get('SMARTMETRO_LEARNED_MIN_SAMPLES', DEFAULT_MIN_SAMPLES))
+HISTORY_RETENTION_DAYS = int(os.environ.get('SMARTMETRO_HISTORY_RETENTION_DAYS', DEFAULT_RETENTION_DAYS))
+
+# 到站看板推送：检查列车位置是否变化的间隔，以及无更新时的心跳间隔（秒）
+BOARD_PUBLISH_SECONDS = float(os.environ.get('SMARTMETRO_BOARD_PUBLISH_SECONDS', DEFAULT_PUBLISH_SECONDS))
+BOARD_HEARTBEAT_SECONDS = float(os.environ.get('SMARTMETRO_BOARD_HEARTBEAT_SECONDS', DEFAULT_HEARTBEAT_SECONDS))
+
+# 到站看板每个方向的列车数；设置 SMARTMETRO_ARRIVAL_BOARD_MIRROR=1 时定期镜像到 arrival_board 表
+NEXT_TRAINS_PER_DIRECTION = int(os.environ.get('SMARTMETRO_NEXT_TRAINS_PER_DIRECTION', DEFAULT_PER_DIRECTION))
+ARRIVAL_BOARD_MIRROR = os.environ.get('SMARTMETRO_ARRIVAL_BOARD_MIRROR', '').lower() in ('1', 'true', 'yes')
+ARRIVAL_BOARD_MIRROR_SECONDS = float(os.environ.get('SMARTMETRO_ARRIVAL_BOARD_MIRROR_SECONDS', DEFAULT_MIRROR_SECONDS))
+
+# 路线响应缓存条数，0 表示关闭
+ROUTE_CACHE_SIZE = int(os.environ.get('SMARTMETRO_ROUTE_CACHE_SIZE', DEFAULT_MAXSIZE))
+
+# 管理接口令牌（可选）：设置后 /smartmetro/admin/* 需在 X-Admin-Token 请求头中携带
+ADMIN_TOKEN = os.environ.get('SMARTMETRO_ADMIN_TOKEN')
+
 # ======= 公共函数 =======
 
 def get_db_connection():
     return connection_pool.get_connection()
 
-def haversine(lat1, lon1, lat2, lon2):
-    R = 6371  # 地球半径km
-    lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
-    dlat = lat2 - lat1
-    dlon = lon2 - lon1
-    a = math.sin(dlat/2)**2 + math.cos(lat1)*math.cos(lat2)*math.sin(dlon/2)**2
-    return R * 2 * math.asin(math.sqrt(a))
-
 def get_stations():
     """从数据库获取 line 和 all_stations 列的数据"""
     try:
@@ -56,64 +155,9 @@ def get_stations():
         print(f"数据库错误: {err}")
         return []
 
-def calculate_travel_time(conn, path_id, from_station_id, to_station_id):
-    with conn.cursor(buffered=True, dictionary=True) as cursor:
-        cursor.execute("""
-            SELECT station_order FROM station_path_order 
-            WHERE path_id = %s AND station_id = %s
-        """, (path_id, from_station_id))
-        from_result = cursor.fetchone()
-
-        cursor.execute("""
-            SELECT station_order FROM station_path_order 
-            WHERE path_id = %s AND station_id = %s
-        """, (path_id, to_station_id))
-        to_result = cursor.fetchone()
-
-        if not from_result or not to_result:
-            return None
-
-        from_order = from_result['station_order']
-        to_order = to_result['station_order']
-
-        if from_order == to_order:
-            return 0  # 已经在目标站
-
-        total_time = 0
-        # up方向，order递增
-        if from_order < to_order:
-            current_order = from_order
-            while current_order < to_order:
-                cursor.execute("""
-                    SELECT travel_time 
-                    FROM station_travel_time stt
-                    JOIN station_path_order spo_from ON stt.from_station_id = spo_from.station_id
-                    JOIN station_path_order spo_to ON stt.to_station_id = spo_to.station_id
-                    WHERE spo_from.path_id = %s AND spo_to.path_id = %s
-                    AND spo_from.station_order = %s AND spo_to.station_order = %s
-                """, (path_id, path_id, current_order, current_order + 1))
-                result = cursor.fetchone()
-                if result:
-                    total_time += result['travel_time']
-                current_order += 1
-        else:
-            # down方向，order递减
-            current_order = from_order
-            while current_order > to_order:
-                cursor.execute("""
-                    SELECT travel_time 
-                    FROM station_travel_time stt
-                    JOIN station_path_order spo_from ON stt.from_station_id = spo_from.station_id
-                    JOIN station_path_order spo_to ON stt.to_station_id = spo_to.station_id
-                    WHERE spo_from.path_id = %s AND spo_to.path_id = %s
-                    AND spo_from.station_order = %s AND spo_to.station_order = %s
-                """, (path_id, path_id, current_order, current_order - 1))
-                result = cursor.fetchone()
-                if result:
-                    total_time += result['travel_time']
-                current_order -= 1
-
-        return float(total_time) if total_time else None
+def calculate_travel_time(path_id, from_station_id, to_station_id, at=None):
+    """path_id 上两站之间的行驶时间（分钟），at 时刻（默认当前）出发，查内存前缀和索引，不访问数据库"""
+    return travel_time_index.travel_time(path_id, from_station_id, to_station_id, at)
 
 def handle_errors(f):
     @wraps(f)
@@ -143,217 +187,327 @@ def get_nearest_stations():
     if not (30.5 <= user_lat <= 32.5) or not (120.8 <= user_lng <= 122.2):
         return jsonify({'error': 'Location outside Shanghai area'}), 400
 
-    conn = None
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-
-        cursor.execute("""
-            SELECT 
-                stat_id, name_cn, name_en, latitude, longitude, 
-                travel_group, line, all_stations, associated_lines
-            FROM station_map
-            WHERE latitude IS NOT NULL AND longitude IS NOT NULL
-        """)
-        stations = cursor.fetchall()
-
-        seen_groups = {}
-        for station in stations:
-            try:
-                travel_group = str(station.get('travel_group', '')).strip()
-                if not travel_group:
-                    continue
-                if travel_group not in seen_groups:
-                    distance_km = haversine(
-                        user_lat, user_lng,
-                        float(station['latitude']),
-                        float(station['longitude'])
-                    )
-                    all_stations = [
-                        s.strip('"\' ') for s in station['all_stations'].split(',') if s.strip()
-                    ]
-                    associated_lines = [
-                        int(line.strip()) for line in (station['associated_lines'] or '').split(',')
-                        if line.strip().isdigit()
-                    ]
-                    seen_groups[travel_group] = {
-                        "stat_id": station['stat_id'],
-                        "name_cn": station['name_cn'],
-                        "name_en": station['name_en'],
-                        "travel_group": travel_group,
-                        "distance_m": round(distance_km * 1000),
-                        "line_info": {
-                            "line": station['line'],
-                            "all_stations": all_stations
-                        },
-                        "associated_lines": associated_lines
-                    }
-            except (KeyError, ValueError) as e:
-                app.logger.error(f"Data error: {e}")
-                continue
-
-        sorted_results = sorted(
-            seen_groups.values(),
-            key=lambda x: x['distance_m']
-        )[:max_results]
-
         return jsonify({
             'user_location': {'lat': user_lat, 'lng': user_lng},
-            'nearest_stations': sorted_results
+            'nearest_stations': station_locator.nearest(user_lat, user_lng, max_results)
         })
-
     except Exception as e:
         app.logger.error(f"Error: {str(e)}")
         return jsonify({'error': str(e)}), 500
-    finally:
-        if conn:
-            conn.close()
-
-# ======= Dijkstra 最短路径 API =======
 
-class StationGraph:
-    def __init__(self):
-        self.graph = {}
-        self.name_to_groups = {}
-        self.station_info = {}
-        self.connections = {}  # 存储站点间的连接信息
-        
-    def _add_mapping(self, name_cn, name_en, group):
-        name_cn = str(name_cn).strip() if name_cn else ''
-        name_en = str(name_en).strip() if name_en else ''
-
-        if name_cn:
-            self.name_to_groups[name_cn.lower()] = group
-        if name_en:
-            self.name_to_groups[name_en.lower()] = group
-
-        self.station_info[group] = {
-            'cn': name_cn or f'UNKNOWN_CN_{group}',
-            'en': name_en or f'UNKNOWN_EN_{group}'
-        }
-        
-    def build_graph(self):
-        conn = None
-        cursor = None
+def read_snap_points(lat_column, lng_column):
+    """
+    读取批量匹配的输入，返回 (逐批产出 (lats, lngs) 的生成器, 需在响应结束后关闭的临时文件或 None)；
+    输入无法识别时抛出 ValueError
+    - multipart 上传的 file：扩展名为 .parquet 时按 Parquet 读取，否则按 CSV。
+      请求结束时上传文件会被关闭，先复制到临时文件再在响应中读取
+    - Content-Type 为 application/json：{"lat": [...], "lng": [...]}
+    - 其他：请求体为 CSV，按行流式读取
+    """
+    upload = request.files.get('file')
+    if upload is not None:
+        upload_file = tempfile.TemporaryFile()
         try:
-            conn = get_db_connection()
-            cursor = conn.cursor(dictionary=True)
-            
-            cursor.execute("""
-                SELECT 
-                    from_station_travel_group,
-                    to_station_travel_group,
-                    travel_time,
-                    line_id,
-                    from_station_cn,
-                    to_station_cn,
-                    from_station_en,
-                    to_station_en
-                FROM Dijkstra
-                WHERE from_station_cn IS NOT NULL 
-                  AND to_station_cn IS NOT NULL
-            """)
-            
-            for row in cursor:
-                from_node = row['from_station_travel_group']
-                to_node = row['to_station_travel_group']
-                line_id = row['line_id']
-                time = row['travel_time']
-
-                # 构建图结构
-                if from_node not in self.graph:
-                    self.graph[from_node] = []
-                self.graph[from_node].append((to_node, time))
-                
-                # 存储连接信息
-                self.connections[(from_node, to_node)] = {
-                    'line_id': line_id,
-                    'time': time
-                }
-                
-                # 添加反向关系
-                if to_node not in self.graph:
-                    self.graph[to_node] = []
-                self.graph[to_node].append((from_node, time))
-                self.connections[(to_node, from_node)] = {
-                    'line_id': line_id,
-                    'time': time
-                }
-                
-                # 添加名称映射
-                self._add_mapping(row['from_station_cn'], row['from_station_en'], from_node)
-                self._add_mapping(row['to_station_cn'], row['to_station_en'], to_node)
-                    
-        except Exception as e:
-            logger.error(f"构建图结构时出错: {str(e)}", exc_info=True)
+            shutil.copyfileobj(upload.stream, upload_file)
+            upload_file.seek(0)
+            if (upload.filename or '').lower().endswith('.parquet') or 'parquet' in (upload.mimetype or ''):
+                return parquet_point_chunks(upload_file, lat_column, lng_column, SNAP_CHUNK_SIZE), upload_file
+            return csv_point_chunks(upload_file, lat_column, lng_column, SNAP_CHUNK_SIZE), upload_file
+        except Exception:
+            upload_file.close()
             raise
-        finally:
-            if cursor:
-                cursor.close()
-            if conn:
-                conn.close()
-    
-    def find_travel_group(self, station_name):
-        if not station_name:
-            return None
-        return self.name_to_groups.get(station_name.lower().strip())
-    
-    def dijkstra_shortest_path(self, start_group, end_group):
+
+    if request.is_json:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict) or not isinstance(data.get(lat_column), list) \
+                or not isinstance(data.get(lng_column), list):
+            raise ValueError(f'JSON 请求体必须包含 {lat_column} 与 {lng_column} 两个数组')
+        lats, lngs = data[lat_column], data[lng_column]
+        if len(lats) != len(lngs):
+            raise ValueError(f'{lat_column} 与 {lng_column} 长度不同')
+        if len(lats) > MAX_SNAP_JSON_POINTS:
+            raise ValueError(f'JSON 请求单次最多 {MAX_SNAP_JSON_POINTS} 个点，更多请上传 CSV 或 Parquet')
+        return array_point_chunks(lats, lngs, SNAP_CHUNK_SIZE), None
+
+    return csv_point_chunks(request.stream, lat_column, lng_column, SNAP_CHUNK_SIZE), None
+
+@app.route('/smartmetro/nearest_stations/batch', methods=['POST'])
+@handle_errors
+def snap_nearest_stations():
+    """
+    GPS 轨迹批量匹配最近站点，结果按输入顺序以 CSV 流式返回：point_index,stat_id,travel_group,name_cn,distance_m
+    POST /smartmetro/nearest_stations/batch[?lat_column=lat&lng_column=lng]
+    请求体为 CSV（或 multipart 上传 CSV / Parquet 文件 file），也可为 JSON {"lat": [...], "lng": [...]}；
+    每 SMARTMETRO_SNAP_CHUNK_SIZE 个点读取、计算、输出一次，内存占用与总点数无关。
+    坐标无法解析或超出经纬度范围的点站点各列与距离为空；
+    输出中途出错时最后一行的 point_index 为 error、name_cn 为错误信息，之后不再有结果
+    """
+    lat_column = request.args.get('lat_column', DEFAULT_LAT_COLUMN)
+    lng_column = request.args.get('lng_column', DEFAULT_LNG_COLUMN)
+    try:
+        point_chunks, upload_file = read_snap_points(lat_column, lng_column)
+    except (ValueError, UnicodeDecodeError) as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 400
+
+    grid = station_locator.current()
+    if not len(grid):
+        if upload_file:
+            upload_file.close()
+        return jsonify({
+            'success': False,
+            'message': '站点空间索引未就绪'
+        }), 503
+
+    def generate():
         try:
-            if not start_group or not end_group:
-                return None
-            if start_group not in self.graph or end_group not in self.graph:
-                return None
-            
-            # Heap (总时间, 当前节点, 路径, 当前线路)
-            heap = [(0, start_group, [], None)]
-            visited = set()
-                
-            while heap:
-                (total_time, current, path, current_line) = heapq.heappop(heap)
-            
-                if current in visited:
-                    continue
-                    
-                visited.add(current)
-                path = path + [current]
-            
-                if current == end_group:
-                    return {
-                        'path': path,
-                        'total_time': total_time
-                    }
-                
-                for neighbor, time in self.graph.get(current, []):
-                    if neighbor not in visited:
-                        # 获取连接信息
-                        conn_info = self.connections.get((current, neighbor))
-                        if not conn_info:
-                            continue
-                            
-                        new_line = conn_info['line_id']
-                        new_total_time = total_time + time
-                        
-                        # 检查是否换乘（线路变更且不是初始状态）
-                        if current_line is not None and new_line != current_line:
-                            new_total_time += 5  # 增加换乘时间
-                        
-                        heapq.heappush(heap, (new_total_time, neighbor, path, new_line))
-                            
-            return None
+            yield from snap_csv(grid, point_chunks)
         except Exception as e:
-            logger.error(f"Dijkstra算法执行出错: {str(e)}", exc_info=True)
-            return None
+            # 响应已开始，无法再返回错误状态码，结果在出错处截断并以错误行结尾
+            logger.error(f"批量匹配最近站点失败: {str(e)}", exc_info=True)
+            yield error_csv_row(str(e))
+        finally:
+            if upload_file:
+                upload_file.close()
+
+    return Response(stream_with_context(generate()), mimetype='text/csv')
+
+# ======= 站名联想 API =======
+
+@app.route('/smartmetro/stations/suggest', methods=['GET'])
+@handle_errors
+def suggest_stations():
+    """
+    站名联想：支持中文、英文、拼音全拼 / 首字母、前缀、错别字，不访问数据库
+    GET /smartmetro/stations/suggest?q=xujiahui&limit=10
+    """
+    query = request.args.get('q', '').strip()
+    try:
+        limit = int(request.args.get('limit', 10))
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'message': 'limit 必须为整数'
+        }), 400
+
+    if not query:
+        return jsonify({
+            'success': False,
+            'message': '必须提供 q 参数'
+        }), 400
+
+    name_index = graph_store.current.name_index
+    if name_index is None:
+        return jsonify({
+            'success': False,
+            'message': '站名检索未就绪'
+        }), 503
+
+    return jsonify({
+        'success': True,
+        'data': name_index.suggest(query, max(1, min(limit, MAX_SUGGESTIONS)))
+    })
+
+# ======= Dijkstra 最短路径 API =======
+
+def load_station_graph():
+    """从 Dijkstra 表构建一份全新的图快照"""
+    graph = StationGraph()
+    graph.build_graph(get_db_connection)
+    if CSR_GRAPH_DIR:
+        from csr_graph import CSRStationGraph
+        graph.version = graph.compute_version()
+        directory = os.path.join(CSR_GRAPH_DIR, graph.version)
+        if not os.path.exists(os.path.join(directory, 'meta.json')):
+            CSRStationGraph.from_station_graph(graph).save(directory)
+        graph = CSRStationGraph.load(directory)
+    if ALL_PAIRS_DIR:
+        from all_pairs import AllPairsTable
+        graph.all_pairs = AllPairsTable.load_or_build(graph, ALL_PAIRS_DIR)
+    if CONTRACTION_DIR:
+        from contraction import ContractionHierarchy
+        graph.contraction = ContractionHierarchy.load_or_build(graph, CONTRACTION_DIR)
+    try:
+        graph.name_index = StationNameIndex.load(get_db_connection, graph)
+    except Exception as e:
+        # 站名检索不可用时仅支持精确站名
+        logger.error(f"构建站名检索失败: {str(e)}", exc_info=True)
+    try:
+        graph.coordinates = StationCoordinates.load(get_db_connection, graph)
+    except Exception as e:
+        # 无坐标时 algorithm=astar 退化为 Dijkstra
+        logger.error(f"加载站点坐标失败: {str(e)}", exc_info=True)
+    try:
+        graph.accessibility = AccessibilityIndex.load(get_db_connection, graph)
+    except Exception as e:
+        # 无障碍数据不可用时 mode=accessible 返回 503
+        logger.error(f"加载无障碍站台数据失败: {str(e)}", exc_info=True)
+    return graph
 
 # 初始化图结构
-station_graph = StationGraph()
+graph_store = GraphStore(load_station_graph)
 try:
-    station_graph.build_graph()
+    graph_store.load()
     logger.info("地铁图结构构建成功")
 except Exception as e:
     logger.error(f"初始化地铁图结构失败: {str(e)}")
     raise
 
+batch_router = BatchRouter(graph_store.current)
+
+def on_graph_swap(graph, old_graph):
+    # 进程池中的子进程持有旧图，切换后换用新的批量路由器
+    global batch_router
+    old_router, batch_router = batch_router, BatchRouter(graph)
+    old_router.close()
+
+graph_store.add_listener(on_graph_swap)
+
+# 路线响应缓存，键中带图版本，图切换后整体清空
+route_cache = RouteCache(ROUTE_CACHE_SIZE)
+
+def on_graph_swap_cache(graph, old_graph):
+    route_cache.clear()
+
+graph_store.add_listener(on_graph_swap_cache)
+
+# 车厢拥挤度汇总（comfort 模式），加载失败不影响其他模式
+crowding_index = CrowdingIndex(
+    get_db_connection,
+    threshold=COMFORT_CROWD_THRESHOLD,
+    penalty_ratio=COMFORT_PENALTY_RATIO
+)
+try:
+    crowding_index.load_directions()
+except Exception as e:
+    logger.error(f"加载拥挤度索引失败: {str(e)}", exc_info=True)
+
+def on_graph_swap_crowding(graph, old_graph):
+    # 线路数据可能已变化，重新加载边的运行方向
+    crowding_index.load_directions()
+
+graph_store.add_listener(on_graph_swap_crowding)
+
+# 站间行驶时间前缀和索引（next_trains），定期检查 station_path_order / station_travel_time 是否变化
+travel_time_index = TravelTimeIndex(
+    get_db_connection,
+    refresh_seconds=TRAVEL_TIME_REFRESH_SECONDS,
+    learned_days=LEARNED_DAYS,
+    min_samples=LEARNED_MIN_SAMPLES
+)
+try:
+    travel_time_index.load()
+except Exception as e:
+    # 首次查询时重试
+    logger.error(f"加载行驶时间索引失败: {str(e)}", exc_info=True)
+
+def on_graph_swap_travel_time(graph, old_graph):
+    # 重建图时线路数据可能已变化，不等检查间隔直接重新加载
+    travel_time_index.load()
+
+graph_store.add_listener(on_graph_swap_travel_time)
+
+# 最近站点空间索引（nearest_stations），定期检查 station_map 是否变化
+station_locator = StationLocator(
+    get_db_connection,
+    refresh_seconds=STATION_MAP_REFRESH_SECONDS,
+    cell_km=STATION_GRID_CELL_KM
+)
+try:
+    station_locator.load()
+except Exception as e:
+    # 首次查询时重试
+    logger.error(f"加载站点空间索引失败: {str(e)}", exc_info=True)
+
+def on_graph_swap_station_locator(graph, old_graph):
+    station_locator.load()
+
+graph_store.add_listener(on_graph_swap_station_locator)
+
+# 列车实时位置（next_trains），上报只写内存，后台批量写回数据库
+live_train_store = LiveTrainStore(
+    get_db_connection,
+    flush_seconds=TRAIN_FLUSH_SECONDS,
+    stale_minutes=TRAIN_STALE_MINUTES,
+    record_history=POSITION_HISTORY
+)
+try:
+    live_train_store.load()
+except Exception as e:
+    logger.error(f"恢复列车实时位置失败: {str(e)}", exc_info=True)
+live_train_store.start()
+atexit.register(live_train_store.stop)
+
+# 列车位置历史的日分区维护与区段运行时间汇总，汇总结果由行驶时间索引在下次检查时加载
+position_history = PositionHistory(
+    get_db_connection,
+    learned_days=LEARNED_DAYS,
+    retention_days=HISTORY_RETENTION_DAYS
+)
+if POSITION_HISTORY:
+    position_history.start()
+
+# 首末班车时刻表（按出发时间规划），加载失败时该接口返回 503
+timetable_planner = None
+try:
+    timetable_planner = TimetablePlanner.load(get_db_connection, headway=TIMETABLE_HEADWAY)
+except Exception as e:
+    logger.error(f"加载时刻表失败: {str(e)}", exc_info=True)
+
+def on_graph_swap_timetable(graph, old_graph):
+    global timetable_planner
+    timetable_planner = TimetablePlanner.load(get_db_connection, headway=TIMETABLE_HEADWAY)
+
+graph_store.add_listener(on_graph_swap_timetable)
+
+# 全站点最短时间矩阵（批量等时圈），首次请求时构建，按图版本缓存
+travel_time_matrix = None
+travel_time_matrix_lock = threading.Lock()
+
+def get_travel_time_matrix(graph):
+    global travel_time_matrix
+    with travel_time_matrix_lock:
+        if travel_time_matrix is None or travel_time_matrix.version != graph.version:
+            travel_time_matrix = TravelTimeMatrix.build(graph)
+        return travel_time_matrix
+
+def on_graph_swap_matrix(graph, old_graph):
+    global travel_time_matrix
+    travel_time_matrix = None
+
+graph_store.add_listener(on_graph_swap_matrix)
+
+def get_mode_penalties(mode):
+    """路线规划模式对应的附加代价，fastest 返回 None"""
+    if mode == 'comfort':
+        return crowding_index.penalties()
+    return None
+
+def get_mode_step_free(mode, graph):
+    """accessible 模式使用图快照上预计算的无障碍位图，其他模式不限制换乘"""
+    if mode == 'accessible':
+        return graph.accessibility
+    return None
+
+def check_mode_available(mode, graph):
+    """accessible 模式需要无障碍位图，未加载时返回 503 响应，否则返回 None"""
+    if mode == 'accessible' and graph.accessibility is None:
+        return jsonify({
+            'success': False,
+            'message': '无障碍站台数据未就绪'
+        }), 503
+    return None
+
+# kill -HUP <pid> 触发后台重建
+try:
+    signal.signal(signal.SIGHUP, lambda signum, frame: graph_store.reload_async())
+except (AttributeError, ValueError):
+    # Windows 没有 SIGHUP；非主线程导入时无法注册信号
+    logger.warning("未注册 SIGHUP 图重建信号，请使用 /smartmetro/admin/reload_graph")
+
 @app.route('/smartmetro/dijkstra', methods=['GET'])
 @handle_errors
 def find_shortest_path():
@@ -366,6 +520,25 @@ def find_shortest_path():
             'message': '必须提供起始站和目的站'
         }), 400
     
+    mode = request.args.get('mode', 'fastest')
+    if mode not in ROUTE_MODES:
+        return jsonify({
+            'success': False,
+            'message': f"mode 必须为 {' / '.join(ROUTE_MODES)} 之一"
+        }), 400
+    
+    # 指定 algorithm 时实时搜索并在响应中附带已确定的节点数，用于对比各算法的搜索范围
+    algorithm = request.args.get('algorithm')
+    if algorithm is not None and algorithm not in SEARCH_ALGORITHMS:
+        return jsonify({
+            'success': False,
+            'message': f"algorithm 必须为 {' / '.join(SEARCH_ALGORITHMS)} 之一"
+        }), 400
+    
+    station_graph = graph_store.current
+    unavailable = check_mode_available(mode, station_graph)
+    if unavailable:
+        return unavailable
     start_group = station_graph.find_travel_group(from_station)
     end_group = station_graph.find_travel_group(to_station)
     
@@ -377,7 +550,23 @@ def find_shortest_path():
             'end_station': to_station
         }), 400
         
-    result = station_graph.dijkstra_shortest_path(start_group, end_group)
+    # comfort 模式的结果随拥挤度变化：先按需刷新拥挤度（否则缓存一直命中、版本号不会变化），
+    # 再取拥挤度版本，之后才计算，版本变化后旧条目不再命中
+    if mode == 'comfort':
+        crowding_index.penalties()
+    cache_mode = (mode, crowding_index.version) if mode == 'comfort' else mode
+    cache_key = (start_group, end_group, cache_mode, station_graph.version, algorithm)
+    body = route_cache.get(cache_key)
+    if body is not None:
+        return Response(body, mimetype='application/json', headers={'X-Cache': 'HIT'})
+        
+    search = None
+    if algorithm:
+        result, search = search_with_stats(station_graph, start_group, end_group, algorithm,
+                                           get_mode_penalties(mode), get_mode_step_free(mode, station_graph))
+    else:
+        result = station_graph.route(start_group, end_group, get_mode_penalties(mode),
+                                     get_mode_step_free(mode, station_graph))
     
     if not result:
         return jsonify({
@@ -387,59 +576,355 @@ def find_shortest_path():
             'end_station': station_graph.station_info.get(end_group, {}).get('cn')
         }), 404
         
-    # 构建完整路径信息
-    formatted_path = []
-    cumulative_time = 0
-    previous_line = None
-
-    for i in range(len(result['path']) - 1):
-        current = result['path'][i]
-        next_node = result['path'][i+1]
-        
-        # 获取连接信息
-        conn_info = station_graph.connections.get((current, next_node))
-        if not conn_info:
-            continue
-            
-        line_id = conn_info['line_id']
-        segment_time = conn_info['time']
-        
-        # 检查是否换乘
-        if previous_line is not None and line_id != previous_line:
-            # 添加换乘时间
-            cumulative_time += 5
-            formatted_path.append({
-                'transfer': True,
-                'transfer_time': 5,
-                'cumulative_time': cumulative_time,
-                'message': f"换乘到{line_id}号线",
-                'from_line': previous_line,
-                'to_line': line_id
-            })
-        
-        cumulative_time += segment_time
-        previous_line = line_id
-        
-        formatted_path.append({
-            'from_station': station_graph.station_info.get(current, {'cn': '未知', 'en': 'Unknown'}),
-            'to_station': station_graph.station_info.get(next_node, {'cn': '未知', 'en': 'Unknown'}),
-            'line_id': line_id,
-            'segment_time': segment_time,
-            'cumulative_time': cumulative_time,
-            'transfer': False
-        })
-    
+    response = {
+        'success': True,
+        'data': station_graph.format_route(result, start_group, end_group),
+        'mode': mode,
+        'graph_version': station_graph.version
+    }
+    if search:
+        response['search'] = search
+    body = json.dumps(response).encode('utf-8')
+    route_cache.put(cache_key, body)
+    return Response(body, mimetype='application/json', headers={'X-Cache': 'MISS'})
+
+# ======= 批量路线规划 API =======
+
+@app.route('/smartmetro/dijkstra/batch', methods=['POST'])
+@handle_errors
+def find_shortest_paths_batch():
+    """
+    批量查询多个 OD 对的最短路径，结果以 NDJSON 流式返回（按完成顺序，每行带 index）
+    POST /smartmetro/dijkstra/batch
+    {"pairs": [{"from": "人民广场", "to": "虹桥火车站"}, ["莘庄", "世纪大道"], ...], "mode": "comfort"}
+    """
+    data = request.get_json(silent=True) or {}
+    raw_pairs = data.get('pairs') if isinstance(data, dict) else data
+    mode = (data.get('mode') if isinstance(data, dict) else None) or request.args.get('mode', 'fastest')
+
+    if mode not in ROUTE_MODES:
+        return jsonify({
+            'success': False,
+            'message': f"mode 必须为 {' / '.join(ROUTE_MODES)} 之一"
+        }), 400
+
+    if not isinstance(raw_pairs, list) or not raw_pairs:
+        return jsonify({
+            'success': False,
+            'message': '必须提供 pairs 列表'
+        }), 400
+
+    if len(raw_pairs) > MAX_BATCH_PAIRS:
+        return jsonify({
+            'success': False,
+            'message': f'单次最多 {MAX_BATCH_PAIRS} 个 OD 对'
+        }), 400
+
+    pairs = []
+    for pair in raw_pairs:
+        if isinstance(pair, dict):
+            pairs.append((pair.get('from'), pair.get('to')))
+        elif isinstance(pair, (list, tuple)) and len(pair) == 2:
+            pairs.append((pair[0], pair[1]))
+        else:
+            pairs.append((None, None))
+
+    router = batch_router
+    unavailable = check_mode_available(mode, router.station_graph)
+    if unavailable:
+        return unavailable
+    response = Response(
+        stream_with_context(router.stream(pairs, get_mode_penalties(mode),
+                                          get_mode_step_free(mode, router.station_graph))),
+        mimetype='application/x-ndjson'
+    )
+    response.headers['X-Graph-Version'] = router.station_graph.version
+    return response
+
+# ======= 备选路线 API =======
+
+@app.route('/smartmetro/routes/alternatives', methods=['GET'])
+@handle_errors
+def find_alternative_routes():
+    """
+    返回至多 k 条互相有明显差异的备选路线
+    GET /smartmetro/routes/alternatives?from=人民广场&to=虹桥火车站&k=3&budget_ms=200&mode=comfort
+    """
+    from_station = request.args.get('from')
+    to_station = request.args.get('to')
+
+    if not from_station or not to_station:
+        return jsonify({
+            'success': False,
+            'message': '必须提供起始站和目的站'
+        }), 400
+
+    try:
+        k = min(max(int(request.args.get('k', 3)), 1), MAX_ALTERNATIVES)
+        budget_ms = float(request.args.get('budget_ms', DEFAULT_BUDGET_MS))
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'message': 'k 和 budget_ms 必须为数字'
+        }), 400
+
+    # nan 使截止时间的比较恒为假，不能限制搜索时间
+    if not math.isfinite(budget_ms) or budget_ms <= 0:
+        return jsonify({
+            'success': False,
+            'message': 'budget_ms 必须为正数'
+        }), 400
+    budget_ms = min(budget_ms, DEFAULT_BUDGET_MS)
+
+    mode = request.args.get('mode', 'fastest')
+    if mode not in ROUTE_MODES:
+        return jsonify({
+            'success': False,
+            'message': f"mode 必须为 {' / '.join(ROUTE_MODES)} 之一"
+        }), 400
+
+    station_graph = graph_store.current
+    unavailable = check_mode_available(mode, station_graph)
+    if unavailable:
+        return unavailable
+    start_group = station_graph.find_travel_group(from_station)
+    end_group = station_graph.find_travel_group(to_station)
+
+    if not start_group or not end_group:
+        return jsonify({
+            'success': False,
+            'message': '无效的车站名称',
+            'start_station': from_station,
+            'end_station': to_station
+        }), 400
+
+    routes, truncated = k_shortest_paths(
+        station_graph, start_group, end_group, k,
+        budget_ms=budget_ms, penalties=get_mode_penalties(mode),
+        step_free=get_mode_step_free(mode, station_graph)
+    )
+
+    if not routes:
+        return jsonify({
+            'success': False,
+            'message': '未找到路径',
+            'start_station': station_graph.station_info.get(start_group, {}).get('cn'),
+            'end_station': station_graph.station_info.get(end_group, {}).get('cn')
+        }), 404
+
     return jsonify({
         'success': True,
         'data': {
-            'path': formatted_path,
-            'total_time': result['total_time'],
+            'routes': [station_graph.format_route(route, start_group, end_group) for route in routes],
             'from_station': station_graph.station_info.get(start_group, {'cn': '未知', 'en': 'Unknown'}),
             'to_station': station_graph.station_info.get(end_group, {'cn': '未知', 'en': 'Unknown'}),
-            'transfer_count': len([p for p in formatted_path if p.get('transfer')])
+            'truncated': truncated
+        },
+        'mode': mode,
+        'graph_version': station_graph.version
+    })
+
+# ======= 按出发时间规划 API =======
+
+@app.route('/smartmetro/routes/earliest_arrival', methods=['GET'])
+@handle_errors
+def find_earliest_arrival():
+    """
+    考虑首末班车的最早到达路线（Connection Scan）
+    GET /smartmetro/routes/earliest_arrival?from=莘庄&to=上海火车站&depart_at=22:40
+    depart_at 可为 HH:MM 或 YYYY-MM-DD HH:MM，缺省为当前时间。
+    末班车已过无法到达时返回最短路线，并在错过末班车的区段标记 missed_last_train。
+    """
+    from_station = request.args.get('from')
+    to_station = request.args.get('to')
+
+    if not from_station or not to_station:
+        return jsonify({
+            'success': False,
+            'message': '必须提供起始站和目的站'
+        }), 400
+
+    try:
+        depart_at = parse_depart_at(request.args.get('depart_at'))
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'message': 'depart_at 格式应为 HH:MM 或 YYYY-MM-DD HH:MM'
+        }), 400
+
+    planner = timetable_planner
+    if planner is None:
+        return jsonify({
+            'success': False,
+            'message': '时刻表未加载'
+        }), 503
+
+    station_graph = graph_store.current
+    start_group = station_graph.find_travel_group(from_station)
+    end_group = station_graph.find_travel_group(to_station)
+
+    if not start_group or not end_group:
+        return jsonify({
+            'success': False,
+            'message': '无效的车站名称',
+            'start_station': from_station,
+            'end_station': to_station
+        }), 400
+
+    journey = planner.earliest_arrival(start_group, end_group, depart_at)
+    reachable = journey is not None
+    if not reachable:
+        result = station_graph.route(start_group, end_group)
+        if not result:
+            return jsonify({
+                'success': False,
+                'message': '未找到路径',
+                'start_station': station_graph.station_info.get(start_group, {}).get('cn'),
+                'end_station': station_graph.station_info.get(end_group, {}).get('cn')
+            }), 404
+        journey = planner.check_route(result, depart_at)
+
+    data = format_journey(journey, station_graph.station_info)
+    data.update({
+        'from_station': station_graph.station_info.get(start_group, {'cn': '未知', 'en': 'Unknown'}),
+        'to_station': station_graph.station_info.get(end_group, {'cn': '未知', 'en': 'Unknown'}),
+        'reachable': reachable
+    })
+    response = {
+        'success': True,
+        'data': data,
+        'graph_version': station_graph.version
+    }
+    if not reachable:
+        response['message'] = '末班车已过，无法按时刻表到达'
+    return jsonify(response)
+
+# ======= 等时圈 API =======
+
+def parse_isochrone_minutes():
+    """解析 minutes 参数，返回 (分钟数, 错误响应)"""
+    try:
+        minutes = int(request.args.get('minutes', ''))
+    except ValueError:
+        return None, (jsonify({
+            'success': False,
+            'message': 'minutes 必须为整数'
+        }), 400)
+    if not 0 < minutes <= MAX_ISOCHRONE_MINUTES:
+        return None, (jsonify({
+            'success': False,
+            'message': f'minutes 必须在 1 到 {MAX_ISOCHRONE_MINUTES} 之间'
+        }), 400)
+    return minutes, None
+
+@app.route('/smartmetro/isochrone', methods=['GET'])
+@handle_errors
+def get_isochrone():
+    """
+    从起点出发 minutes 分钟内可达的所有站点（含换乘时间），附到达时间与坐标
+    GET /smartmetro/isochrone?from=人民广场&minutes=30
+    """
+    from_station = request.args.get('from')
+    if not from_station:
+        return jsonify({
+            'success': False,
+            'message': '必须提供起始站'
+        }), 400
+
+    minutes, error = parse_isochrone_minutes()
+    if error:
+        return error
+
+    station_graph = graph_store.current
+    start_group = station_graph.find_travel_group(from_station)
+    if not start_group:
+        return jsonify({
+            'success': False,
+            'message': '无效的车站名称',
+            'start_station': from_station
+        }), 400
+
+    # 有界搜索：出堆时间超过 minutes 即停止
+    stations = format_isochrone(station_graph.reachable_within(start_group, minutes), station_graph)
+    return jsonify({
+        'success': True,
+        'data': {
+            'from_station': station_graph.station_info.get(start_group, {'cn': '未知', 'en': 'Unknown'}),
+            'travel_group': start_group,
+            'minutes': minutes,
+            'count': len(stations),
+            'stations': stations
+        },
+        'graph_version': station_graph.version
+    })
+
+@app.route('/smartmetro/isochrone/all', methods=['GET'])
+@handle_errors
+def get_all_isochrones():
+    """
+    所有站点的等时圈，基于按图版本缓存的全站点最短时间矩阵
+    GET /smartmetro/isochrone/all?minutes=30
+    每个起点返回可达站点数及 [[travel_group, 分钟], ...]（按时间排序）
+    """
+    minutes, error = parse_isochrone_minutes()
+    if error:
+        return error
+
+    station_graph = graph_store.current
+    matrix = get_travel_time_matrix(station_graph)
+    origins = [
+        {
+            'travel_group': origin,
+            'name_cn': station_graph.station_info.get(origin, {}).get('cn'),
+            'count': len(reachable),
+            'reachable': reachable
         }
+        for origin, reachable in matrix.within(minutes).items()
+    ]
+    return jsonify({
+        'success': True,
+        'data': {
+            'minutes': minutes,
+            'origins': origins
+        },
+        'graph_version': matrix.version
     })
 
+# ======= 图结构热更新 API =======
+
+@app.route('/smartmetro/admin/reload_graph', methods=['GET', 'POST'])
+@handle_errors
+def reload_graph():
+    """
+    GET 查看当前图快照版本；POST 在后台重建图结构，完成后原子替换
+    POST /smartmetro/admin/reload_graph
+    """
+    if ADMIN_TOKEN and request.headers.get('X-Admin-Token') != ADMIN_TOKEN:
+        return jsonify({'success': False, 'message': 'Forbidden'}), 403
+
+    if request.method == 'GET':
+        return jsonify({'success': True, 'data': graph_store.status()})
+
+    started = graph_store.reload_async()
+    return jsonify({
+        'success': True,
+        'message': '已开始重建图结构' if started else '图结构正在重建中',
+        'data': graph_store.status()
+    }), 202
+
+@app.route('/smartmetro/admin/route_cache', methods=['GET', 'DELETE'])
+@handle_errors
+def route_cache_status():
+    """
+    GET 查看路线缓存的命中 / 未命中 / 淘汰计数；DELETE 清空缓存
+    """
+    if ADMIN_TOKEN and request.headers.get('X-Admin-Token') != ADMIN_TOKEN:
+        return jsonify({'success': False, 'message': 'Forbidden'}), 403
+
+    if request.method == 'DELETE':
+        route_cache.clear()
+    return jsonify({'success': True, 'data': route_cache.stats()})
+
 # ======= 安检口拥挤情况 API =======
 
 @app.route('/smartmetro/congestion_details', methods=['GET'])
@@ -525,6 +1010,8 @@ def post_line_crowding():
                  VALUES (%s, %s, %s, %s, %s)"""
         cursor.execute(sql, (line_number, line_carriage, person_num, crowd_level, path_id))
         conn.commit()
+        # 立即计入 comfort 模式的拥挤度汇总
+        crowding_index.apply(line_number, line_carriage, path_id, crowd_level, cursor.lastrowid)
         cursor.close()
         
         return jsonify({
@@ -629,6 +1116,7 @@ def clear_crowding():
         cursor.execute(sql)
         conn.commit()
         cursor.close()
+        crowding_index.clear()
 
         return jsonify({"status": "success", "message": "Table cleared successfully."})
 
@@ -640,141 +1128,299 @@ def clear_crowding():
 
 # ======= 列车到站时间 API =======
 
-@app.route('/smartmetro/train/report_status', methods=['POST'])
-def report_train_status():
-    data = request.get_json()
-    required_fields = ["train_number", "station_id", "next_station_id", "timestamp", "path_id"]
+# 批量上报的 JSON 数组逐个元素解析
+_json_decoder = JSONDecoder()
 
-    if not all(field in data for field in required_fields):
-        return jsonify({"error": "Missing required fields"}), 400
+TRAIN_STATUS_FIELDS = ["train_number", "station_id", "next_station_id", "timestamp", "path_id"]
+
+def parse_train_status(data):
+    """校验一条列车上报，返回 (记录, 错误信息)，两者有且仅有一个为 None"""
+    if not isinstance(data, dict) or not all(field in data for field in TRAIN_STATUS_FIELDS):
+        return None, "Missing required fields"
 
     try:
         timestamp = datetime.strptime(data['timestamp'], "%Y-%m-%dT%H:%M:%S")
-    except ValueError:
-        return jsonify({"error": "Invalid timestamp format, use YYYY-MM-DDTHH:MM:SS"}), 400
+    except (TypeError, ValueError):
+        return None, "Invalid timestamp format, use YYYY-MM-DDTHH:MM:SS"
 
-    conn = get_db_connection()
     try:
-        with conn.cursor() as cursor:
-            sql = """
-                INSERT INTO train_realtime_status 
-                (train_number, station_id, next_station_id, timestamp, path_id)
-                VALUES (%s, %s, %s, %s, %s)
-                ON DUPLICATE KEY UPDATE 
-                station_id = VALUES(station_id),
-                next_station_id = VALUES(next_station_id),
-                timestamp = VALUES(timestamp),
-                path_id = VALUES(path_id)
-            """
-            cursor.execute(sql, (
-                data['train_number'],
-                data['station_id'],
-                data['next_station_id'],
-                timestamp,
-                data['path_id']
-            ))
-            conn.commit()
-        return jsonify({"status": "success", "message": "Train status updated!"})
-    finally:
-        conn.close()
-
-@app.route('/smartmetro/next_trains', methods=['GET'])
-def get_next_trains():
-    station_name = request.args.get('station_name')
+        station_id = int(data['station_id'])
+        next_station_id = int(data['next_station_id'])
+        path_id = int(data['path_id'])
+    except (TypeError, ValueError):
+        return None, "station_id, next_station_id and path_id must be integers"
+
+    return {
+        'train_number': str(data['train_number']),
+        'station_id': station_id,
+        'next_station_id': next_station_id,
+        'timestamp': timestamp,
+        'path_id': path_id
+    }, None
 
-    if not station_name:
-        return jsonify({"error": "Missing station_name parameter"}), 400
+@app.route('/smartmetro/train/report_status', methods=['POST'])
+def report_train_status():
+    record, error = parse_train_status(request.get_json())
+    if error:
+        return jsonify({"error": error}), 400
+
+    # 只更新内存，由后台线程批量写回 train_realtime_status
+    live_train_store.update(**record)
+    return jsonify({"status": "success", "message": "Train status updated!"})
+
+def iter_json_array(body):
+    """逐个解析 JSON 数组的元素，不先构造整个列表；格式错误时抛出 ValueError"""
+    end = len(body)
+
+    def skip_whitespace(pos):
+        while pos < end and body[pos] in ' \t\r\n':
+            pos += 1
+        return pos
+
+    pos = skip_whitespace(skip_whitespace(0) + 1)
+    if pos < end and body[pos] == ']':
+        pos += 1
+    else:
+        while True:
+            item, pos = _json_decoder.raw_decode(body, pos)
+            yield item
+            pos = skip_whitespace(pos)
+            if pos < end and body[pos] == ']':
+                pos += 1
+                break
+            if pos >= end or body[pos] != ',':
+                raise ValueError("Expecting ',' or ']'")
+            pos = skip_whitespace(pos + 1)
+    if skip_whitespace(pos) != end:
+        raise ValueError("Extra data")
+
+def read_body_lines(stream, max_bytes):
+    """按行读取请求体，累计超过 max_bytes 字节时抛出 RequestEntityTooLarge（分块传输时没有 Content-Length 可查）"""
+    total = 0
+    while True:
+        line = stream.readline(max_bytes + 1 - total)
+        if not line:
+            return
+        total += len(line)
+        if total > max_bytes:
+            raise RequestEntityTooLarge()
+        yield line.decode('utf-8')
+
+def read_bulk_statuses(limit, max_bytes):
+    """
+    读取批量上报的请求体：JSON 数组，或 NDJSON（每行一个 JSON 对象，Content-Type 为 application/x-ndjson 时按行流式读取）
+    返回 [(序号, 原始对象或 None, 解析错误或 None), ...]，请求体整体无法解析时抛出 ValueError；
+    边读边计数，读到第 limit + 1 条时立即停止并返回 None；请求体超过 max_bytes 字节时抛出 RequestEntityTooLarge
+    """
+    if request.content_length is not None and request.content_length > max_bytes:
+        raise RequestEntityTooLarge()
+    if request.mimetype in ('application/x-ndjson', 'application/ndjson', 'application/jsonl'):
+        lines = read_body_lines(request.stream, max_bytes)
+    else:
+        body = request.stream.read(max_bytes + 1)
+        if len(body) > max_bytes:
+            raise RequestEntityTooLarge()
+        body = body.decode('utf-8')
+        if body.lstrip().startswith('['):
+            statuses = []
+            for item in iter_json_array(body):
+                if len(statuses) >= limit:
+                    return None
+                statuses.append((len(statuses), item, None))
+            return statuses
+        lines = body.splitlines()
+
+    statuses = []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        if len(statuses) >= limit:
+            return None
+        try:
+            statuses.append((len(statuses), json.loads(line), None))
+        except ValueError:
+            statuses.append((len(statuses), None, "Invalid JSON"))
+    return statuses
 
-    conn = get_db_connection()
+@app.route('/smartmetro/train/report_status/bulk', methods=['POST'])
+def report_train_status_bulk():
+    """
+    批量上报列车位置，逐条校验，无效记录单独报错不影响其他记录
+    POST /smartmetro/train/report_status/bulk[?flush=1]
+    请求体为 JSON 数组或 NDJSON；flush=1 时在返回前把待写回记录以 executemany 批量写入数据库
+    """
     try:
-        with conn.cursor(buffered=True, dictionary=True) as cursor:
-            cursor.execute("""
-                SELECT path_id, station_id, station_order FROM station_path_order 
-                WHERE name_cn = %s
-            """, (station_name,))
-            target_stations = cursor.fetchall()
+        statuses = read_bulk_statuses(MAX_BULK_STATUSES, MAX_BULK_STATUS_BYTES)
+    except RequestEntityTooLarge:
+        return jsonify({"error": f"Body must not exceed {MAX_BULK_STATUS_BYTES} bytes"}), 413
+    except (ValueError, UnicodeDecodeError):
+        return jsonify({"error": "Body must be a JSON array or NDJSON"}), 400
+
+    if statuses is None:
+        return jsonify({"error": f"At most {MAX_BULK_STATUSES} statuses per request"}), 400
+
+    records = []
+    errors = []
+    for index, data, error in statuses:
+        record = None
+        if error is None:
+            record, error = parse_train_status(data)
+        if error:
+            errors.append({
+                "index": index,
+                "train_number": data.get('train_number') if isinstance(data, dict) else None,
+                "error": error
+            })
+        else:
+            records.append(record)
 
-            if not target_stations:
-                return jsonify({"error": "Station not found"}), 404
+    # 只更新内存，一次加锁；同一列车的多条上报按时间先后只保留最新一条
+    applied = live_train_store.update_many(records)
 
-            result = {}
+    response = {
+        "status": "success",
+        "received": len(statuses),
+        "accepted": sum(applied),
+        "ignored": len(applied) - sum(applied),
+        "errors": errors
+    }
+    if request.args.get('flush') in ('1', 'true'):
+        try:
+            response["written"] = live_train_store.flush()
+        except Exception as e:
+            # 记录已在内存中，后台线程会继续重试写回
+            logger.error(f"批量上报写回数据库失败: {str(e)}", exc_info=True)
+            response["write_error"] = str(e)
+    return jsonify(response)
 
-            for target_station in target_stations:
-                path_id = target_station['path_id']
-                target_station_id = target_station['station_id']
-                target_order = target_station['station_order']
-                target_line_id = target_station_id // 100
+@app.route('/smartmetro/admin/live_trains', methods=['GET', 'POST'])
+@handle_errors
+def live_trains_status():
+    """
+    GET 查看内存中的在线列车数、待写回条数和最近一次写回；POST 立即写回
+    """
+    if ADMIN_TOKEN and request.headers.get('X-Admin-Token') != ADMIN_TOKEN:
+        return jsonify({'success': False, 'message': 'Forbidden'}), 403
 
-                cursor.execute("""
-                    SELECT train_number, station_id, next_station_id, timestamp, path_id 
-                    FROM train_realtime_status 
-                    WHERE path_id = %s
-                """, (path_id,))
-                trains = cursor.fetchall()
+    if request.method == 'POST':
+        live_train_store.flush()
+    return jsonify({'success': True, 'data': live_train_store.status()})
 
-                arrivals = []
-                for train in trains:
-                    train_line_id = train['station_id'] // 100
+@app.route('/smartmetro/admin/segment_times', methods=['GET', 'POST'])
+@handle_errors
+def segment_times_status():
+    """
+    GET 查看区段运行时间汇总状态；POST 汇总指定日期（?date=YYYY-MM-DD，默认补齐尚未汇总的日期）并重建行驶时间索引
+    """
+    if ADMIN_TOKEN and request.headers.get('X-Admin-Token') != ADMIN_TOKEN:
+        return jsonify({'success': False, 'message': 'Forbidden'}), 403
 
-                    if train_line_id != target_line_id:
-                        continue
+    rolled_up = None
+    if request.method == 'POST':
+        day = request.args.get('date')
+        if day:
+            try:
+                day = datetime.strptime(day, '%Y-%m-%d').date()
+            except ValueError:
+                return jsonify({'success': False, 'message': 'date must be YYYY-MM-DD'}), 400
+            reports, segments = position_history.rollup_day(day)
+            rolled_up = {'date': day.isoformat(), 'reports': reports, 'segment_hours': segments}
+        else:
+            rolled_up = [day.isoformat() for day in position_history.run_once()]
+        travel_time_index.load()
+    data = position_history.status()
+    data['rolled_up'] = rolled_up
+    data['learned'] = travel_time_index.table.hourly_up is not None
+    return jsonify({'success': True, 'data': data})
+
+# 物化的到站看板：每条上报只更新该列车所在 path 上行驶方向前方的站点，next_trains 只读字典
+arrival_board = ArrivalBoard(
+    lambda: travel_time_index.table,
+    live_train_store,
+    per_direction=NEXT_TRAINS_PER_DIRECTION
+)
+if ARRIVAL_BOARD_MIRROR:
+    arrival_board.start_mirror(get_db_connection, mirror_seconds=ARRIVAL_BOARD_MIRROR_SECONDS)
+
+def next_trains_board(station_name):
+    """站点的到站看板（next_trains 响应体），只读内存；站名不存在时返回 None"""
+    travel_time_index.refresh()
+    return arrival_board.board(station_name)
 
-                    cursor.execute("""
-                        SELECT station_order FROM station_path_order 
-                        WHERE path_id = %s AND station_id = %s
-                    """, (path_id, train['next_station_id']))
-                    next_station_result = cursor.fetchone()
+@app.route('/smartmetro/next_trains', methods=['GET'])
+def get_next_trains():
+    station_name = request.args.get('station_name')
 
-                    if not next_station_result:
-                        continue
+    if not station_name:
+        return jsonify({"error": "Missing station_name parameter"}), 400
 
-                    next_order = next_station_result['station_order']
-                    direction = "up" if next_order > target_order else "down"
+    try:
+        board = next_trains_board(station_name)
+        if board is None:
+            return jsonify({"error": "Station not found"}), 404
+        return jsonify(board)
+    except Exception as e:
+        logger.error(f"获取下一班列车信息出错: {str(e)}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
 
-                    if (direction == "up" and next_order <= target_order) or (direction == "down" and next_order >= target_order):
-                        continue
+@app.route('/smartmetro/next_trains/line', methods=['GET'])
+def get_line_next_trains():
+    """
+    整条线路各站的到站看板，一次返回
+    GET /smartmetro/next_trains/line?line_id=1
+    """
+    line_id = request.args.get('line_id', type=int)
 
-                    total_travel_time = calculate_travel_time(conn, path_id, train['next_station_id'], target_station_id)
+    if line_id is None:
+        return jsonify({"error": "Missing or invalid line_id parameter"}), 400
 
-                    if total_travel_time is None:
-                        continue
+    try:
+        travel_time_index.refresh()
+        board = arrival_board.line_board(line_id)
+        if board is None:
+            return jsonify({"error": "Line not found"}), 404
+        return jsonify(board)
+    except Exception as e:
+        logger.error(f"获取线路到站看板出错: {str(e)}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
 
-                    arrival_time = train['timestamp'] + timedelta(minutes=total_travel_time)
+# 到站看板推送：每个被订阅的站点在数据变化时只计算一次，同一条消息发给所有订阅者
+arrival_board_hub = ArrivalBoardHub(
+    next_trains_board,
+    lambda: (arrival_board.version, id(travel_time_index.table)),
+    publish_seconds=BOARD_PUBLISH_SECONDS
+)
 
-                    arrivals.append({
-                        "train_number": train['train_number'],
-                        "direction": direction,
-                        "expected_arrival_time": arrival_time.strftime('%Y-%m-%d %H:%M:%S'),
-                        "path_id": train['path_id'],
-                        "line_id": train_line_id
-                    })
+@app.route('/smartmetro/next_trains/stream', methods=['GET'])
+def stream_next_trains():
+    """
+    订阅站点到站看板（Server-Sent Events），连接后立即收到当前看板，之后在列车位置变化时推送
+    GET /smartmetro/next_trains/stream?station_name=人民广场
+    每条消息为 event: board，data 与 /smartmetro/next_trains 的响应相同
+    """
+    station_name = request.args.get('station_name')
 
-                up_trains = sorted(
-                    [t for t in arrivals if t['direction'] == "up"],
-                    key=lambda x: x['expected_arrival_time']
-                )[:2]
+    if not station_name:
+        return jsonify({"error": "Missing station_name parameter"}), 400
 
-                down_trains = sorted(
-                    [t for t in arrivals if t['direction'] == "down"],
-                    key=lambda x: x['expected_arrival_time']
-                )[:2]
+    if not travel_time_index.current().names.get(station_name):
+        return jsonify({"error": "Station not found"}), 404
 
-                line_key = f"Line_{target_line_id}"
-                if line_key not in result:
-                    result[line_key] = {
-                        "up_direction": up_trains,
-                        "down_direction": down_trains
-                    }
+    return Response(
+        arrival_board_hub.stream(station_name, BOARD_HEARTBEAT_SECONDS),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
 
-            return jsonify({
-                "station_name": station_name,
-                "lines": result
-            })
-    except Exception as e:
-        logger.error(f"获取下一班列车信息出错: {str(e)}", exc_info=True)
-        return jsonify({"error": str(e)}), 500
-    finally:
-        conn.close()
+@app.route('/smartmetro/admin/arrival_boards', methods=['GET'])
+@handle_errors
+def arrival_boards_status():
+    """查看被订阅的站点数、订阅连接数、看板计算次数与推送消息数"""
+    if ADMIN_TOKEN and request.headers.get('X-Admin-Token') != ADMIN_TOKEN:
+        return jsonify({'success': False, 'message': 'Forbidden'}), 403
+
+    return jsonify({'success': True, 'data': {**arrival_board_hub.stats(), 'board': arrival_board.stats()}})
 
 # ======= 地铁站点详情（电梯位置、卫生间位置、出口位置） API =======
 
@@ -0,0 +1,333 @@
+import hashlib
+import heapq
+import logging
+from itertools import count
+
+logger = logging.getLogger(__name__)
+
+# 换乘耗时（分钟）
+TRANSFER_TIME = 5
+
+DIJKSTRA_QUERY = """
+    SELECT
+        from_station_travel_group,
+        to_station_travel_group,
+        travel_time,
+        line_id,
+        from_station_cn,
+        to_station_cn,
+        from_station_en,
+        to_station_en
+    FROM Dijkstra
+    WHERE from_station_cn IS NOT NULL
+      AND to_station_cn IS NOT NULL
+"""
+
+UNKNOWN_STATION = {'cn': '未知', 'en': 'Unknown'}
+
+
+class StationGraph:
+    """
+    地铁换乘图
+
+    graph 以 travel_group 为节点，邻接表中保存 (相邻节点, 行驶时间, 线路)，
+    同一对站点之间不同线路的并行区段（如 3/4 号线共线段）会分别保留。
+    """
+
+    def __init__(self):
+        self.graph = {}
+        self.name_to_groups = {}
+        self.station_info = {}
+        self.connections = {}  # 存储站点间的连接信息
+        self.all_pairs = None  # 可选的全源最短路表，见 all_pairs.py
+        self.contraction = None  # 可选的收缩层次，见 contraction.py
+        self.version = None  # 快照版本，由 GraphStore 在构建完成后设置
+        self.name_index = None  # 可选的模糊站名检索，见 station_names.py
+        self.coordinates = None  # 可选的站点坐标，A* 启发函数使用，见 goal_directed.py
+        self.accessibility = None  # 可选的无障碍站台位图，mode=accessible 使用，见 accessibility.py
+
+    def __getstate__(self):
+        # 传给子进程时不携带内存映射的全源最短路表 / 收缩层次
+        state = self.__dict__.copy()
+        state['all_pairs'] = None
+        state['contraction'] = None
+        return state
+
+    def _add_mapping(self, name_cn, name_en, group):
+        name_cn = str(name_cn).strip() if name_cn else ''
+        name_en = str(name_en).strip() if name_en else ''
+
+        if name_cn:
+            self.name_to_groups[name_cn.lower()] = group
+        if name_en:
+            self.name_to_groups[name_en.lower()] = group
+
+        self.station_info[group] = {
+            'cn': name_cn or f'UNKNOWN_CN_{group}',
+            'en': name_en or f'UNKNOWN_EN_{group}'
+        }
+
+    def add_row(self, row):
+        """添加 Dijkstra 表中的一行（双向）"""
+        from_node = row['from_station_travel_group']
+        to_node = row['to_station_travel_group']
+        line_id = row['line_id']
+        time = row['travel_time']
+
+        # 构建图结构：Dijkstra 表中每个区段只有一个方向的记录（同方向各重复一行），
+        # 反向边由本行推出，重复的边只保留一条
+        edges = self.graph.setdefault(from_node, [])
+        if (to_node, time, line_id) not in edges:
+            edges.append((to_node, time, line_id))
+        edges = self.graph.setdefault(to_node, [])
+        if (from_node, time, line_id) not in edges:
+            edges.append((from_node, time, line_id))
+
+        # 存储连接信息
+        self.connections[(from_node, to_node)] = {
+            'line_id': line_id,
+            'time': time
+        }
+        self.connections[(to_node, from_node)] = {
+            'line_id': line_id,
+            'time': time
+        }
+
+        # 添加名称映射
+        self._add_mapping(row['from_station_cn'], row['from_station_en'], from_node)
+        self._add_mapping(row['to_station_cn'], row['to_station_en'], to_node)
+
+    def load_rows(self, rows):
+        for row in rows:
+            self.add_row(row)
+        return self
+
+    def build_graph(self, get_connection):
+        conn = None
+        cursor = None
+        try:
+            conn = get_connection()
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute(DIJKSTRA_QUERY)
+            self.load_rows(cursor)
+        except Exception as e:
+            logger.error(f"构建图结构时出错: {str(e)}", exc_info=True)
+            raise
+        finally:
+            if cursor:
+                cursor.close()
+            if conn:
+                conn.close()
+
+    def compute_version(self):
+        """由边集和站名计算的版本号，内容不变则版本不变，可作为缓存键"""
+        digest = hashlib.sha1(f'transfer={TRANSFER_TIME}'.encode())
+        for node in sorted(self.graph):
+            for neighbor, time, line_id in sorted(self.graph[node]):
+                digest.update(f'{node},{neighbor},{time},{line_id};'.encode())
+        for group in sorted(self.station_info):
+            info = self.station_info[group]
+            digest.update(f"{group},{info['cn']},{info['en']};".encode())
+        for name in sorted(self.name_to_groups):
+            digest.update(f'{name}={self.name_to_groups[name]};'.encode())
+        return digest.hexdigest()[:12]
+
+    def find_travel_group(self, station_name):
+        if not station_name:
+            return None
+        group = self.name_to_groups.get(station_name.lower().strip())
+        if group is None and self.name_index is not None:
+            # 容忍错别字、缺少"站"字、拼音输入
+            group = self.name_index.resolve(station_name)
+        return group
+
+    def _search(self, start_group, end_group=None, penalties=None, max_time=None, step_free=None):
+        """
+        以 (travel_group, line_id) 为状态的 Dijkstra，换乘代价计入边权。
+        给定 end_group 时首次弹出终点即停止，返回 (dist, parent, 终点状态)。
+        penalties 为 {(from, to, line_id): 附加代价}（如拥挤度），只影响选路，parent 中仍记录实际行驶时间。
+        给定 max_time 时弹出的代价超过 max_time 即停止，dist 中不超过 max_time 的值都是精确的。
+        step_free 为 AccessibilityIndex（见 accessibility.py）时只允许在无台阶可达的站台之间换乘。
+        """
+        start = (start_group, None)
+        dist = {start: 0}
+        parent = {start: None}
+        tie = count()
+        # Heap (总时间, 序号, 当前节点, 当前线路)
+        heap = [(0, next(tie), start_group, None)]
+
+        while heap:
+            total_time, _, current, current_line = heapq.heappop(heap)
+            if max_time is not None and total_time > max_time:
+                break
+            state = (current, current_line)
+            if total_time > dist[state]:
+                continue
+
+            if current == end_group:
+                return dist, parent, state
+
+            for neighbor, time, line_id in self.graph[current]:
+                new_total_time = total_time + time
+                # 检查是否换乘（线路变更且不是初始状态）
+                if current_line is not None and line_id != current_line:
+                    if step_free is not None and not step_free.can_transfer(current, current_line, line_id):
+                        continue
+                    new_total_time += TRANSFER_TIME
+                if penalties:
+                    new_total_time += penalties.get((current, neighbor, line_id), 0)
+
+                next_state = (neighbor, line_id)
+                if new_total_time < dist.get(next_state, float('inf')):
+                    dist[next_state] = new_total_time
+                    parent[next_state] = (state, time)
+                    heapq.heappush(heap, (new_total_time, next(tie), neighbor, line_id))
+
+        return dist, parent, None
+
+    def shortest_path_tree(self, start_group, penalties=None, step_free=None):
+        """单源最短路树：返回覆盖全图的 (dist, parent)，键为 (travel_group, line_id) 状态"""
+        dist, parent, _ = self._search(start_group, penalties=penalties, step_free=step_free)
+        return dist, parent
+
+    def reachable_within(self, start_group, max_time):
+        """有界单源搜索：返回 {travel_group: 最短时间}，只含 max_time 分钟内可达的站点（含起点）"""
+        if start_group not in self.graph:
+            return {}
+        dist, _, _ = self._search(start_group, max_time=max_time)
+        reachable = {}
+        for (node, _), total_time in dist.items():
+            if total_time <= max_time and total_time < reachable.get(node, float('inf')):
+                reachable[node] = total_time
+        return reachable
+
+    def dijkstra_shortest_path(self, start_group, end_group, penalties=None, step_free=None):
+        """结果对换乘惩罚模型是精确最优的，路径通过父指针回溯"""
+        try:
+            if not start_group or not end_group:
+                return None
+            if start_group not in self.graph or end_group not in self.graph:
+                return None
+
+            dist, parent, state = self._search(start_group, end_group, penalties, step_free=step_free)
+            if state is None:
+                return None
+            return self.trace(parent, state, dist[state], penalties)
+        except Exception as e:
+            logger.error(f"Dijkstra算法执行出错: {str(e)}", exc_info=True)
+            return None
+
+    def routes_from(self, start_group, end_groups, penalties=None, step_free=None):
+        """单源搜索一次，回溯出到多个终点的路线，返回 {终点: 结果}，不可达的终点不出现"""
+        if start_group not in self.graph:
+            return {}
+        dist, parent = self.shortest_path_tree(start_group, penalties, step_free)
+
+        best = {}
+        for state, total_time in dist.items():
+            node = state[0]
+            if node in end_groups and (node not in best or total_time < dist[best[node]]):
+                best[node] = state
+
+        return {
+            node: self.trace(parent, state, dist[state], penalties)
+            for node, state in best.items()
+        }
+
+    def route(self, start_group, end_group, penalties=None, step_free=None):
+        """路线查询入口：无附加代价与换乘限制时优先查全源最短路表、其次用收缩层次，否则实时搜索"""
+        if not penalties and step_free is None:
+            if self.all_pairs is not None:
+                return self.all_pairs.route(start_group, end_group)
+            if self.contraction is not None:
+                return self.contraction.route(start_group, end_group)
+        return self.dijkstra_shortest_path(start_group, end_group, penalties, step_free)
+
+    @staticmethod
+    def travel_time(lines, times):
+        """按线路序列与区段时间计算实际耗时（含换乘）"""
+        total_time = sum(times)
+        for i in range(1, len(lines)):
+            if lines[i] != lines[i - 1]:
+                total_time += TRANSFER_TIME
+        return total_time
+
+    @staticmethod
+    def trace(parent, state, total_time, penalties=None):
+        """
+        沿父指针回溯出 path / lines / times
+        带附加代价搜索时 total_time 为含代价的总代价，记入 cost，total_time 改为实际耗时
+        """
+        path, lines, times = [], [], []
+        while parent[state] is not None:
+            prev_state, time = parent[state]
+            path.append(state[0])
+            lines.append(state[1])
+            times.append(time)
+            state = prev_state
+        path.append(state[0])
+        path.reverse()
+        lines.reverse()
+        times.reverse()
+        result = {
+            'path': path,
+            'lines': lines,
+            'times': times,
+            'total_time': total_time
+        }
+        if penalties:
+            result['cost'] = total_time
+            result['total_time'] = StationGraph.travel_time(lines, times)
+        return result
+
+    def format_path(self, result):
+        """将搜索结果转换为接口返回的分段路径（含换乘段）"""
+        formatted_path = []
+        cumulative_time = 0
+        previous_line = None
+
+        for i, line_id in enumerate(result['lines']):
+            current = result['path'][i]
+            next_node = result['path'][i + 1]
+            segment_time = result['times'][i]
+
+            # 检查是否换乘
+            if previous_line is not None and line_id != previous_line:
+                # 添加换乘时间
+                cumulative_time += TRANSFER_TIME
+                formatted_path.append({
+                    'transfer': True,
+                    'transfer_time': TRANSFER_TIME,
+                    'cumulative_time': cumulative_time,
+                    'message': f"换乘到{line_id}号线",
+                    'from_line': previous_line,
+                    'to_line': line_id
+                })
+
+            cumulative_time += segment_time
+            previous_line = line_id
+
+            formatted_path.append({
+                'from_station': self.station_info.get(current, UNKNOWN_STATION),
+                'to_station': self.station_info.get(next_node, UNKNOWN_STATION),
+                'line_id': line_id,
+                'segment_time': segment_time,
+                'cumulative_time': cumulative_time,
+                'transfer': False
+            })
+
+        return formatted_path
+
+    def format_route(self, result, start_group, end_group):
+        """/smartmetro/dijkstra 响应中的 data 部分"""
+        formatted_path = self.format_path(result)
+        data = {
+            'path': formatted_path,
+            'total_time': result['total_time'],
+            'from_station': self.station_info.get(start_group, UNKNOWN_STATION),
+            'to_station': self.station_info.get(end_group, UNKNOWN_STATION),
+            'transfer_count': len([p for p in formatted_path if p.get('transfer')])
+        }
+        if 'cost' in result:
+            data['cost'] = result['cost']
+        return data
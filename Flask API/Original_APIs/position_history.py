@@ -0,0 +1,279 @@
+import logging
+import threading
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 汇总最近多少天的区段运行时间供 ETA 使用
+DEFAULT_LEARNED_DAYS = 7
+# 某区段某小时的样本数达到该值才采用学习到的时间，否则用 station_travel_time
+DEFAULT_MIN_SAMPLES = 5
+# 位置历史保留天数，更早的分区整体删除
+DEFAULT_RETENTION_DAYS = 90
+# 后台任务检查分区与前一天汇总的间隔（秒）
+DEFAULT_ROLLUP_SECONDS = 3600
+# 提前建好的日分区数
+PARTITION_DAYS_AHEAD = 3
+# 超过该时长（秒）的区段样本视为中途停运或上报中断，丢弃
+MAX_SEGMENT_SECONDS = 30 * 60
+# 读取历史与写入汇总的批大小
+ROLLUP_BATCH_SIZE = 100000
+SEGMENT_WRITE_BATCH_SIZE = 500
+
+# 表结构见 Database/train_position_history.sql，按 TO_DAYS(timestamp) 每天一个分区
+HISTORY_INSERT = """
+    INSERT INTO train_position_history
+    (train_number, station_id, next_station_id, timestamp, path_id)
+    VALUES (%s, %s, %s, %s, %s)
+"""
+
+# 只读取一天的分区，排序在内存中做
+HISTORY_DAY_QUERY = """
+    SELECT train_number, path_id, station_id, next_station_id, UNIX_TIMESTAMP(timestamp), HOUR(timestamp)
+    FROM train_position_history
+    WHERE timestamp >= %s AND timestamp < %s
+"""
+
+PARTITIONS_QUERY = """
+    SELECT PARTITION_NAME
+    FROM information_schema.PARTITIONS
+    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'train_position_history' AND PARTITION_NAME IS NOT NULL
+"""
+
+ROLLED_UP_DAYS_QUERY = "SELECT DISTINCT service_date FROM segment_run_time WHERE service_date >= %s"
+
+SEGMENT_RUN_TIME_DELETE = "DELETE FROM segment_run_time WHERE service_date = %s"
+
+SEGMENT_RUN_TIME_INSERT = """
+    INSERT INTO segment_run_time
+    (service_date, from_station_id, to_station_id, hour, median_seconds, samples)
+    VALUES (%s, %s, %s, %s, %s, %s)
+"""
+
+
+def _partition_name(day):
+    return day.strftime('p%Y%m%d')
+
+
+def segment_medians(train_numbers, path_ids, station_ids, next_station_ids, timestamps, hours):
+    """
+    由一批位置上报求各区段、各小时的运行时间中位数，全部为数组运算
+
+    同一列车按时间排序后，station_id 连续相同的上报为在该站的一段；相邻两段 A、B
+    （同一 path、同一线路，且 A 段的 next_station_id 为 B）之间的样本为 B 段首条与 A 段首条的时间差，
+    即上一站到站到下一站到站的时间（含停站），小时取 A 段首条的小时。
+    列车当天第一段的开始时间不是真正的到站时间，不作为样本。
+    返回 (from_station_id, to_station_id, hour, 中位数秒, 样本数) 五个数组。
+    """
+    _, trains = np.unique(np.asarray(train_numbers), return_inverse=True)
+    path_ids = np.asarray(path_ids, dtype=np.int64)
+    station_ids = np.asarray(station_ids, dtype=np.int64)
+    next_station_ids = np.asarray(next_station_ids, dtype=np.int64)
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    hours = np.asarray(hours, dtype=np.int64)
+
+    order = np.lexsort((timestamps, trains))
+    trains, path_ids, station_ids = trains[order], path_ids[order], station_ids[order]
+    next_station_ids, timestamps, hours = next_station_ids[order], timestamps[order], hours[order]
+
+    changed = np.ones(len(order), dtype=bool)
+    changed[1:] = (trains[1:] != trains[:-1]) | (station_ids[1:] != station_ids[:-1]) | (path_ids[1:] != path_ids[:-1])
+    starts = np.flatnonzero(changed)
+
+    a, b = starts[:-1], starts[1:]
+    seconds = timestamps[b] - timestamps[a]
+    keep = (
+        (trains[a] == trains[b]) & (path_ids[a] == path_ids[b])
+        & (next_station_ids[a] == station_ids[b]) & (station_ids[a] // 100 == station_ids[b] // 100)
+        & (seconds > 0) & (seconds <= MAX_SEGMENT_SECONDS)
+    )
+    # A 段之前须有同一列车的一段，否则 A 段首条不是到站时间
+    keep[:1] = False
+    keep[1:] &= trains[starts[:-2]] == trains[a[1:]]
+    a, b, seconds = a[keep], b[keep], seconds[keep]
+
+    from_ids, to_ids, sample_hours = station_ids[a], station_ids[b], hours[a]
+    order = np.lexsort((seconds, sample_hours, to_ids, from_ids))
+    from_ids, to_ids, sample_hours, seconds = from_ids[order], to_ids[order], sample_hours[order], seconds[order]
+
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = (from_ids[1:] != from_ids[:-1]) | (to_ids[1:] != to_ids[:-1]) | (sample_hours[1:] != sample_hours[:-1])
+    lo = np.flatnonzero(first)
+    counts = np.diff(np.r_[lo, len(order)])
+    medians = (seconds[lo + (counts - 1) // 2] + seconds[lo + counts // 2]) / 2
+    return from_ids[lo], to_ids[lo], sample_hours[lo], medians, counts
+
+
+class PositionHistory:
+    """
+    列车位置历史（train_position_history，只追加、按天分区）与区段运行时间汇总（segment_run_time）
+
+    上报由 LiveTrainStore 在写回时追加到历史表；后台任务每隔 rollup_seconds 维护日分区
+    （提前建好未来几天、删除超过保留期的），并汇总最近 learned_days 天中尚未汇总的完整日期：
+    读取一天的分区后用 segment_medians 一次求出各区段各小时的中位数，整天替换写入 segment_run_time。
+    TravelTimeIndex 比较汇总表的最新日期与行数，发现变化后重建。
+    """
+
+    def __init__(self, get_connection, learned_days=DEFAULT_LEARNED_DAYS,
+                 retention_days=DEFAULT_RETENTION_DAYS, rollup_seconds=DEFAULT_ROLLUP_SECONDS):
+        self._get_connection = get_connection
+        self.learned_days = learned_days
+        self.retention_days = retention_days
+        self.rollup_seconds = rollup_seconds
+        self._lock = threading.Lock()  # 同一时间只运行一次汇总
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_rollup = None
+        self.last_error = None
+
+    def _execute(self, callback):
+        conn = None
+        cursor = None
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            result = callback(cursor)
+            conn.commit()
+            return result
+        finally:
+            if cursor:
+                cursor.close()
+            if conn:
+                conn.close()
+
+    def ensure_partitions(self, today=None):
+        """建好今天起 PARTITION_DAYS_AHEAD 天的日分区，删除保留期之前的分区，返回 (新建数, 删除数)"""
+        today = today or date.today()
+
+        def run(cursor):
+            cursor.execute(PARTITIONS_QUERY)
+            names = {row[0] for row in cursor.fetchall()}
+            days = sorted(datetime.strptime(name, 'p%Y%m%d').date() for name in names if name != 'pmax')
+            latest = days[-1] if days else today - timedelta(days=1)
+
+            created = []
+            day = max(latest + timedelta(days=1), today)
+            while day <= today + timedelta(days=PARTITION_DAYS_AHEAD):
+                created.append(day)
+                day += timedelta(days=1)
+            if created:
+                partitions = ', '.join(
+                    f"PARTITION {_partition_name(day)} VALUES LESS THAN (TO_DAYS('{day + timedelta(days=1)}'))"
+                    for day in created
+                )
+                cursor.execute(
+                    "ALTER TABLE train_position_history REORGANIZE PARTITION pmax INTO "
+                    f"({partitions}, PARTITION pmax VALUES LESS THAN MAXVALUE)"
+                )
+
+            expired = [day for day in days if day < today - timedelta(days=self.retention_days)]
+            if expired:
+                cursor.execute(
+                    "ALTER TABLE train_position_history DROP PARTITION "
+                    + ', '.join(_partition_name(day) for day in expired)
+                )
+            return len(created), len(expired)
+
+        return self._execute(run)
+
+    def load_day(self, day):
+        """读取一天的位置历史，返回 segment_medians 所需的六个数组"""
+        columns = [[] for _ in range(6)]
+        conn = None
+        cursor = None
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            cursor.execute(HISTORY_DAY_QUERY, (day, day + timedelta(days=1)))
+            while True:
+                rows = cursor.fetchmany(ROLLUP_BATCH_SIZE)
+                if not rows:
+                    break
+                for column, values in zip(columns, zip(*rows)):
+                    column.append(np.array(values))
+        finally:
+            if cursor:
+                cursor.close()
+            if conn:
+                conn.close()
+        return [np.concatenate(column) if column else np.array([]) for column in columns]
+
+    def rollup_day(self, day):
+        """汇总一天的区段运行时间并整天替换写入 segment_run_time，返回 (上报数, 区段小时数)"""
+        started = datetime.now()
+        columns = self.load_day(day)
+        from_ids, to_ids, hours, medians, counts = segment_medians(*columns)
+        rows = [
+            (day, int(f), int(t), int(h), float(m), int(c))
+            for f, t, h, m, c in zip(from_ids, to_ids, hours, medians, counts)
+        ]
+
+        def run(cursor):
+            cursor.execute(SEGMENT_RUN_TIME_DELETE, (day,))
+            for begin in range(0, len(rows), SEGMENT_WRITE_BATCH_SIZE):
+                cursor.executemany(SEGMENT_RUN_TIME_INSERT, rows[begin:begin + SEGMENT_WRITE_BATCH_SIZE])
+
+        self._execute(run)
+        logger.info(
+            f"{day} 区段运行时间已汇总: {len(columns[0])} 条上报, {len(rows)} 个区段小时, "
+            f"耗时 {(datetime.now() - started).total_seconds():.1f} 秒"
+        )
+        return len(columns[0]), len(rows)
+
+    def pending_days(self, today=None):
+        """最近 learned_days 天中尚未汇总的完整日期"""
+        today = today or date.today()
+        first = today - timedelta(days=self.learned_days)
+
+        def run(cursor):
+            cursor.execute(ROLLED_UP_DAYS_QUERY, (first,))
+            return {row[0] for row in cursor.fetchall()}
+
+        done = self._execute(run)
+        days = [first + timedelta(days=i) for i in range(self.learned_days)]
+        return [day for day in days if day not in done]
+
+    def run_once(self, today=None):
+        """维护分区并汇总尚未汇总的日期，返回汇总的日期"""
+        with self._lock:
+            self.ensure_partitions(today)
+            days = self.pending_days(today)
+            for day in days:
+                self.rollup_day(day)
+            self.last_rollup = datetime.now()
+            return days
+
+    def start(self):
+        """启动后台维护线程"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='position-history-rollup', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while True:
+            try:
+                self.run_once()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                logger.error(f"位置历史分区维护或区段运行时间汇总失败: {str(e)}", exc_info=True)
+            if self._stop.wait(self.rollup_seconds):
+                break
+
+    def status(self):
+        return {
+            'learned_days': self.learned_days,
+            'retention_days': self.retention_days,
+            'last_rollup': self.last_rollup.isoformat() if self.last_rollup else None,
+            'last_error': self.last_error
+        }
@@ -0,0 +1,75 @@
+import os
+import re
+
+# 仓库中的 MySQL 导出文件
+DEFAULT_DUMP = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Database', 'new_schema.sql')
+
+
+def _parse_value(token):
+    if token == 'NULL':
+        return None
+    try:
+        return int(token)
+    except ValueError:
+        return float(token)
+
+
+def _parse_rows(values):
+    """解析 INSERT ... VALUES 后面的 (...),(...) 部分"""
+    rows = []
+    i, n = 0, len(values)
+    while i < n:
+        if values[i] != '(':
+            i += 1
+            continue
+        i += 1
+        row = []
+        while True:
+            if values[i] == "'":
+                i += 1
+                chars = []
+                while values[i] != "'":
+                    if values[i] == '\\':
+                        i += 1
+                        chars.append({'n': '\n', 'r': '\r', 't': '\t', '0': '\0'}.get(values[i], values[i]))
+                    else:
+                        chars.append(values[i])
+                    i += 1
+                row.append(''.join(chars))
+                i += 1
+            else:
+                j = i
+                while values[j] not in ',)':
+                    j += 1
+                row.append(_parse_value(values[i:j].strip()))
+                i = j
+            if values[i] == ',':
+                i += 1
+                continue
+            i += 1  # ')'
+            break
+        rows.append(row)
+    return rows
+
+
+def load_table(table, path=DEFAULT_DUMP):
+    """
+    从 mysqldump 导出文件中读取某张表的全部数据，返回与 cursor(dictionary=True) 相同的字典列表
+    用于离线基准测试等无需连接数据库的场景
+    """
+    with open(path, encoding='utf-8') as f:
+        text = f.read()
+
+    match = re.search(r"CREATE TABLE `%s` \((.*?)\n\) ENGINE" % re.escape(table), text, re.S)
+    if not match:
+        raise ValueError(f"导出文件中没有表 {table}")
+    columns = [
+        line.strip().split('`')[1]
+        for line in match.group(1).split('\n')
+        if line.strip().startswith('`')
+    ]
+
+    rows = []
+    for match in re.finditer(r"^INSERT INTO `%s` VALUES (.*);$" % re.escape(table), text, re.M):
+        rows.extend(dict(zip(columns, row)) for row in _parse_rows(match.group(1)))
+    return rows
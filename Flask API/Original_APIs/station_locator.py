@@ -0,0 +1,370 @@
+import logging
+import math
+import threading
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_KM = 6371
+# 网格边长（千米）
+DEFAULT_CELL_KM = 2.0
+# 检查 station_map 是否变化的最小间隔（秒）
+DEFAULT_MAP_REFRESH_SECONDS = 60
+# 等距圆柱投影在上海范围内（纬度 ±1°）的距离误差不到 2%，网格剪枝时按 95% 折算，保证结果与全表扫描一致
+PROJECTION_MARGIN = 0.95
+# 逐圈向外最多查找的圈数，仍未确定时（远离站点的位置）改为对全部站点一次数组运算
+MAX_RINGS = 3
+# 批量查找预先计算候选站点的范围：站点外接矩形向外扩展的距离（千米），范围外的点与全部站点比较
+COVER_MARGIN_KM = 20.0
+# 批量查找候选表的格子边长（千米），比 cell_km 细，多数格子只有一两个候选站点
+BATCH_CELL_KM = 0.5
+# 构建候选表时每块的边长（格子数），块内格子数 × 附近站点数决定临时数组大小
+TABLE_TILE_CELLS = 32
+# 范围外的点与全部站点比较时每批的点数（点数 × 站点数决定临时数组大小）
+FALLBACK_ROWS = 4096
+
+STATION_MAP_QUERY = """
+    SELECT stat_id, name_cn, name_en, latitude, longitude,
+           travel_group, line, all_stations, associated_lines
+    FROM station_map
+    WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+"""
+
+STATION_MAP_CHECKSUM_QUERY = "CHECKSUM TABLE station_map"
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    """球面距离（千米），参数为角度，可传数组"""
+    lat1, lng1, lat2, lng2 = (np.radians(np.asarray(v, dtype=np.float64)) for v in (lat1, lng1, lat2, lng2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return EARTH_RADIUS_KM * 2 * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def _within_bound(xs, ys, x0, y0, x1, y1):
+    """
+    平面上的站点 (xs, ys) 中，哪些可能是矩形 [x0, x1] × [y0, y1] 内某点的最近站点：
+    到矩形的最近距离不超过各站点到矩形最远距离的最小值，按 PROJECTION_MARGIN 放宽；比较距离平方，省去开方
+    """
+    dx = np.maximum(np.maximum(x0 - xs, xs - x1), 0)
+    dy = np.maximum(np.maximum(y0 - ys, ys - y1), 0)
+    closest = dx * dx + dy * dy
+    dx = np.maximum(np.abs(xs - x0), np.abs(xs - x1))
+    dy = np.maximum(np.abs(ys - y0), np.abs(ys - y1))
+    farthest = (dx * dx + dy * dy).min(axis=-1, keepdims=True)
+    return closest * PROJECTION_MARGIN ** 4 <= farthest
+
+
+def parse_station(row):
+    """station_map 的一行转为 nearest_stations 响应中的站点（不含距离），与原逐行处理相同"""
+    all_stations = [
+        s.strip('"\' ') for s in (row['all_stations'] or '').split(',') if s.strip()
+    ]
+    associated_lines = [
+        int(line.strip()) for line in (row['associated_lines'] or '').split(',')
+        if line.strip().isdigit()
+    ]
+    return {
+        "stat_id": row['stat_id'],
+        "name_cn": row['name_cn'],
+        "name_en": row['name_en'],
+        "travel_group": str(row['travel_group']).strip(),
+        "line_info": {
+            "line": row['line'],
+            "all_stations": all_stations
+        },
+        "associated_lines": associated_lines
+    }
+
+
+class _StationGrid:
+    """
+    一次加载得到的站点坐标与网格，每个 travel_group 一个点（取 station_map 中该组的第一行）
+
+    - stations[i]           预先解析好的站点（不含距离）
+    - lats[i] / lngs[i]     坐标（角度）
+    - cells[(ix, iy)]       落在该格子中的站点下标数组
+    - candidates            批量查找（nearest_many）用的候选表，见 _candidate_table
+    """
+
+    def __init__(self, stations, lats, lngs, cell_km):
+        self.stations = stations
+        self.lats = np.asarray(lats, dtype=np.float64)
+        self.lngs = np.asarray(lngs, dtype=np.float64)
+        self.cell_km = cell_km
+        self.lat0 = float(self.lats.mean()) if len(self.lats) else 31.2
+        xs, ys = self.project(self.lats, self.lngs)
+        self.x_min = float(xs.min()) if len(xs) else 0.0
+        self.y_min = float(ys.min()) if len(ys) else 0.0
+        ix, iy = self._cell(xs, ys)
+        self.cells = {}
+        for i, key in enumerate(zip(ix.tolist(), iy.tolist())):
+            self.cells.setdefault(key, []).append(i)
+        self.cells = {key: np.array(indexes, dtype=np.int64) for key, indexes in self.cells.items()}
+        self._rad_lats, self._rad_lngs = np.radians(self.lats), np.radians(self.lngs)
+        self._cos_lats = np.cos(self._rad_lats)
+        self.candidates = self._candidate_table() if len(self.stations) else None
+
+    def __len__(self):
+        return len(self.stations)
+
+    def project(self, lats, lngs):
+        """以平均纬度为基准的等距圆柱投影（千米）"""
+        scale = math.radians(1) * EARTH_RADIUS_KM
+        return np.asarray(lngs) * scale * math.cos(math.radians(self.lat0)), np.asarray(lats) * scale
+
+    def _cell(self, xs, ys):
+        return (
+            np.floor((xs - self.x_min) / self.cell_km).astype(np.int64),
+            np.floor((ys - self.y_min) / self.cell_km).astype(np.int64)
+        )
+
+    def _ring(self, cx, cy, r):
+        if r == 0:
+            yield cx, cy
+            return
+        for dx in range(-r, r + 1):
+            yield cx + dx, cy - r
+            yield cx + dx, cy + r
+        for dy in range(-r + 1, r):
+            yield cx - r, cy + dy
+            yield cx + r, cy + dy
+
+    def nearest(self, lat, lng, k):
+        """
+        距 (lat, lng) 最近的 k 个站点，返回 [(站点下标, 距离千米), ...]
+
+        从所在格子起逐圈向外取站点并计算球面距离，已有 k 个候选且第 k 近的距离不超过
+        未访问格子的最近可能距离时停止；MAX_RINGS 圈内不能确定时计算到全部站点的距离
+        """
+        k = min(k, len(self))
+        if k <= 0:
+            return []
+        x, y = self.project(lat, lng)
+        gx, gy = (x - self.x_min) / self.cell_km, (y - self.y_min) / self.cell_km
+        cx, cy = math.floor(gx), math.floor(gy)
+
+        found = []
+        distances = np.array([], dtype=np.float64)
+        for r in range(MAX_RINGS + 1):
+            ring = [self.cells[key] for key in self._ring(cx, cy, r) if key in self.cells]
+            if ring:
+                indexes = np.concatenate(ring)
+                found.append(indexes)
+                distances = np.concatenate([distances, haversine_km(lat, lng, self.lats[indexes], self.lngs[indexes])])
+            if len(distances) >= k:
+                # 第 r 圈之外的格子到查询点的最近距离
+                outside = min(gx - (cx - r), cx + r + 1 - gx, gy - (cy - r), cy + r + 1 - gy) * self.cell_km
+                if np.partition(distances, k - 1)[k - 1] <= outside * PROJECTION_MARGIN:
+                    indexes = np.concatenate(found)
+                    break
+        else:
+            indexes = np.arange(len(self))
+            distances = haversine_km(lat, lng, self.lats, self.lngs)
+
+        order = np.argsort(distances, kind='stable')[:k]
+        return list(zip(indexes[order].tolist(), distances[order].tolist()))
+
+    def _candidate_table(self):
+        """
+        批量查找用的候选表，构建网格时计算，返回 (起始格 ix, 起始格 iy, x 方向格数, y 方向格数, 候选数, 表)
+
+        覆盖范围按 BATCH_CELL_KM 划分格子，表的每一行列出格子中任意一点的最近站点的全部可能取值
+        （按站点下标排序，不足列数的以第一个候选补齐）：站点到格子的最近距离不超过各站点到格子
+        最远距离的最小值即为候选，两侧都按 PROJECTION_MARGIN 放宽。
+        按 TABLE_TILE_CELLS × TABLE_TILE_CELLS 个格子一块计算，临时数组与覆盖面积无关
+        """
+        xs, ys = self.project(self.lats, self.lngs)
+        xs, ys = xs - self.x_min, ys - self.y_min
+        margin = int(math.ceil(COVER_MARGIN_KM / BATCH_CELL_KM))
+        nx = int(math.floor(xs.max() / BATCH_CELL_KM)) + 1 + 2 * margin
+        ny = int(math.floor(ys.max() / BATCH_CELL_KM)) + 1 + 2 * margin
+
+        counts = np.zeros(nx * ny, dtype=np.int64)
+        blocks = []
+        for tx in range(0, nx, TABLE_TILE_CELLS):
+            for ty in range(0, ny, TABLE_TILE_CELLS):
+                ix, iy = np.meshgrid(np.arange(tx, min(tx + TABLE_TILE_CELLS, nx)),
+                                     np.arange(ty, min(ty + TABLE_TILE_CELLS, ny)), indexing='ij')
+                cells = (ix * ny + iy).ravel()
+                x0, y0 = (ix.ravel() - margin) * BATCH_CELL_KM, (iy.ravel() - margin) * BATCH_CELL_KM
+                # 块内任一格子的候选也是整块外接矩形的候选，先按外接矩形筛掉大部分站点
+                nearby = np.flatnonzero(_within_bound(xs, ys, x0.min(), y0.min(),
+                                                      x0.max() + BATCH_CELL_KM, y0.max() + BATCH_CELL_KM))
+                mask = _within_bound(xs[nearby], ys[nearby], x0[:, None], y0[:, None],
+                                     x0[:, None] + BATCH_CELL_KM, y0[:, None] + BATCH_CELL_KM)
+                block_counts = mask.sum(axis=1)
+                counts[cells] = block_counts
+                # 稳定排序使候选保持站点下标顺序，距离相同时与逐点查找取同一个站点
+                width = int(block_counts.max())
+                block = nearby[np.argsort(~mask, axis=1, kind='stable')[:, :width]].astype(np.int32)
+                blocks.append((cells, np.where(np.arange(width) < block_counts[:, None], block, block[:, :1])))
+
+        table = np.empty((nx * ny, int(counts.max())), dtype=np.int32)
+        for cells, block in blocks:
+            table[cells, :block.shape[1]] = block
+            table[cells, block.shape[1]:] = block[:, :1]
+        return -margin, -margin, nx, ny, counts, table
+
+    def nearest_many(self, lats, lngs):
+        """
+        一批点各自最近的站点，返回 (站点下标, 距离千米) 两个数组，全部为数组运算
+
+        覆盖范围内的点按所在格子的候选数分组（1, 2, 4, 8...），每组只与候选表的前若干列比较；
+        范围外的点每 FALLBACK_ROWS 个一批与全部站点比较。坐标为 NaN 或无穷的点站点下标为 -1、距离为 NaN。
+        临时数组与点数成正比，调用方按批传入
+        """
+        lats = np.asarray(lats, dtype=np.float64)
+        lngs = np.asarray(lngs, dtype=np.float64)
+        indexes = np.full(len(lats), -1, dtype=np.int64)
+        distances = np.full(len(lats), np.nan)
+        if not len(self) or not len(lats):
+            return indexes, distances
+
+        ix0, iy0, nx, ny, counts, table = self.candidates
+        xs, ys = self.project(lats, lngs)
+        valid = np.isfinite(xs) & np.isfinite(ys)
+        ix = np.floor((np.where(valid, xs, self.x_min) - self.x_min) / BATCH_CELL_KM).astype(np.int64) - ix0
+        iy = np.floor((np.where(valid, ys, self.y_min) - self.y_min) / BATCH_CELL_KM).astype(np.int64) - iy0
+        inside = valid & (ix >= 0) & (ix < nx) & (iy >= 0) & (iy < ny)
+        cells = np.where(inside, ix * ny + iy, 0)
+        point_counts = np.where(inside, counts[cells], 0)
+
+        lower, width = 0, 1
+        while lower < table.shape[1]:
+            width = min(width, table.shape[1])
+            rows = np.flatnonzero((point_counts > lower) & (point_counts <= width))
+            if len(rows):
+                self._nearest_of(rows, table[cells[rows], :width], lats, lngs, indexes, distances)
+            lower, width = width, width * 2
+
+        outside = np.flatnonzero(valid & ~inside)
+        for begin in range(0, len(outside), FALLBACK_ROWS):
+            rows = outside[begin:begin + FALLBACK_ROWS]
+            self._nearest_of(rows, None, lats, lngs, indexes, distances)
+        return indexes, distances
+
+    def _nearest_of(self, rows, candidates, lats, lngs, indexes, distances):
+        """rows 中的点与各自的候选站点（None 为全部站点）比较，结果写入 indexes / distances"""
+        lat = np.radians(lats[rows])[:, None]
+        lng = np.radians(lngs[rows])[:, None]
+        if candidates is None:
+            station_lats, station_lngs, station_cos = self._rad_lats, self._rad_lngs, self._cos_lats
+        else:
+            station_lats, station_lngs = self._rad_lats[candidates], self._rad_lngs[candidates]
+            station_cos = self._cos_lats[candidates]
+        # 与 haversine_km 相同的公式，距离随 a 单调，先取最小再开方
+        a = np.sin((station_lats - lat) / 2) ** 2 + np.cos(lat) * station_cos * np.sin((station_lngs - lng) / 2) ** 2
+        best = np.argmin(a, axis=1)
+        picked = a[np.arange(len(rows)), best]
+        indexes[rows] = best if candidates is None else candidates[np.arange(len(rows)), best]
+        distances[rows] = EARTH_RADIUS_KM * 2 * np.arcsin(np.sqrt(np.minimum(picked, 1.0)))
+
+
+class StationLocator:
+    """
+    station_map 的内存空间索引，替代每次请求全表查询并逐行计算距离的 nearest_stations
+
+    站点按 travel_group 去重后投影到平面网格，all_stations / associated_lines 在加载时解析一次，
+    查询不访问数据库。每隔 refresh_seconds 用 CHECKSUM TABLE 检查 station_map，有变化时整体重建；
+    查询只读取一次 grid 引用，重建过程中不会读到新旧混合的数据。
+    """
+
+    def __init__(self, get_connection, refresh_seconds=DEFAULT_MAP_REFRESH_SECONDS, cell_km=DEFAULT_CELL_KM):
+        self._get_connection = get_connection
+        self.refresh_seconds = refresh_seconds
+        self.cell_km = cell_km
+        self._lock = threading.Lock()
+        self.grid = self.build([], cell_km)
+        self.checksum = None
+        self.checked_at = None
+
+    def _query(self, sql):
+        conn = None
+        cursor = None
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute(sql)
+            return cursor.fetchall()
+        finally:
+            if cursor:
+                cursor.close()
+            if conn:
+                conn.close()
+
+    @staticmethod
+    def build(rows, cell_km=DEFAULT_CELL_KM):
+        """由 station_map 的行构建网格"""
+        stations, lats, lngs = [], [], []
+        seen_groups = set()
+        for row in rows:
+            try:
+                travel_group = str(row.get('travel_group', '')).strip()
+                if not travel_group or travel_group == 'None' or travel_group in seen_groups:
+                    continue
+                lat, lng = float(row['latitude']), float(row['longitude'])
+                station = parse_station(row)
+            except (KeyError, TypeError, ValueError) as e:
+                logger.error(f"站点坐标数据有误: {e}")
+                continue
+            seen_groups.add(travel_group)
+            stations.append(station)
+            lats.append(lat)
+            lngs.append(lng)
+        return _StationGrid(stations, lats, lngs, cell_km)
+
+    def load(self):
+        """重新加载 station_map 并替换索引"""
+        self._load(self._checksum())
+
+    def _load(self, checksum):
+        grid = self.build(self._query(STATION_MAP_QUERY), self.cell_km)
+        with self._lock:
+            self.grid = grid
+            self.checksum = checksum
+            self.checked_at = time.monotonic()
+        logger.info(f"站点空间索引已加载 {len(grid)} 个站点, {len(grid.cells)} 个网格")
+
+    def _checksum(self):
+        try:
+            return tuple(row['Checksum'] for row in self._query(STATION_MAP_CHECKSUM_QUERY))
+        except Exception as e:
+            # 无法计算校验和时每次检查都重新加载
+            logger.error(f"计算 station_map 校验和失败: {str(e)}", exc_info=True)
+            return None
+
+    def refresh(self):
+        """到达检查间隔时比较校验和，表有变化则重建；失败时沿用内存中的索引"""
+        if self.checked_at is not None and time.monotonic() - self.checked_at < self.refresh_seconds:
+            return
+        self.checked_at = time.monotonic()
+        try:
+            checksum = self._checksum()
+            if checksum is None or checksum != self.checksum:
+                self._load(checksum)
+        except Exception as e:
+            logger.error(f"刷新站点空间索引失败: {str(e)}", exc_info=True)
+
+    def current(self):
+        """按需刷新后返回当前快照"""
+        self.refresh()
+        return self.grid
+
+    def nearest(self, lat, lng, k=5):
+        """距 (lat, lng) 最近的 k 个站点（nearest_stations 响应中的格式，含 distance_m）"""
+        grid = self.current()
+        results = []
+        for i, distance_km in grid.nearest(lat, lng, k):
+            station = grid.stations[i]
+            results.append({
+                "stat_id": station['stat_id'],
+                "name_cn": station['name_cn'],
+                "name_en": station['name_en'],
+                "travel_group": station['travel_group'],
+                "distance_m": round(distance_km * 1000),
+                "line_info": station['line_info'],
+                "associated_lines": station['associated_lines']
+            })
+        return results
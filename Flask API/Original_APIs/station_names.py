@@ -0,0 +1,286 @@
+import logging
+import re
+import unicodedata
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+# stations.pinyin 为拼音首字母（如 莘庄 -> xz），全拼取自 name_en（多为拼音，如 Xinzhuang）
+STATION_NAMES_QUERY = """
+    SELECT s.name_cn, s.name_en, s.pinyin, s.line, m.travel_group
+    FROM stations s
+    JOIN station_map m ON m.stat_id = s.stat_id
+"""
+
+STATION_MAP_QUERY = """
+    SELECT name_cn, name_en, travel_group, associated_lines FROM station_map
+"""
+
+# 匹配类型及基础得分
+EXACT, STRIPPED, PREFIX, INITIALS, CONTAINS, FUZZY = 100, 95, 80, 70, 60, 50
+
+_PUNCTUATION = re.compile(r"[\s·・\-_'’.,()（）/]+")
+_SUFFIXES = ('地铁站', '站', 'metrostation', 'station', 'stn')
+
+
+def normalize(text):
+    """全角转半角、小写、去掉空格和标点"""
+    if not text:
+        return ''
+    return _PUNCTUATION.sub('', unicodedata.normalize('NFKC', str(text)).lower())
+
+
+def strip_suffix(key):
+    for suffix in _SUFFIXES:
+        if key.endswith(suffix) and len(key) > len(suffix):
+            return key[:-len(suffix)]
+    return key
+
+
+def _grams(key, pad=True):
+    """中文按单字 + 双字，拉丁字母按三字母切分；pad 时加首尾标记，用于区分词首词尾"""
+    if not key:
+        return set()
+    if key.isascii():
+        padded = f'#{key}#' if pad else key
+        return {padded[i:i + 3] for i in range(len(padded) - 2)} or {key}
+    return set(key) | {key[i:i + 2] for i in range(len(key) - 1)}
+
+
+def _edit_distance(a, b, limit):
+    """Levenshtein 距离，只计算宽度为 limit 的对角带，超过 limit 时返回 limit + 1"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    too_far = limit + 1
+    previous = [j if j <= limit else too_far for j in range(len(b) + 1)]
+    for i, ca in enumerate(a, 1):
+        low, high = max(1, i - limit), min(len(b), i + limit)
+        current = [too_far] * (len(b) + 1)
+        current[0] = i if i <= limit else too_far
+        best = current[0]
+        for j in range(low, high + 1):
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != b[j - 1]))
+            current[j] = value
+            if value < best:
+                best = value
+        if best > limit:
+            return too_far
+        previous = current
+    return min(previous[-1], too_far)
+
+
+class _TrieNode:
+    __slots__ = ('children', 'ids')
+
+    def __init__(self):
+        self.children = {}
+        self.ids = set()  # 经过该节点（即以该前缀开头）的站点
+
+
+class StationNameIndex:
+    """
+    站名检索：精确 / 去"站"后缀 / 前缀（字典树）/ 拼音首字母 / 包含 / 模糊（n-gram + 编辑距离）
+
+    每个 travel_group 为一个候选，中文名、英文名（拼音）、首字母均可检索。
+    """
+
+    def __init__(self):
+        self.entries = []        # [{'travel_group', 'cn', 'en', 'lines'}]
+        self._by_group = {}
+        self._keys = []          # 每个候选的 [(归一化名称, 是否为首字母), ...]
+        self._exact = {}         # 归一化名称 -> 候选下标
+        self._root = _TrieNode()
+        self._grams = defaultdict(set)
+
+    @classmethod
+    def load(cls, get_connection, station_graph=None):
+        conn = None
+        cursor = None
+        try:
+            conn = get_connection()
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute(STATION_NAMES_QUERY)
+            station_rows = cursor.fetchall()
+            cursor.execute(STATION_MAP_QUERY)
+            map_rows = cursor.fetchall()
+        finally:
+            if cursor:
+                cursor.close()
+            if conn:
+                conn.close()
+        return cls.from_rows(station_rows, map_rows, station_graph)
+
+    @classmethod
+    def from_rows(cls, station_rows, map_rows, station_graph=None):
+        index = cls()
+        for row in map_rows:
+            if row['travel_group'] in (None, ''):
+                continue
+            lines = [line.strip() for line in str(row.get('associated_lines') or '').split(',') if line.strip()]
+            index.add(int(row['travel_group']), row['name_cn'], row['name_en'], lines=lines)
+        for row in station_rows:
+            if row['travel_group'] in (None, ''):
+                continue
+            lines = [line.strip() for line in str(row.get('line') or '').split(',') if line.strip()]
+            index.add(int(row['travel_group']), row['name_cn'], row['name_en'], row.get('pinyin'), lines)
+        if station_graph is not None:
+            # Dijkstra 表中的站名（含 station_map 中没有的写法）
+            for name, group in station_graph.name_to_groups.items():
+                info = station_graph.station_info.get(group, {})
+                index.add(group, info.get('cn'), info.get('en'), aliases=[name])
+        return index
+
+    def add(self, group, name_cn, name_en, pinyin=None, lines=(), aliases=()):
+        entry_id = self._by_group.get(group)
+        if entry_id is None:
+            entry_id = len(self.entries)
+            self._by_group[group] = entry_id
+            self.entries.append({'travel_group': group, 'cn': name_cn, 'en': name_en, 'lines': []})
+            self._keys.append([])
+        entry = self.entries[entry_id]
+        entry['cn'] = entry['cn'] or name_cn
+        entry['en'] = entry['en'] or name_en
+        for line in lines:
+            if line not in entry['lines']:
+                entry['lines'].append(line)
+
+        keys = [(normalize(name), False) for name in (name_cn, name_en, *aliases)]
+        if pinyin:
+            keys.append((normalize(pinyin), True))
+        for key, initials in keys:
+            if not key or (key, initials) in self._keys[entry_id]:
+                continue
+            self._keys[entry_id].append((key, initials))
+            if not initials:
+                # 首字母重复较多，不参与精确解析
+                self._exact.setdefault(key, entry_id)
+                self._exact.setdefault(strip_suffix(key), entry_id)
+            node = self._root
+            for char in key:
+                node = node.children.setdefault(char, _TrieNode())
+                node.ids.add(entry_id)
+            for gram in _grams(key) | _grams(key, pad=False):
+                self._grams[gram].add(entry_id)
+
+    def _prefix_ids(self, key):
+        node = self._root
+        for char in key:
+            node = node.children.get(char)
+            if node is None:
+                return set()
+        return node.ids
+
+    def _score(self, entry_id, query):
+        """候选与查询的最佳匹配 (得分, 匹配类型)"""
+        best = (0, None)
+        for key, initials in self._keys[entry_id]:
+            if key == query:
+                score = (INITIALS + 10 if initials else EXACT, 'initials' if initials else 'exact')
+            elif strip_suffix(key) == query or key == strip_suffix(query):
+                score = (STRIPPED, 'exact')
+            elif key.startswith(query):
+                # 前缀越接近全名得分越高
+                score = ((INITIALS if initials else PREFIX) + 10 * len(query) / len(key),
+                         'initials' if initials else 'prefix')
+            elif not initials and query in key:
+                score = (CONTAINS + 10 * len(query) / len(key), 'contains')
+            else:
+                continue
+            best = max(best, score)
+        return best
+
+    def _fuzzy(self, query, exclude, limit):
+        """按共享 n-gram 取候选，再以编辑距离确认"""
+        query_grams = _grams(query)
+        if not query_grams:
+            return []
+        # "road"、"路" 等高频 n-gram 几乎不区分候选，跳过以控制计数开销
+        common = max(8, len(self.entries) // 8)
+        postings = [self._grams.get(gram, ()) for gram in query_grams]
+        rare = [ids for ids in postings if len(ids) <= common]
+        counts = defaultdict(int)
+        for ids in rare:
+            for entry_id in ids:
+                counts[entry_id] += 1
+        max_distance = 1 if len(query) <= 4 else 2
+        # 每处编辑至多影响 3 个 n-gram，共享数过少的候选不可能在距离内
+        min_shared = len(rare) - 3 * max_distance
+        results = []
+        for entry_id, shared in sorted(counts.items(), key=lambda item: -item[1])[:limit * 3]:
+            if entry_id in exclude or shared < min_shared:
+                continue
+            best = None
+            for key, initials in self._keys[entry_id]:
+                if initials:
+                    continue
+                distance = _edit_distance(query, key, max_distance)
+                stripped = strip_suffix(key)
+                if distance and stripped != key:
+                    distance = min(distance, _edit_distance(query, stripped, max_distance))
+                if distance <= max_distance and (best is None or distance < best):
+                    best = distance
+            if best is not None:
+                results.append((FUZZY - 10 * best, 'fuzzy', entry_id))
+        return results
+
+    def suggest(self, text, limit=10):
+        """返回按得分排序的候选 [{'travel_group', 'name_cn', 'name_en', 'lines', 'score', 'match'}]"""
+        query = strip_suffix(normalize(text)) if normalize(text) not in self._exact else normalize(text)
+        if not query:
+            return []
+
+        candidates = set(self._prefix_ids(query))
+        # 包含匹配：查询串出现在名称中间（如 "火车站"）
+        query_grams = _grams(query, pad=False)
+        if query_grams and len(candidates) < limit:
+            shared = None
+            for gram in query_grams:
+                ids = self._grams.get(gram, set())
+                shared = ids if shared is None else shared & ids
+                if not shared:
+                    break
+            candidates |= shared or set()
+
+        scored = []
+        for entry_id in candidates:
+            score, match = self._score(entry_id, query)
+            if match:
+                scored.append((score, match, entry_id))
+        # 前缀 / 包含均无结果时才做模糊检索（输入有误）
+        if not scored:
+            scored = self._fuzzy(query, set(), limit)
+
+        scored.sort(key=lambda item: (-item[0], len(self.entries[item[2]]['cn'] or ''), item[2]))
+        return [
+            {
+                'travel_group': self.entries[entry_id]['travel_group'],
+                'name_cn': self.entries[entry_id]['cn'],
+                'name_en': self.entries[entry_id]['en'],
+                'lines': self.entries[entry_id]['lines'],
+                'score': round(score, 1),
+                'match': match
+            }
+            for score, match, entry_id in scored[:limit]
+        ]
+
+    def resolve(self, text):
+        """
+        站名解析为 travel_group：精确匹配（含去"站"后缀）优先；
+        否则仅在结果无歧义时返回——唯一的前缀匹配，或唯一距离最小的模糊匹配
+        """
+        key = normalize(text)
+        if not key:
+            return None
+        entry_id = self._exact.get(key, self._exact.get(strip_suffix(key)))
+        if entry_id is not None:
+            return self.entries[entry_id]['travel_group']
+
+        candidates = self.suggest(text, limit=5)
+        prefixes = [c for c in candidates if c['match'] == 'prefix']
+        if prefixes:
+            return prefixes[0]['travel_group'] if len(prefixes) == 1 else None
+        # 模糊匹配只接受编辑距离为 1 的唯一候选
+        fuzzy = [c for c in candidates if c['match'] == 'fuzzy' and c['score'] >= FUZZY - 10]
+        if len(fuzzy) == 1:
+            return fuzzy[0]['travel_group']
+        return None
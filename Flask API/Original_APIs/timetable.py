@@ -0,0 +1,504 @@
+import json
+import logging
+import threading
+from bisect import bisect_left
+from collections import OrderedDict, defaultdict
+from datetime import datetime, time, timedelta
+
+import numpy as np
+
+from metro_graph import TRANSFER_TIME, UNKNOWN_STATION
+
+logger = logging.getLogger(__name__)
+
+# 发车间隔（分钟）：时刻表只提供首末班车，中间车次按固定间隔生成
+DEFAULT_HEADWAY = 5
+# 运营日从 04:00 开始，此前的时刻（末班车过零点）计入前一运营日
+SERVICE_DAY_START = 4 * 60
+# 同时缓存的已编译运营日数（不同星期、节假日前一天的末班车延时不同）
+MAX_COMPILED_DAYS = 4
+
+# line_schedule 为各站分方向的首末班车；transfer_schedule 为换乘站的同类数据，两者合并取最宽的运营时段
+SCHEDULE_QUERY = """
+    SELECT line, stat_id, direction, first_time, last_time, last_time_desc FROM line_schedule
+    UNION ALL
+    SELECT line, stat_id, direction, first_time, last_time, last_time_desc FROM transfer_schedule
+"""
+
+FLTIME_QUERY = """
+    SELECT line_id, station_id, to_station_id, first_time, last_time FROM fltime
+"""
+
+PATH_ORDER_QUERY = """
+    SELECT line, path_id, station_order, station_id
+    FROM station_path_order
+    WHERE line IS NOT NULL
+    ORDER BY line, path_id, station_order
+"""
+
+SEGMENT_QUERY = """
+    SELECT from_station, to_station, line_id, travel_time,
+           from_station_travel_group, to_station_travel_group
+    FROM Dijkstra
+"""
+
+
+def _minutes(value):
+    """TIME 列（timedelta / time / 'HH:MM:SS'）转为运营日内的分钟数，过零点的时刻加 24 小时"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, timedelta):
+        total = int(value.total_seconds() // 60)
+    elif isinstance(value, time):
+        total = value.hour * 60 + value.minute
+    else:
+        hour, minute = str(value).split(':')[:2]
+        total = int(hour) * 60 + int(minute)
+    total %= 24 * 60
+    if total < SERVICE_DAY_START:
+        total += 24 * 60
+    return total
+
+
+def service_day(moment):
+    """返回 (运营日日期, 运营日内的分钟数)"""
+    minutes = moment.hour * 60 + moment.minute + (1 if moment.second or moment.microsecond else 0)
+    if minutes < SERVICE_DAY_START:
+        return moment.date() - timedelta(days=1), minutes + 24 * 60
+    return moment.date(), minutes
+
+
+def parse_depart_at(value, now=None):
+    """depart_at 支持 HH:MM[:SS]（当天）或 YYYY-MM-DD[ T]HH:MM[:SS]，缺省为当前时间"""
+    now = now or datetime.now()
+    if not value:
+        return now
+    value = value.strip()
+    if len(value) <= 8:
+        for fmt in ('%H:%M', '%H:%M:%S'):
+            try:
+                return datetime.combine(now.date(), datetime.strptime(value, fmt).time())
+            except ValueError:
+                continue
+        raise ValueError(f"无法解析的时间: {value}")
+    return datetime.fromisoformat(value)
+
+
+def _day_key(service_date, special_dates):
+    """
+    末班车延时规则的取值键：(星期序号, 特殊日期)
+    last_time_desc 中 weekday 数组以周日为 0，dateday 为节假日前一天等按日期的延时
+    """
+    mmdd = service_date.strftime('%m-%d')
+    return service_date.isoweekday() % 7, mmdd if mmdd in special_dates else None
+
+
+def _last_time_adjust(desc, day_key):
+    """解析 last_time_desc，返回该运营日末班车的延时分钟数"""
+    if not desc:
+        return 0
+    try:
+        rule = json.loads(desc)
+    except ValueError:
+        return 0
+    weekday, mmdd = day_key
+    adjust = 0
+    weekdays = rule.get('weekday') or []
+    if weekday < len(weekdays):
+        adjust = int(weekdays[weekday] or 0)
+    for item in rule.get('dateday') or []:
+        if item.get('date') == mmdd:
+            adjust = max(adjust, int(item.get('adjust') or 0))
+    return adjust
+
+
+def _int_view(values):
+    array = np.ascontiguousarray(values, dtype=np.int32)
+    return memoryview(array).cast('B').cast('i')
+
+
+class _Sequence:
+    """某条线路一个方向上连续有区段时间的站点序列，车次沿序列行驶"""
+
+    def __init__(self, line_id, sign, stations, groups, offsets):
+        self.line_id = line_id
+        self.sign = sign          # +1 沿 station_order 递增方向，-1 反向
+        self.stations = stations  # station_id
+        self.groups = groups      # travel_group
+        self.offsets = offsets    # 自序列起点的累计行驶时间
+
+
+class CompiledTimetable:
+    """
+    某个运营日的连接数组（Connection Scan）
+
+    每个连接是一趟车在相邻两站间的一段运行，按出发时间排序后存放在整型数组中，
+    查询时二分定位出发时刻，之后只需一次线性扫描。
+    """
+
+    def __init__(self, sequences, windows, headway):
+        self.sequences = sequences
+        self.windows = windows
+        trips = []  # trip -> (sequence 下标, 起点发车时刻)
+        columns = [[], [], [], [], [], []]  # dep, arr, from_group, to_group, trip, pos
+
+        for seq_index, seq in enumerate(sequences):
+            spans = [windows.get((seq.line_id, station, seq.sign)) for station in seq.stations[:-1]]
+            bounds = [
+                (span[0] - offset, span[1] - offset)
+                for span, offset in zip(spans, seq.offsets) if span is not None
+            ]
+            if not bounds:
+                continue
+            start = min(first for first, _ in bounds)
+            end = max(last for _, last in bounds)
+            for departure in range(start, end + 1, headway):
+                trip = len(trips)
+                used = False
+                for pos, span in enumerate(spans):
+                    dep = departure + seq.offsets[pos]
+                    # 早于首班车或晚于末班车的区段不运营
+                    if span is None or dep < span[0] or dep > span[1]:
+                        continue
+                    columns[0].append(dep)
+                    columns[1].append(departure + seq.offsets[pos + 1])
+                    columns[2].append(seq.groups[pos])
+                    columns[3].append(seq.groups[pos + 1])
+                    columns[4].append(trip)
+                    columns[5].append(pos)
+                    used = True
+                # 没有运营区段的车次不登记，编号留给下一趟
+                if used:
+                    trips.append((seq_index, departure))
+
+        order = np.lexsort((np.array(columns[1]), np.array(columns[0]))) if columns[0] else np.array([], dtype=np.int64)
+        self.departures = _int_view(np.array(columns[0], dtype=np.int32)[order])
+        self.arrivals = _int_view(np.array(columns[1], dtype=np.int32)[order])
+        self.from_groups = _int_view(np.array(columns[2], dtype=np.int32)[order])
+        self.to_groups = _int_view(np.array(columns[3], dtype=np.int32)[order])
+        self.trips_of = _int_view(np.array(columns[4], dtype=np.int32)[order])
+        self.positions = _int_view(np.array(columns[5], dtype=np.int32)[order])
+        self.trips = trips
+        # 出发时刻的列表副本用于 bisect 定位（按分钟计，元素个数即连接数）
+        self._departure_list = self.departures.tolist()
+
+    def __len__(self):
+        return len(self._departure_list)
+
+    def scan(self, start_group, end_group, depart_minutes):
+        """
+        最早到达查询，返回 [(上车连接, 下车连接), ...] 或 None
+        同一趟车上继续乘坐不计换乘时间，换乘其他车次需留出 TRANSFER_TIME
+        """
+        departures, arrivals = self.departures, self.arrivals
+        from_groups, to_groups, trips_of = self.from_groups, self.to_groups, self.trips_of
+
+        earliest = {start_group: depart_minutes}
+        ready = {start_group: depart_minutes}
+        legs = {}
+        boarded = [-1] * len(self.trips)
+        best = float('inf')
+
+        for i in range(bisect_left(self._departure_list, depart_minutes), len(self._departure_list)):
+            dep = departures[i]
+            if dep >= best:
+                break
+            trip = trips_of[i]
+            if boarded[trip] < 0:
+                if ready.get(from_groups[i], float('inf')) > dep:
+                    continue
+                boarded[trip] = i
+            arr = arrivals[i]
+            to_group = to_groups[i]
+            if arr < earliest.get(to_group, float('inf')):
+                earliest[to_group] = arr
+                ready[to_group] = arr + TRANSFER_TIME
+                legs[to_group] = (boarded[trip], i)
+                if to_group == end_group:
+                    best = arr
+
+        if end_group not in legs:
+            return None
+
+        journey = []
+        group = end_group
+        while group != start_group:
+            enter, leave = legs[group]
+            journey.append((enter, leave))
+            group = from_groups[enter]
+        journey.reverse()
+        return journey
+
+
+class TimetablePlanner:
+    """
+    按出发时间规划最早到达路线
+
+    原始时刻表数据加载一次，各运营日（星期 / 节假日前一天的末班车延时不同）按需编译为连接数组并缓存。
+    """
+
+    def __init__(self, sequences, windows, line_windows, special_dates, headway=DEFAULT_HEADWAY):
+        self.sequences = sequences
+        self._base_windows = windows      # (line, station_id, sign) -> [(first, last, last_time_desc), ...]
+        self._line_windows = line_windows  # (line, sign) -> (first, last)，来自 fltime，站点缺少数据时使用
+        self.special_dates = special_dates
+        self.headway = headway
+        self._compiled = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, get_connection, headway=DEFAULT_HEADWAY):
+        conn = None
+        cursor = None
+        try:
+            conn = get_connection()
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute(SCHEDULE_QUERY)
+            schedule = cursor.fetchall()
+            cursor.execute(FLTIME_QUERY)
+            fltime = cursor.fetchall()
+            cursor.execute(PATH_ORDER_QUERY)
+            path_order = cursor.fetchall()
+            cursor.execute(SEGMENT_QUERY)
+            segments = cursor.fetchall()
+        finally:
+            if cursor:
+                cursor.close()
+            if conn:
+                conn.close()
+        return cls.from_rows(schedule, fltime, path_order, segments, headway)
+
+    @classmethod
+    def from_rows(cls, schedule, fltime, path_order, segments, headway=DEFAULT_HEADWAY):
+        # 区段行驶时间与 station_id -> travel_group
+        travel_time = {}
+        group_of = {}
+        for row in segments:
+            key = (row['line_id'], row['from_station'], row['to_station'])
+            travel_time[key] = row['travel_time']
+            travel_time.setdefault((row['line_id'], row['to_station'], row['from_station']), row['travel_time'])
+            group_of[row['from_station']] = row['from_station_travel_group']
+            group_of[row['to_station']] = row['to_station_travel_group']
+
+        paths = defaultdict(list)
+        for row in path_order:
+            paths[(row['line'], row['path_id'])].append(row['station_id'])
+        order_of = {}
+        for (line_id, _), stations in paths.items():
+            for order, station in enumerate(stations):
+                order_of.setdefault((line_id, station), order)
+
+        # direction 字段在不同线路上含义不一，按首班车时刻沿站序的变化判断实际方向
+        trend = defaultdict(int)
+        by_direction = defaultdict(list)
+        for row in schedule:
+            first = _minutes(row['first_time'])
+            order = order_of.get((row['line'], int(row['stat_id'])))
+            if first is not None and order is not None:
+                by_direction[(row['line'], row['direction'])].append((order, first))
+        for key, points in by_direction.items():
+            points.sort()
+            for (_, a), (_, b) in zip(points, points[1:]):
+                trend[key] += (b > a) - (b < a)
+        sign_of = {key: 1 if value >= 0 else -1 for key, value in trend.items()}
+
+        windows = defaultdict(list)
+        special_dates = set()
+        for row in schedule:
+            sign = sign_of.get((row['line'], row['direction']))
+            last = _minutes(row['last_time'])
+            if sign is None or last is None:
+                continue
+            desc = row.get('last_time_desc') or ''
+            if desc:
+                try:
+                    special_dates.update(item.get('date') for item in json.loads(desc).get('dateday') or [])
+                except ValueError:
+                    desc = ''
+            windows[(row['line'], int(row['stat_id']), sign)].append((_minutes(row['first_time']), last, desc))
+
+        line_windows = {}
+        for row in fltime:
+            first, last = _minutes(row['first_time']), _minutes(row['last_time'])
+            a = order_of.get((row['line_id'], row['station_id']))
+            b = order_of.get((row['line_id'], row['to_station_id']))
+            if first is None or last is None or a is None or b is None or a == b:
+                continue
+            key = (row['line_id'], 1 if b > a else -1)
+            if key in line_windows:
+                first = min(first, line_windows[key][0])
+                last = max(last, line_windows[key][1])
+            line_windows[key] = (first, last)
+
+        sequences = []
+        for (line_id, _), stations in sorted(paths.items()):
+            # 环线：首末站之间有区段时闭合
+            if len(stations) > 2 and (line_id, stations[-1], stations[0]) in travel_time \
+                    and sum(1 for key in paths if key[0] == line_id) == 1:
+                stations = stations + [stations[0]]
+            for sign in (1, -1):
+                ordered = stations if sign == 1 else stations[::-1]
+                run = [ordered[0]]
+                for station in ordered[1:]:
+                    if (line_id, run[-1], station) in travel_time and station in group_of and run[-1] in group_of:
+                        run.append(station)
+                        continue
+                    if len(run) > 1:
+                        sequences.append(cls._sequence(line_id, sign, run, group_of, travel_time))
+                    run = [station]
+                if len(run) > 1:
+                    sequences.append(cls._sequence(line_id, sign, run, group_of, travel_time))
+
+        return cls(sequences, dict(windows), line_windows, special_dates, headway)
+
+    @staticmethod
+    def _sequence(line_id, sign, stations, group_of, travel_time):
+        offsets = [0]
+        for a, b in zip(stations, stations[1:]):
+            offsets.append(offsets[-1] + travel_time[(line_id, a, b)])
+        return _Sequence(line_id, sign, stations, [group_of[s] for s in stations], offsets)
+
+    def _windows_for(self, day_key):
+        windows = {}
+        for key, spans in self._base_windows.items():
+            firsts = [first for first, _, _ in spans if first is not None]
+            lasts = [last + _last_time_adjust(desc, day_key) for _, last, desc in spans]
+            fallback = self._line_windows.get((key[0], key[2]))
+            first = min(firsts) if firsts else (fallback[0] if fallback else None)
+            if first is None:
+                continue
+            windows[key] = (first, max(lasts))
+        # 没有分站时刻的站点使用 fltime 中的全线首末班时间
+        for seq in self.sequences:
+            fallback = self._line_windows.get((seq.line_id, seq.sign))
+            if fallback:
+                for station in seq.stations:
+                    windows.setdefault((seq.line_id, station, seq.sign), fallback)
+        return windows
+
+    def compiled(self, service_date):
+        day_key = _day_key(service_date, self.special_dates)
+        with self._lock:
+            timetable = self._compiled.get(day_key)
+            if timetable is not None:
+                self._compiled.move_to_end(day_key)
+                return timetable
+        timetable = CompiledTimetable(self.sequences, self._windows_for(day_key), self.headway)
+        logger.info(f"已编译运营日 {day_key} 的时刻表，共 {len(timetable)} 个连接")
+        with self._lock:
+            self._compiled[day_key] = timetable
+            while len(self._compiled) > MAX_COMPILED_DAYS:
+                self._compiled.popitem(last=False)
+        return timetable
+
+    def earliest_arrival(self, start_group, end_group, depart_at):
+        """
+        返回 {'service_date', 'depart_minutes', 'arrival_minutes', 'legs'}，不可达时返回 None
+        legs 中每项为 {'line_id', 'groups', 'departure', 'arrival', 'last_departure'}；
+        起止站相同时无需乘车，legs 为空、到达时间即出发时间
+        """
+        service_date, minutes = service_day(depart_at)
+        if start_group == end_group:
+            return {'service_date': service_date, 'depart_minutes': minutes, 'arrival_minutes': minutes, 'legs': []}
+        timetable = self.compiled(service_date)
+        journey = timetable.scan(start_group, end_group, minutes)
+        if journey is None:
+            return None
+
+        legs = []
+        for enter, leave in journey:
+            seq_index, departure = timetable.trips[timetable.trips_of[enter]]
+            seq = self.sequences[seq_index]
+            first_pos, last_pos = timetable.positions[enter], timetable.positions[leave]
+            window = timetable.windows.get((seq.line_id, seq.stations[first_pos], seq.sign))
+            legs.append({
+                'line_id': seq.line_id,
+                'groups': seq.groups[first_pos:last_pos + 2],
+                'departure': timetable.departures[enter],
+                'arrival': timetable.arrivals[leave],
+                'last_departure': window[1] if window else None
+            })
+        return {
+            'service_date': service_date,
+            'depart_minutes': minutes,
+            'arrival_minutes': legs[-1]['arrival'] if legs else minutes,
+            'legs': legs
+        }
+
+    def check_route(self, result, depart_at):
+        """
+        按静态最短路线逐段检查首末班车（末班车已过、时刻表无解时使用）
+        返回与 earliest_arrival 相同结构，错过末班车的区段 missed_last_train 为 True
+        """
+        service_date, minutes = service_day(depart_at)
+        timetable = self.compiled(service_date)
+        legs = []
+        current = minutes
+        start = 0
+        for i in range(1, len(result['lines']) + 1):
+            if i < len(result['lines']) and result['lines'][i] == result['lines'][start]:
+                continue
+            line_id = result['lines'][start]
+            groups = result['path'][start:i + 1]
+            if legs:
+                current += TRANSFER_TIME
+            window = self._leg_window(timetable, line_id, groups[0], groups[-1])
+            departure = max(current, window[0]) if window else current
+            arrival = departure + sum(result['times'][start:i])
+            legs.append({
+                'line_id': line_id,
+                'groups': groups,
+                'departure': departure,
+                'arrival': arrival,
+                'last_departure': window[1] if window else None,
+                'missed_last_train': bool(window) and departure > window[1]
+            })
+            current = arrival
+            start = i
+        return {
+            'service_date': service_date,
+            'depart_minutes': minutes,
+            'arrival_minutes': None,
+            'legs': legs
+        }
+
+    def _leg_window(self, timetable, line_id, from_group, to_group):
+        for seq in self.sequences:
+            if seq.line_id != line_id or from_group not in seq.groups or to_group not in seq.groups:
+                continue
+            a, b = seq.groups.index(from_group), seq.groups.index(to_group)
+            if a < b:
+                return timetable.windows.get((line_id, seq.stations[a], seq.sign))
+        return None
+
+
+def _clock(service_date, minutes):
+    if minutes is None:
+        return None
+    return (datetime.combine(service_date, time()) + timedelta(minutes=minutes)).isoformat(timespec='minutes')
+
+
+def format_journey(journey, station_info):
+    """时刻表规划结果转换为接口返回格式"""
+    service_date = journey['service_date']
+    legs = []
+    for leg in journey['legs']:
+        groups = leg['groups']
+        legs.append({
+            'line_id': leg['line_id'],
+            'from_station': station_info.get(groups[0], UNKNOWN_STATION),
+            'to_station': station_info.get(groups[-1], UNKNOWN_STATION),
+            'stations': [station_info.get(group, UNKNOWN_STATION) for group in groups],
+            'departure_time': _clock(service_date, leg['departure']),
+            'arrival_time': _clock(service_date, leg['arrival']),
+            'last_departure': _clock(service_date, leg['last_departure']),
+            'missed_last_train': leg.get('missed_last_train', False)
+        })
+    arrival = journey['arrival_minutes']
+    return {
+        'depart_at': _clock(service_date, journey['depart_minutes']),
+        'arrival_time': _clock(service_date, arrival),
+        'total_time': arrival - journey['depart_minutes'] if arrival is not None else None,
+        'transfer_count': max(len(legs) - 1, 0),
+        'legs': legs
+    }
@@ -0,0 +1,296 @@
+import logging
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+from position_history import DEFAULT_LEARNED_DAYS, DEFAULT_MIN_SAMPLES
+
+logger = logging.getLogger(__name__)
+
+# 检查两张表是否变化的最小间隔（秒）
+DEFAULT_REFRESH_SECONDS = 30
+
+PATH_ORDER_QUERY = """
+    SELECT path_id, station_order, station_id, name_cn
+    FROM station_path_order
+    WHERE path_id IS NOT NULL AND station_order IS NOT NULL AND station_id IS NOT NULL
+    ORDER BY path_id, station_order
+"""
+
+SEGMENT_TIME_QUERY = """
+    SELECT from_station_id, to_station_id, line_id, travel_time
+    FROM station_travel_time
+"""
+
+# 最近几天各区段各小时的运行时间（由位置历史汇总，见 position_history），按样本数加权合并各天的中位数
+LEARNED_TIME_QUERY = """
+    SELECT from_station_id, to_station_id, hour,
+           SUM(median_seconds * samples) / SUM(samples) AS run_seconds
+    FROM segment_run_time
+    WHERE service_date >= %s
+    GROUP BY from_station_id, to_station_id, hour
+    HAVING SUM(samples) >= %s
+"""
+
+# 两张静态表内容变化时校验和随之变化，未变化时不重建
+TABLES_CHECKSUM_QUERY = "CHECKSUM TABLE station_path_order, station_travel_time"
+
+# segment_run_time 逐日增长，CHECKSUM 需要读全表；汇总按整天替换写入，用最新日期与行数即可发现变化
+SEGMENT_RUN_TIME_STATS_QUERY = "SELECT MAX(service_date) AS last_date, COUNT(*) AS row_count FROM segment_run_time"
+
+# 不在任何序列中的站点
+NOT_ON_PATH = -1
+
+
+def _key(path_id, station_id):
+    return (np.asarray(path_id, dtype=np.int64) << 32) | np.asarray(station_id, dtype=np.int64)
+
+
+class _PathTable:
+    """
+    一次加载得到的全部站点序列，各序列首尾相接排成扁平数组，下标在同一序列内随 station_order 递增
+
+    - positions[(path_id, station_id)]  扁平下标
+    - sequence[i]                       第 i 个站点所属序列的编号
+    - up[i] / down[i]                   所在序列从首站累加到第 i 站的上行 / 下行区段时间
+    - hourly_up[h, i] / hourly_down     同上，h 点钟出发的区段有学习到的运行时间时用该时间，没有学习数据时为 None
+    - names[name_cn]                    [(path_id, station_id, 扁平下标), ...]
+    - stations[i]                       第 i 个站点的 (path_id, station_id, name_cn)
+    - starts[q] / ends[q]               第 q 个序列的扁平下标范围 [starts[q], ends[q])
+    """
+
+    def __init__(self, positions, sequence, up, down, names, station_names, hourly_up=None, hourly_down=None):
+        self.positions = positions
+        self.sequence = sequence
+        self.up = up
+        self.down = down
+        self.hourly_up = hourly_up
+        self.hourly_down = hourly_down
+        self.names = names
+        self.stations = [(path_id, station_id, name) for (path_id, station_id), name in zip(positions, station_names)]
+        self.starts = np.flatnonzero(np.r_[True, sequence[1:] != sequence[:-1]]) if len(sequence) else sequence
+        self.ends = np.r_[self.starts[1:], len(sequence)].astype(np.int64)
+        keys = _key([path_id for path_id, _ in positions], [station_id for _, station_id in positions])
+        order = np.argsort(keys)
+        self.keys = keys[order]
+        self.key_positions = np.array(list(positions.values()), dtype=np.int64)[order]
+
+    def lookup(self, path_ids, station_ids):
+        """批量求扁平下标，不在序列中的为 NOT_ON_PATH"""
+        keys = _key(path_ids, station_ids)
+        if not len(self.keys):
+            return np.full(keys.shape, NOT_ON_PATH, dtype=np.int64)
+        found = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        return np.where(self.keys[found] == keys, self.key_positions[found], NOT_ON_PATH)
+
+    def between(self, start, end, hour=None):
+        """
+        扁平下标 start -> end（须在同一序列）的行驶时间（分钟）：end 在后为上行，在前为下行，可传数组；
+        给出 hour 时各区段优先用该小时学习到的运行时间
+        """
+        up, down = self.up, self.down
+        if hour is not None and self.hourly_up is not None:
+            up, down = self.hourly_up[hour], self.hourly_down[hour]
+        return np.where(start < end, up[end] - up[start], down[start] - down[end])
+
+    def span(self, position):
+        """position 所在序列的扁平下标范围 (起, 止)"""
+        sequence_id = self.sequence[position]
+        return int(self.starts[sequence_id]), int(self.ends[sequence_id])
+
+    def line_positions(self, line_id):
+        """某条线路在各 path 上的全部站点，按 path_id、station_order 排列"""
+        return [i for i, (_, station_id, _) in enumerate(self.stations) if station_id // 100 == line_id]
+
+
+class TravelTimeIndex:
+    """
+    station_path_order / station_travel_time 的内存前缀和索引，替代逐区段查询数据库的 calculate_travel_time
+
+    每条 (path_id, 线路) 按 station_order 排成站点序列（线路取 station_id // 100，与 next_trains 的约定一致），
+    并预先累加上行（order 递增）与下行（order 递减）两个方向的区段时间，
+    同一序列上任意两站间的行驶时间为一次减法，批量计算时为一次数组运算。
+    station_travel_time 只记录了上行区段时，下行取同一区段的反向时间。
+
+    segment_run_time 中最近 learned_days 天样本数不少于 min_samples 的区段小时，另按 24 个小时各累加一份，
+    按出发小时查询时这些区段用学习到的运行时间，其余区段仍用 station_travel_time。
+
+    每隔 refresh_seconds 检查这些表（两张静态表用 CHECKSUM TABLE，segment_run_time 比较最新日期与行数），
+    有变化时整体重建；查询只读取一次 table 引用，重建过程中不会读到新旧混合的数据。
+    """
+
+    def __init__(self, get_connection, refresh_seconds=DEFAULT_REFRESH_SECONDS,
+                 learned_days=DEFAULT_LEARNED_DAYS, min_samples=DEFAULT_MIN_SAMPLES):
+        self._get_connection = get_connection
+        self.refresh_seconds = refresh_seconds
+        self.learned_days = learned_days
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+        self.table = self.build([], [])
+        self.checksum = None
+        self.checked_at = None
+
+    def _query(self, sql, params=()):
+        conn = None
+        cursor = None
+        try:
+            conn = self._get_connection()
+            try:
+                cursor = conn.cursor(dictionary=True)
+            except TypeError:
+                # pymysql 连接在创建时已指定 DictCursor
+                cursor = conn.cursor()
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+        finally:
+            if cursor:
+                cursor.close()
+            if conn:
+                conn.close()
+
+    @staticmethod
+    def build(order_rows, segment_rows, learned_rows=()):
+        """由两张表的行（及学习到的区段运行时间）构建站点序列"""
+        segments = {}
+        for row in segment_rows:
+            key = (row['from_station_id'], row['to_station_id'])
+            # 同一区段有多条线路的记录（如 16 号线与大站车）时取本线路的时间
+            if key not in segments or row['line_id'] == row['from_station_id'] // 100:
+                segments[key] = row['travel_time']
+
+        learned = {}  # (from_station_id, to_station_id) -> 24 个小时的分钟数，没有数据的小时为 NaN
+        for row in learned_rows:
+            key = (row['from_station_id'], row['to_station_id'])
+            if key not in learned:
+                learned[key] = np.full(24, np.nan)
+            learned[key][int(row['hour'])] = float(row['run_seconds']) / 60
+
+        def segment_time(from_station_id, to_station_id):
+            travel_time = segments.get((from_station_id, to_station_id))
+            if travel_time is None:
+                travel_time = segments.get((to_station_id, from_station_id), 0)
+            return travel_time
+
+        sequences = {}
+        for row in sorted(order_rows, key=lambda r: (r['path_id'], r['station_order'])):
+            key = (row['path_id'], row['station_id'] // 100)
+            sequences.setdefault(key, []).append(row)
+
+        def hourly_time(from_station_id, to_station_id):
+            # 学习到的时间只用于实际记录到的方向，缺的小时取静态时间
+            hourly = learned.get((from_station_id, to_station_id))
+            static = segment_time(from_station_id, to_station_id)
+            return np.full(24, float(static)) if hourly is None else np.where(np.isnan(hourly), static, hourly)
+
+        positions = {}
+        sequence_ids, up, down = [], [], []
+        hourly_up, hourly_down = [], []
+        names = {}
+        station_names = []
+        for sequence_id, ((path_id, _), rows) in enumerate(sequences.items()):
+            previous = None
+            for row in rows:
+                station_id = row['station_id']
+                if (path_id, station_id) in positions:
+                    continue
+                if previous is None:
+                    up.append(0)
+                    down.append(0)
+                    hourly_up.append(np.zeros(24))
+                    hourly_down.append(np.zeros(24))
+                else:
+                    up.append(up[-1] + segment_time(previous, station_id))
+                    down.append(down[-1] + segment_time(station_id, previous))
+                    hourly_up.append(hourly_up[-1] + hourly_time(previous, station_id))
+                    hourly_down.append(hourly_down[-1] + hourly_time(station_id, previous))
+                position = positions[(path_id, station_id)] = len(sequence_ids)
+                sequence_ids.append(sequence_id)
+                station_names.append(row.get('name_cn'))
+                if row.get('name_cn'):
+                    names.setdefault(row['name_cn'], []).append((path_id, station_id, position))
+                previous = station_id
+
+        return _PathTable(
+            positions,
+            np.array(sequence_ids, dtype=np.int64),
+            np.array(up, dtype=np.int64),
+            np.array(down, dtype=np.int64),
+            names,
+            station_names,
+            np.array(hourly_up).reshape(-1, 24).T.copy() if learned else None,
+            np.array(hourly_down).reshape(-1, 24).T.copy() if learned else None
+        )
+
+    def load(self):
+        """重新加载两张表并替换索引"""
+        self._load(self._checksum())
+
+    def _load(self, checksum):
+        table = self.build(self._query(PATH_ORDER_QUERY), self._query(SEGMENT_TIME_QUERY), self._learned_rows())
+        with self._lock:
+            self.table = table
+            self.checksum = checksum
+            self.checked_at = time.monotonic()
+        logger.info(
+            f"行驶时间索引已加载 {len(table.positions)} 个站点"
+            + ("，使用学习到的区段运行时间" if table.hourly_up is not None else "")
+        )
+
+    def _learned_rows(self):
+        try:
+            return self._query(LEARNED_TIME_QUERY, (date.today() - timedelta(days=self.learned_days), self.min_samples))
+        except Exception as e:
+            # 汇总表不存在或查询失败时只用 station_travel_time
+            logger.error(f"加载学习到的区段运行时间失败: {str(e)}", exc_info=True)
+            return []
+
+    def _segment_run_time_stats(self):
+        try:
+            row = self._query(SEGMENT_RUN_TIME_STATS_QUERY)[0]
+        except Exception:
+            # 未启用位置历史时汇总表不存在
+            return None
+        return row['last_date'], row['row_count']
+
+    def _checksum(self):
+        try:
+            checksums = tuple(row['Checksum'] for row in self._query(TABLES_CHECKSUM_QUERY))
+            return checksums + (self._segment_run_time_stats(),)
+        except Exception as e:
+            # 无法计算校验和时每次检查都重新加载
+            logger.error(f"计算行驶时间表校验和失败: {str(e)}", exc_info=True)
+            return None
+
+    def refresh(self):
+        """到达检查间隔时比较校验和，表有变化则重建；失败时沿用内存中的索引"""
+        if self.checked_at is not None and time.monotonic() - self.checked_at < self.refresh_seconds:
+            return
+        self.checked_at = time.monotonic()
+        try:
+            checksum = self._checksum()
+            if checksum is None or checksum != self.checksum:
+                self._load(checksum)
+        except Exception as e:
+            logger.error(f"刷新行驶时间索引失败: {str(e)}", exc_info=True)
+
+    def current(self):
+        """按需刷新后返回当前快照；同一请求内只取一次，避免中途切换"""
+        self.refresh()
+        return self.table
+
+    def travel_time(self, path_id, from_station_id, to_station_id, at=None):
+        """
+        path_id 上两站之间的行驶时间（分钟），at 时刻（默认当前）从 from_station_id 出发，与原逐区段查询的返回约定相同：
+        同一站为 0；站点不在该 path 的同一线路上、或区段时间全部缺失时为 None
+        """
+        table = self.current()
+        start = table.positions.get((path_id, from_station_id))
+        end = table.positions.get((path_id, to_station_id))
+        if start is None or end is None or table.sequence[start] != table.sequence[end]:
+            return None
+        if start == end:
+            return 0
+        total_time = float(table.between(start, end, (at or datetime.now()).hour))
+        return total_time if total_time else None